@@ -0,0 +1,237 @@
+# -*- coding: Utf-8 -*
+
+from model import *
+from protocol import *
+from network import *
+from engine import *
+import asyncio
+
+################################################################################
+#                       ASYNC NETWORK SERVER CONTROLLER                        #
+################################################################################
+
+### Constants ###
+
+MAX_QUEUE = 2*FPS # max number of pending outgoing writes per client (one per tick)
+
+### Class Client ###
+
+# A connected client, used by the server in place of a socket: it has its own
+# reader task (see AsyncServerController.read_loop), and a writer task that
+# drains a bounded queue, filled with the frames of each tick. Writes are
+# counted in the server `stats`.
+
+class Client:
+
+    def __init__(self, reader, writer, codec, stats):
+        self.reader = reader
+        self.writer = writer
+        self.codec = codec
+        self.stats = stats
+        self.binary = False
+        self.replicated = False
+        self.acked = None
+        self.sent = None
+        self.views = {}
+        self.visible = set()
+        self.center = None
+        peer = writer.get_extra_info("peername")
+        self.uid = str(peer[0]) + ":" + str(peer[1])
+        self.queue = asyncio.Queue(MAX_QUEUE)
+        self.outbox = bytearray() # frames of the current tick
+        self.closed = False
+        self.task = asyncio.ensure_future(self.write_loop())
+
+    # frame of a message, in the format used with this client
+    def frame(self, message):
+        if self.binary: return self.codec.encode(message)
+        return encode(message)
+
+    # queue a message, it will be handed to the writer at the end of the tick
+    def send(self, message):
+        self.outbox += self.frame(message)
+
+    # queue the frames of the tick, return False if the client does not keep up
+    def flush(self):
+        if self.closed or not self.outbox: return True
+        try:
+            self.queue.put_nowait(bytes(self.outbox))
+        except asyncio.QueueFull:
+            return False
+        self.outbox = bytearray()
+        return True
+
+    async def write_loop(self):
+        try:
+            while True:
+                batch = [ await self.queue.get() ]
+                # coalesce everything queued meanwhile into a single write
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                data = b"".join(frame for frame in batch if frame is not None)
+                self.writer.write(data)
+                self.stats.sends += 1
+                self.stats.bytes += len(data)
+                await self.writer.drain()
+                if None in batch: break
+        except ConnectionError:
+            pass
+        self.closed = True
+        self.writer.close()
+
+    # close once the queued frames are written
+    def shutdown(self):
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        if self.closed: return
+        self.closed = True
+        self.task.cancel()
+        self.writer.close()
+
+### Class Channel ###
+
+# Connection to another server, with the interface of Connection used for the
+# handoffs: the frames are kept until the connection is open, then written at
+# each flush. If the server can't be reached, flush fails, and the channel is
+# dropped (see NetworkServerController.flush_channels).
+
+class Channel:
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.writer = None
+        self.outbox = bytearray()
+        self.failed = False
+        self.task = asyncio.ensure_future(self.open())
+
+    async def open(self):
+        try:
+            (_, self.writer) = await asyncio.wait_for(asyncio.open_connection(*self.address), CHANNEL_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            print("TELEPORT ERROR: server {}:{} unreachable...".format(*self.address))
+            self.failed = True
+
+    def send(self, message):
+        self.outbox += encode(message)
+
+    # write the queued frames once connected, return False on error
+    def flush(self):
+        if self.failed or (self.writer is not None and self.writer.is_closing()): return False
+        if self.writer is None or not self.outbox: return True
+        self.writer.write(bytes(self.outbox))
+        self.outbox = bytearray()
+        return True
+
+    def close(self):
+        self.task.cancel()
+        if self.writer is not None: self.writer.close()
+
+### Class AsyncServerController ###
+
+# Same protocol and game logic as NetworkServerController, but with asyncio:
+# each client has its own reader task that feeds an inbox, and the simulation
+# task, the only one to touch the model, handles the inbox at each step.
+
+class AsyncServerController(NetworkServerController):
+
+    def __init__(self, model, port, interest = None):
+        super().__init__(model, port, interest)
+        self.clients = []
+        self.inbox = None # (client, message), message is None on disconnection
+
+    # no selector: the server socket is opened by serve, and the clients have
+    # their own tasks
+    def open_sockets(self, selector):
+        self.selector = None
+
+    # start the server, and run the simulation forever
+    async def serve(self):
+        self.inbox = asyncio.Queue()
+        server = await asyncio.start_server(self.read_loop, '', self.port, backlog = BACKLOG)
+        engine = Engine(self.model, controllers = [self])
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        async with server:
+            while True:
+                now = loop.time()
+                engine.advance((now - last)*1000)
+                last = now
+                await asyncio.sleep(max(0, engine.step - engine.accumulator)/1000)
+
+    # reader task of a client
+    async def read_loop(self, reader, writer):
+        client = Client(reader, writer, BinaryCodec(SERVER_MESSAGES, CLIENT_MESSAGES, self.ids), self.stats)
+        self.clients.append(client)
+        print("A new player has connected.")
+        decoder = FrameDecoder(client.codec)
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                self.stats.recvs += 1
+                if not data: break
+                decoder.feed(data)
+                for message in decoder.frames():
+                    self.inbox.put_nowait((client, message))
+        except ConnectionError:
+            pass
+        self.inbox.put_nowait((client, None))
+
+    # handle the inbox, called by the engine at each step
+    def tick(self, dt):
+        while not self.inbox.empty():
+            (client, message) = self.inbox.get_nowait()
+            if client not in self.clients: continue
+            if message is None:
+                self.disconnect(client)
+            else:
+                print("REC :", message)
+                self.handle_message(client, message)
+
+        # Hand everything queued during this tick to the writers
+        self.update()
+
+        return True
+
+    def uid_from_socket(self, client):
+        return client.uid
+
+    def peer(self, client):
+        return client
+
+    def peers(self):
+        return [ (client, client) for client in self.clients ]
+
+    def send_message(self, message, client):
+        self.broadcast()
+        client.send(message)
+        self.outgoing.add(client)
+        print("SENDING :", message)
+
+    # a client whose queue is full is disconnected
+    def flush(self):
+        self.broadcast()
+        self.flush_channels()
+        for client in self.outgoing:
+            if not client.flush():
+                print(client.uid+" is too slow, disconnecting.")
+                client.close()
+        self.outgoing.clear()
+
+    # connection to another server, opened in the background so that a slow
+    # peer does not hold the other clients back
+    def channel(self, host, port):
+        if (host, port) not in self.channels:
+            self.channels[(host, port)] = Channel(host, port)
+            self.channels[(host, port)].send("PROT "+str(PROTOCOL_VERSION))
+        return self.channels[(host, port)]
+
+    def close_socket(self, client):
+        self.clients.remove(client)
+        self.broadcast()
+        self.outgoing.discard(client)
+        client.flush()
+        client.shutdown()
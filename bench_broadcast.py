@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from network import *
+import contextlib
+import os
+import random
+import socket
+import sys
+import time
+
+################################################################################
+#                           BROADCAST BENCHMARK                                #
+################################################################################
+
+### Constants ###
+
+MAP = "maps/map1"
+PLAYERS = [ 10, 50, 200 ]
+MOVES = 50 # moves per tick
+DROPS = 3 # bomb drops per tick
+TICKS = 100
+
+### Class ImmediateServerController ###
+
+# Server as it was before the broadcasts were batched: each message is framed
+# for each client, and sent right away.
+
+class ImmediateServerController(NetworkServerController):
+
+    def tell_clients(self, message, ignore=[], pos=None):
+        print(message)
+        for (s, connection) in self.peers():
+            if s not in ignore:
+                connection.send(message)
+                self.stats.frames += 1
+                size = len(connection.outbox)
+                connection.flush()
+                self.stats.sends += 1
+                self.stats.bytes += size - len(connection.outbox)
+
+### Functions ###
+
+# read everything the server has sent
+def drain(sockets):
+    for s in sockets:
+        try:
+            while s.recv(RECV_SIZE): pass
+        except BlockingIOError:
+            pass
+
+# time (in us) and traffic of a busy tick, with `players` clients (half of them binary)
+def bench(kind, players, port, ticks = TICKS):
+    model = Model()
+    model.load_map(MAP)
+    server = kind(model, port)
+    sockets = []
+    clients = []
+    for i in range(players):
+        (a, b) = socket.socketpair()
+        b.setblocking(False)
+        server.add_socket(a, ("127.0.0.1", i))
+        if i % 2: server.handle_message(a, "PROT 2")
+        server.handle_message(a, "JOIN bot{}".format(i))
+        sockets.append(a)
+        clients.append(b)
+    server.flush()
+    drain(clients)
+    server.stats.reset()
+    elapsed = 0
+    for _ in range(ticks):
+        start = time.perf_counter()
+        for s in random.sample(sockets, min(MOVES, players)):
+            server.handle_message(s, "MOVE " + str(random.choice(DIRECTIONS)))
+        for s in random.sample(sockets, min(DROPS, players)):
+            server.handle_message(s, "DROP")
+        server.alea_bomb()
+        server.flush()
+        server.stats.ticks += 1
+        elapsed += time.perf_counter() - start
+        drain(clients)
+    result = (elapsed / ticks * 1e6,) + server.stats.per_tick()
+    for s in sockets + clients: s.close()
+    server.listener.close()
+    return result
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    players = [ int(arg) for arg in sys.argv[1:] ] or PLAYERS
+    print("{:<10} {:>8} {:>10} {:>10} {:>12} {:>10}".format("server", "players", "tick (us)", "sends", "bytes", "frames"))
+    port = 7960
+    for count in players:
+        for (name, kind) in [ ("immediate", ImmediateServerController), ("batched", NetworkServerController) ]:
+            # server is verbose, mute it while measuring
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                (elapsed, sends, recvs, size, frames) = bench(kind, count, port)
+            port += 1
+            print("{:<10} {:>8} {:>10.0f} {:>10.0f} {:>12.0f} {:>10.0f}".format(name, count, elapsed, sends, size, frames))
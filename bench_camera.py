@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # no window
+from model import *
+from view import *
+import contextlib
+import random
+import sys
+import time
+import pygame
+
+################################################################################
+#                               CAMERA BENCHMARK                               #
+################################################################################
+
+### Constants ###
+
+FRAMES = 300
+MAP = (1000, 1000)
+LOADS = [ 1000, 10000, 100000 ] # number of characters, bombs and fruits
+MOVES = 1000 # characters that may move at each frame
+STEP = 1000 / FPS
+
+### Class ScanView ###
+
+# View that finds the visible objects by scanning the lists of the model,
+# instead of looking them up in the occupancy indexes of the map
+
+class ScanView(GraphicView):
+
+    def lookup(self, occupancy, x0, y0, x1, y1):
+        m = self.model.map
+        objects = self.model.bombs if occupancy is m.bombs_at else self.model.fruits if occupancy is m.fruits_at else self.model.characters
+        return [ obj for obj in objects if x0 <= obj.pos[X] < x1 and y0 <= obj.pos[Y] < y1 ]
+
+### Functions ###
+
+# render `frames` frames of a game on a large map, while the player walks
+# across it; return the time per frame, and the time spent in layout (in ms)
+def bench(load, scan, frames = FRAMES):
+    random.seed(0)
+    model = Model()
+    model.map.generate(*MAP)
+    model.add_character("player", True, DK, (MAP[X] // 2 - 1, MAP[Y] // 2 - 1))
+    for i in range(load):
+        model.add_character("bot{}".format(i))
+        model.add_bomb(model.map.random())
+        model.add_fruit()
+    view = (ScanView if scan else GraphicView)(model, "bench")
+    layout = view.layout
+    spent = [0]
+    def timed():
+        start = time.perf_counter()
+        scene = layout()
+        spent[0] += time.perf_counter() - start
+        return scene
+    view.layout = timed
+    elapsed = 0
+    for frame in range(frames):
+        # the player walks along the diagonal, the others move randomly
+        model.player.move(DIRECTION_RIGHT if frame % 16 < 8 else DIRECTION_DOWN)
+        for character in random.sample(model.characters, min(MOVES, len(model.characters))):
+            model.move_character(character.nickname, random.choice(DIRECTIONS))
+        start = time.perf_counter()
+        view.tick(STEP)
+        elapsed += time.perf_counter() - start
+    return (elapsed / frames * 1000, spent[0] / frames * 1000)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else FRAMES
+    pygame.display.init()
+    pygame.font.init()
+    print("{:>12} {:>8} {:>6} {:>12} {:>12}".format("map", "objects", "lookup", "frame ms", "layout ms"))
+    for load in LOADS:
+        for scan in [True, False]:
+            # model is verbose, mute it while measuring
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = bench(load, scan, frames)
+            print("{:>12} {:>8} {:>6} {:>12.2f} {:>12.2f}".format("{}x{}".format(*MAP), 3*load, "scan" if scan else "index", *result))
+    pygame.quit()
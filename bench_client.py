@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from network import *
+import contextlib
+import os
+import socket
+import sys
+import threading
+import time
+
+################################################################################
+#                         CLIENT NETWORK I/O BENCHMARK                         #
+################################################################################
+
+### Constants ###
+
+PORT = 7990
+RATES = [ 1000, 10000, 50000 ] # messages per second sent by the server
+RENDER = 10 # time spent drawing each frame (in ms)
+DURATION = 3 # in s
+BURST = 10 # messages sent at once
+STEP = 1000 / FPS
+
+### Class Flooder ###
+
+# Fake server: welcomes the client, then moves another player `rate` times per
+# second, and records when each move is sent.
+
+class Flooder:
+
+    def __init__(self, port, rate):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("localhost", port))
+        self.listener.listen(1)
+        self.rate = rate
+        self.sent = []
+        self.running = True
+
+    def start(self):
+        threading.Thread(target = self.run, daemon = True).start()
+
+    def run(self):
+        (s, addr) = self.listener.accept()
+        s.sendall(encode("WELC 0 50 1 1 " + DEFAULT_MAP) + encode("NEWP bot 50 1 1 1"))
+        data = b"".join(encode("MOVP bot " + str(DIRECTIONS[i % 2])) for i in range(BURST))
+        start = time.perf_counter()
+        while self.running:
+            wait = start + len(self.sent) / self.rate - time.perf_counter()
+            if wait > 0: time.sleep(wait)
+            self.sent += [ time.perf_counter() ] * BURST
+            try:
+                s.sendall(data)
+            except OSError:
+                break
+        s.close()
+
+    def stop(self):
+        self.running = False
+        self.listener.close()
+
+### Class Client ###
+
+# Client controller that records when each move of the other player is handled
+
+class Client(NetworkClientController):
+
+    def move_character(self, message):
+        self.handled.append(time.perf_counter())
+        NetworkClientController.move_character(self, message)
+
+### Functions ###
+
+# run a client that draws frames of RENDER ms for DURATION s; return the moves
+# handled per second, the mean and max latency from the server to the model,
+# the moves left behind at the end, and the max queue depth
+def bench(rate, threaded, port):
+    flooder = Flooder(port, rate)
+    flooder.start()
+    client = Client(Model(), "localhost", port, "me", threaded = threaded)
+    client.handled = []
+    depth = 0
+    start = time.perf_counter()
+    tick = 0
+    while time.perf_counter() - start < DURATION:
+        client.tick(0)
+        depth = max(depth, client.stats.depth)
+        if client.ready: client.model.tick(STEP)
+        time.sleep(RENDER / 1000)
+        tick += 1
+        wait = start + tick*STEP/1000 - time.perf_counter()
+        if wait > 0: time.sleep(wait)
+    handled = client.handled
+    latencies = [ handled[i] - flooder.sent[i] for i in range(len(handled)) ]
+    behind = len(flooder.sent) - len(handled)
+    flooder.stop()
+    client.close()
+    return (len(handled) / DURATION, sum(latencies) / max(1, len(latencies)) * 1000, max(latencies, default = 0) * 1000, behind, depth)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    rates = [ int(arg) for arg in sys.argv[1:] ] or RATES
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8}".format("rate", "client", "handled/s", "mean ms", "max ms", "behind", "depth"))
+    port = PORT
+    for rate in rates:
+        for threaded in [False, True]:
+            # the client is verbose, mute it while measuring
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = bench(rate, threaded, port)
+            port += 1
+            print("{:>8} {:>10} {:>10.0f} {:>10.1f} {:>10.1f} {:>8} {:>8}".format(rate, "thread" if threaded else "polling", *result))
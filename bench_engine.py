@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from engine import *
+import contextlib
+import os
+import random
+import sys
+
+################################################################################
+#                             ENGINE BENCHMARK                                 #
+################################################################################
+
+### Constants ###
+
+TICKS = 600 # 10 seconds of game time
+MAPS = [ "maps/map0", "maps/map1", (101, 101), (501, 501) ]
+LOADS = [ (10, 5, 10), (100, 50, 100), (500, 200, 500) ] # (characters, bombs, fruits)
+SCALING_MAP = (201, 201)
+SCALING = [ 10, 100, 1000, 3000 ] # number of characters, bombs and fruits
+
+### Class Workload ###
+
+# Controller that keeps the population of the model constant: characters move
+# randomly and drop bombs, and dead characters, exploded bombs and eaten fruits
+# are replaced.
+
+class Workload:
+
+    def __init__(self, model, characters, bombs, fruits):
+        self.model = model
+        self.characters = characters
+        self.bombs = bombs
+        self.fruits = fruits
+        self.count = 0
+
+    def populate(self):
+        while len(self.model.characters) < self.characters:
+            self.model.add_character("bot{}".format(self.count))
+            self.count += 1
+        while len(self.model.bombs) < self.bombs:
+            self.model.add_bomb(self.model.map.random())
+        while len(self.model.fruits) < self.fruits:
+            self.model.add_fruit()
+
+    def tick(self, dt):
+        for character in self.model.characters:
+            character.move(random.choice(DIRECTIONS))
+        self.populate()
+
+### Functions ###
+
+def bench(mapname, characters, bombs, fruits, ticks = TICKS):
+    model = Model()
+    if isinstance(mapname, tuple):
+        model.map.generate(*mapname)
+        mapname = "generated"
+    else:
+        model.load_map(mapname)
+    workload = Workload(model, characters, bombs, fruits)
+    workload.populate()
+    engine = Engine(model, controllers = [workload])
+    elapsed = engine.run_steps(ticks)
+    return (mapname, model.map.width, model.map.height, ticks / elapsed)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else TICKS
+    print("{:<12} {:>9} {:>6} {:>6} {:>6} {:>12}".format("map", "size", "chars", "bombs", "fruits", "ticks/s"))
+    for mapname in MAPS:
+        for (characters, bombs, fruits) in LOADS:
+            # model is verbose, mute it while measuring
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = bench(mapname, characters, bombs, fruits, ticks)
+            size = "{}x{}".format(result[1], result[2])
+            print("{:<12} {:>9} {:>6} {:>6} {:>6} {:>12.1f}".format(result[0], size, characters, bombs, fruits, result[3]))
+    # tick cost should grow linearly with the number of entities
+    print()
+    print("{:<12} {:>9} {:>12} {:>12}".format("map", "size", "entities", "us/tick"))
+    for count in SCALING:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = bench(SCALING_MAP, count, count, count, ticks)
+        size = "{}x{}".format(result[1], result[2])
+        print("{:<12} {:>9} {:>12} {:>12.1f}".format(result[0], size, count, 1e6 / result[3]))
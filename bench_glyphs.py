@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # no window
+from model import *
+from view import *
+import contextlib
+import random
+import sys
+import time
+import pygame
+
+################################################################################
+#                             GLYPH CACHE BENCHMARK                            #
+################################################################################
+
+### Constants ###
+
+FRAMES = 300
+WARMUP = 30 # frames rendered before the measures
+MAP = (VIEW_WIDTH - 1, VIEW_HEIGHT - 1) # the whole map fits in the window
+BOMBS = [ 0, 50, 500 ] # active bombs
+CHARACTERS = 4
+STEP = 1000 / FPS
+
+### Class RedrawView ###
+
+# View that redraws every bomb, fruit and character at each frame, not only
+# the ones that have changed
+
+class RedrawView(GraphicView):
+
+    def tick(self, dt):
+        self.scene = {}
+        GraphicView.tick(self, dt)
+
+### Functions ###
+
+# view class that renders its texts with or without the cache
+def view_class(full, cached):
+    base = RedrawView if full else GraphicView
+    if cached: return base
+    class UncachedView(base):
+        def render_text(self, text, antialias, color):
+            return self.font.render(text, antialias, color)
+    return UncachedView
+
+# render `frames` frames with `bombs` bombs on the map; return the time per
+# frame (in ms) and the hit ratio of the cache
+def bench(bombs, full, cached, frames = FRAMES):
+    random.seed(0)
+    model = Model()
+    model.map.generate(*MAP)
+    for i in range(CHARACTERS): model.add_character("bot{}".format(i), i == 0)
+    view = view_class(full, cached)(model, "bench")
+    elapsed = 0
+    for _ in range(frames):
+        # exploded bombs are replaced, so that their countdowns keep changing
+        while len(model.bombs) < bombs: model.add_bomb(model.map.random())
+        for character in model.characters: character.move(random.choice(DIRECTIONS))
+        model.tick(STEP)
+        start = time.perf_counter()
+        view.tick(STEP)
+        elapsed += time.perf_counter() - start
+    lookups = view.glyph_hits + view.glyph_misses
+    return (elapsed / frames * 1000, view.glyph_hits / lookups if lookups else float("nan"))
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else FRAMES
+    pygame.display.init()
+    pygame.font.init()
+    print("{:>6} {:>8} {:>12} {:>12} {:>8}".format("bombs", "view", "no cache ms", "cache ms", "hits"))
+    # fonts and sprites are loaded on the first views
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for cached in [False, True]: bench(BOMBS[-1], True, cached, WARMUP)
+    for bombs in BOMBS:
+        for full in [True, False]:
+            # model is verbose, mute it while measuring
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                (uncached, _) = bench(bombs, full, False, frames)
+                (cached, hits) = bench(bombs, full, True, frames)
+            print("{:>6} {:>8} {:>12.2f} {:>12.2f} {:>8.3f}".format(bombs, "all" if full else "dirty", uncached, cached, hits))
+    pygame.quit()
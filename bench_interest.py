@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from network import *
+from interest import *
+from replication import *
+import contextlib
+import os
+import random
+import socket
+import sys
+
+################################################################################
+#                       INTEREST MANAGEMENT BENCHMARK                          #
+################################################################################
+
+### Constants ###
+
+PORT = 7980
+SIZE = 129 # map size (in tiles)
+PLAYERS = [ 50, 100, 200, 400 ]
+MOVES = 0.2 # probability that a player moves at each tick
+DROPS = 0.002 # probability that a player drops a bomb at each tick
+WARMUP = 60
+TICKS = 300
+STEP = 1000 / FPS
+
+### Functions ###
+
+# bytes available on each socket
+def drain(sockets):
+    size = 0
+    for s in sockets:
+        try:
+            while True:
+                data = s.recv(RECV_SIZE)
+                if not data: break
+                size += len(data)
+        except BlockingIOError:
+            pass
+    return size
+
+# records of the model of a client that differ from what the server shows it
+def errors(server, observer):
+    s = next(s for (s, connection) in server.peers() if server.nicks.get(connection.uid) == observer.nickname)
+    state = server.model.state()
+    center = server.center(s)
+    if center: state = server.interest.view(state, server.interest.index(state), center)
+    mine = observer.model.state()
+    if not observer.replicated:
+        # bombs and fruits are not updated by the events
+        state = { key: values[:4] for (key, values) in state.items() if key[0] == "C" }
+        mine = { key: values[:4] for (key, values) in mine.items() if key[0] == "C" }
+    return len(diff(state, mine))
+
+# play `ticks` ticks with `players` bots (half of them replicated, the others
+# get the events) and two observers; return the bytes per tick and per client
+# of each kind, and the number of wrong records of the observers at the end
+def bench(players, port, interest, ticks = TICKS):
+    model = Model()
+    model.map.generate(SIZE, SIZE)
+    model.mappath = DEFAULT_MAP # not loaded by the bots
+    for _ in range(players // 4): model.add_fruit()
+    server = NetworkServerController(model, port, interest)
+    bots = { False: [], True: [] } # replicated -> [(server socket, bot socket)]
+    for i in range(players):
+        (a, b) = socket.socketpair()
+        b.setblocking(False)
+        server.add_socket(a, ("127.0.0.1", i))
+        replicated = (i % 2 == 1)
+        server.handle_message(a, "PROT " + str(3 if replicated else 2))
+        server.handle_message(a, "JOIN bot{}".format(i))
+        bots[replicated].append((a, b))
+    observers = []
+    for replicated in [False, True]:
+        observer = NetworkClientController(Model(), "localhost", port, "observer{}".format(len(observers)), replicated = replicated, threaded = False)
+        observer.model.map.generate(SIZE, SIZE)
+        observer.maps = MapCache(None) # same generated map, not sent
+        observer.maps.add(observer.model.map)
+        server.tick(0) # accept
+        observer.flush()
+        observers.append(observer)
+
+    traffic = { False: 0, True: 0 }
+    for tick in range(WARMUP + ticks):
+        for (a, b) in bots[False] + bots[True]:
+            if a not in server.save_sock: continue
+            if random.random() < MOVES: server.handle_message(a, "MOVE " + str(random.choice(DIRECTIONS)))
+            if random.random() < DROPS: server.handle_message(a, "DROP")
+        server.tick(0)
+        model.tick(STEP)
+        for observer in observers:
+            observer.tick(0)
+            observer.model.tick(STEP)
+        for (a, b) in bots[True]:
+            server.handle_message(a, "ACKS " + str(server.replicator.seq))
+        for replicated in bots:
+            size = drain([ b for (a, b) in bots[replicated] ])
+            if tick >= WARMUP: traffic[replicated] += size
+    # let the observers catch up
+    for _ in range(2*PERIOD):
+        server.tick(0)
+        for observer in observers: observer.tick(0)
+    wrong = [ errors(server, observer) for observer in observers ]
+    for (a, b) in bots[False] + bots[True]:
+        a.close()
+        b.close()
+    for observer in observers: observer.close()
+    server.listener.close()
+    return [ traffic[replicated] / ticks / len(bots[replicated]) for replicated in [False, True] ] + wrong
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    players = [ int(arg) for arg in sys.argv[1:] ] or PLAYERS
+    print("{:>8} {:>10} {:>12} {:>12} {:>8} {:>8}".format("players", "interest", "event B/t", "state B/t", "wrong e", "wrong s"))
+    port = PORT
+    for count in players:
+        for interest in [ None, InterestManager() ]:
+            # server and clients are verbose, mute them while measuring
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = bench(count, port, interest)
+            port += 1
+            name = "none" if interest is None else "{}x{}".format(2*interest.radius+1, 2*interest.radius+1)
+            print("{:>8} {:>10} {:>12.1f} {:>12.1f} {:>8} {:>8}".format(count, name, *result))
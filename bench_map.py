@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+import random
+import sys
+import time
+
+################################################################################
+#                               MAP BENCHMARK                                  #
+################################################################################
+
+### Constants ###
+
+BOMBS = 100000
+LOOKUPS = 1000000
+MAPS = [ "maps/map0", "maps/map1", (101, 101), (1001, 1001) ]
+SIZES = [ 64, 256, 1024, 4096 ]
+
+### Functions ###
+
+def load(mapname):
+    m = Map()
+    if isinstance(mapname, tuple):
+        m.generate(*mapname)
+        return (m, "generated")
+    m.load(mapname)
+    return (m, mapname)
+
+# throughput (per second) of blast range computations by ray casting (before) and
+# by table lookup (after), and of bomb creations
+def bench_bombs(m, count = BOMBS):
+    positions = [ m.random() for _ in range(count) ]
+    start = time.perf_counter()
+    for pos in positions:
+        m.cast_blast(pos)
+    cast = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for pos in positions:
+        m.blast_range(pos)
+    lookup = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for pos in positions:
+        Bomb(m, pos)
+    bombs = count / (time.perf_counter() - start)
+    return (cast, lookup, bombs)
+
+# memory of the map (in MB), as a flat bytearray and as the former list of lists
+# of one-character strings, and throughput of walkable tile lookups (per second)
+def bench_memory(m, count = LOOKUPS):
+    tiles = sys.getsizeof(m.tiles) / 2**20
+    blast = sys.getsizeof(m.blast) / 2**20
+    array = [ list(row) for row in m.array ]
+    lists = (sys.getsizeof(array) + sum(sys.getsizeof(row) for row in array)) / 2**20
+    positions = [ (random.randrange(m.width), random.randrange(m.height)) for _ in range(count) ]
+    start = time.perf_counter()
+    for (x, y) in positions:
+        array[y][x] not in WALLS
+    before = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for (x, y) in positions:
+        m.walkable(x, y)
+    after = count / (time.perf_counter() - start)
+    return (tiles, blast, lists, before, after)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else BOMBS
+    print("{:<12} {:>11} {:>12} {:>12} {:>12} {:>12}".format("map", "size", "table (ms)", "cast/s", "lookup/s", "bombs/s"))
+    for mapname in MAPS:
+        (m, name) = load(mapname)
+        start = time.perf_counter()
+        m.build_blast()
+        build = (time.perf_counter() - start) * 1000
+        (cast, lookup, bombs) = bench_bombs(m, count)
+        size = "{}x{}".format(m.width, m.height)
+        print("{:<12} {:>11} {:>12.1f} {:>12.0f} {:>12.0f} {:>12.0f}".format(name, size, build, cast, lookup, bombs))
+    print()
+    print("{:>11} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12}".format("size", "load (ms)", "grid (MB)", "blast (MB)", "lists (MB)", "lists/s", "walkable/s"))
+    for size in SIZES:
+        m = Map()
+        start = time.perf_counter()
+        m.generate(size, size)
+        build = (time.perf_counter() - start) * 1000
+        (tiles, blast, lists, before, after) = bench_memory(m)
+        print("{:>11} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.0f} {:>12.0f}".format("{}x{}".format(size, size), build, tiles, blast, lists, before, after))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from network import *
+from mapcache import *
+import contextlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+################################################################################
+#                               MAP CACHE BENCHMARK                            #
+################################################################################
+
+### Constants ###
+
+PORT = 7985
+MAPS = [ "maps/map0", "maps/map1" ]
+SIZES = [ 256, 1024 ] # sizes of the random maps
+WALLS_RATE = 0.2 # probability of a wall inside the random maps
+RUNS = 10 # joins per map and per mode
+MISSING = "maps/missing" # path of a map the client doesn't have
+
+### Functions ###
+
+# random map of size `size`x`size`, with walls around
+def random_map(size):
+    rows = [ "x" * size ]
+    for _ in range(size - 2):
+        rows.append("x" + "".join(random.choice(WALLS) if random.random() < WALLS_RATE else random.choice(BACKGROUNDS) for _ in range(size - 2)) + "x")
+    rows.append("x" * size)
+    return "\n".join(rows) + "\n"
+
+# median time of `runs` calls of `function` (in ms)
+def timing(function, runs = RUNS):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+# join a server with a new client using a given map cache, return the time
+# until the client is ready (in ms)
+def join(server, cache):
+    start = time.perf_counter()
+    client = NetworkClientController(Model(), "localhost", server.port, "bench", threaded = False)
+    client.maps = cache
+    while not client.ready:
+        server.tick(0)
+        client.tick(0)
+    elapsed = (time.perf_counter() - start) * 1000
+    client.close()
+    server.tick(0) # disconnect
+    return elapsed
+
+# join times when the client parses the file of the map, has it neither on
+# disk nor in memory (transfer), only on disk, and in memory (in ms)
+def bench_joins(path, port):
+    model = Model()
+    model.load_map(path)
+    server = NetworkServerController(model, port)
+    server.alea_bomb = lambda: None
+    times = {}
+    with tempfile.TemporaryDirectory() as directory:
+        times["file"] = statistics.median(join(server, MapCache(None)) for _ in range(RUNS))
+        model.mappath = MISSING
+        times["transfer"] = statistics.median(join(server, MapCache(None)) for _ in range(RUNS))
+        join(server, MapCache(directory))
+        times["disk"] = statistics.median(join(server, MapCache(directory)) for _ in range(RUNS))
+        cache = MapCache(directory)
+        times["memory"] = statistics.median(join(server, cache) for _ in range(RUNS))
+    server.listener.close()
+    return times
+
+def bench(path, port):
+    m = Map()
+    m.load(path)
+    digest = m.digest()
+    transfer = sum(len(message) for message in map_messages(m))
+    parse = timing(lambda: Map().load(path))
+    with tempfile.TemporaryDirectory() as directory:
+        MapCache(directory).save(m)
+        disk = timing(lambda: MapCache(directory).find(digest, MISSING))
+    cache = MapCache(None)
+    cache.add(m)
+    memory = timing(lambda: cache.find(digest, MISSING))
+    joins = bench_joins(path, port)
+    return (m, os.path.getsize(path), transfer, parse, disk, memory, joins)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    if len(sys.argv) > 1: RUNS = int(sys.argv[1])
+    print("{:>11} {:>10} {:>10} | {:>9} {:>9} {:>9} | {:>9} {:>9} {:>9} {:>9}".format("map", "file B", "sent B", "parse ms", "disk ms", "mem ms",
+          "join file", "transfer", "disk", "memory"))
+    with tempfile.TemporaryDirectory() as directory:
+        paths = list(MAPS)
+        for size in SIZES:
+            path = os.path.join(directory, "random{}".format(size))
+            with open(path, "w") as _file:
+                _file.write(random_map(size))
+            paths.append(path)
+        for (i, path) in enumerate(paths):
+            # clients and servers are verbose, mute them
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                (m, size, transfer, parse, disk, memory, joins) = bench(path, PORT + i)
+            print("{:>11} {:>10} {:>10} | {:>9.3f} {:>9.3f} {:>9.4f} | {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format("{}x{}".format(m.width, m.height), size, transfer,
+                  parse, disk, memory, joins["file"], joins["transfer"], joins["disk"], joins["memory"]))
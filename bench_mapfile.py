@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from mapgen import *
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+################################################################################
+#                               MAP FILE BENCHMARK                             #
+################################################################################
+
+### Constants ###
+
+SIZES = [ 64, 256, 1024, 4096, 8192 ]
+SEED = 0
+REGION = (32, 24) # tiles shown by the view
+BOMBS = 50 # bombs dropped in the region
+
+### Functions ###
+
+# resident memory of this process, and its peak (in kB)
+def rss():
+    memory = {}
+    with open("/proc/self/status") as _file:
+        for line in _file:
+            if line.startswith("VmRSS:") or line.startswith("VmHWM:"): memory[line.split(":")[0]] = int(line.split()[1])
+    return (memory["VmRSS"], memory["VmHWM"])
+
+# load a map in a fresh process, then look at a region and drop bombs in it;
+# return the load time, the time for the region (in ms), the resident memory
+# after the load and after the region, and its peak (in MB)
+def load(filename, results):
+    random.seed(SEED)
+    (before, _) = rss()
+    start = time.perf_counter()
+    m = open_map(filename)
+    loaded = (time.perf_counter() - start) * 1000
+    (after, _) = rss()
+    start = time.perf_counter()
+    x = random.randrange(m.width - REGION[X] + 1) if m.width > REGION[X] else 0
+    y = random.randrange(m.height - REGION[Y] + 1) if m.height > REGION[Y] else 0
+    m.page_in(x, y, x + REGION[X], y + REGION[Y])
+    for _ in range(BOMBS):
+        pos = (x + random.randrange(min(REGION[X], m.width)), y + random.randrange(min(REGION[Y], m.height)))
+        if m.passable(*pos): m.blast_range(pos)
+    region = (time.perf_counter() - start) * 1000
+    (played, peak) = rss()
+    results.put((loaded, region, (after - before) / 1024, (played - before) / 1024, (peak - before) / 1024))
+
+def bench(filename):
+    # spawned, so that the memory of each load is measured apart
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target = load, args = (filename, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    sizes = [ int(arg) for arg in sys.argv[1:] ] or SIZES
+    print("{:>11} {:<8} {:>8} {:>9} {:>11} {:>10} {:>10} {:>10} {:>10}".format("map", "format", "file MB", "write s",
+          "load ms", "region ms", "RSS MB", "+region", "peak MB"))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for chunked in [ False, True ]:
+                filename = os.path.join(directory, "map{}{}".format(size, ".chunked" if chunked else ""))
+                start = time.perf_counter()
+                write_map(filename, size, size, SEED, chunked = chunked)
+                written = time.perf_counter() - start
+                (loaded, region, memory, played, peak) = bench(filename)
+                print("{:>11} {:<8} {:>8.2f} {:>9.2f} {:>11.2f} {:>10.2f} {:>10.1f} {:>10.1f} {:>10.1f}".format("{}x{}".format(size, size),
+                      "chunked" if chunked else "text", os.path.getsize(filename) / 2**20, written, loaded, region, memory, played, peak))
+                os.remove(filename)
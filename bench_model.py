@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from network import *
+import contextlib
+import os
+import random
+import socket
+import sys
+import time
+
+################################################################################
+#                         MESSAGE HANDLING BENCHMARK                           #
+################################################################################
+
+### Constants ###
+
+MESSAGES = 2000
+PLAYERS = [ 10, 100, 1000, 5000 ]
+
+### Class Peer ###
+
+# connected socket look-alike, that swallows everything sent to it (it has a
+# real, unconnected socket to be registered by the server)
+
+class Peer:
+
+    def __init__(self, port):
+        self.port = port
+        self.sock = socket.socket()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def setblocking(self, flag):
+        pass
+
+    def send(self, data):
+        return len(data)
+
+    def close(self):
+        self.sock.close()
+
+### Functions ###
+
+# cost (in us) of a MOVE or DROP handled by the model, and by the server
+# (including the broadcast to all the other players)
+def bench(players, count = MESSAGES):
+    model = Model()
+    model.load_map("maps/map1")
+    server = NetworkServerController(model, 0)
+    peers = [ Peer(port) for port in range(players) ]
+    for peer in peers:
+        server.add_socket(peer, ("127.0.0.1", peer.port))
+        server.changeNickname(peer, "JOIN p{}".format(peer.port))
+    targets = [ random.choice(peers) for _ in range(count) ]
+    start = time.perf_counter()
+    for peer in targets:
+        model.move_character("p{}".format(peer.port), random.choice(DIRECTIONS))
+        model.drop_bomb("p{}".format(peer.port))
+    local = (time.perf_counter() - start) * 1e6 / (2*count)
+    start = time.perf_counter()
+    for peer in targets:
+        server.moveCharacter(peer, "MOVE {}".format(random.choice(DIRECTIONS)))
+        server.dropBomb(peer)
+        server.flush()
+    remote = (time.perf_counter() - start) * 1e6 / (2*count)
+    for peer in peers: server.close_socket(peer)
+    server.listener.close()
+    return (local, remote)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGES
+    print("{:>8} {:>12} {:>12}".format("players", "model (us)", "server (us)"))
+    for players in PLAYERS:
+        # model and server are verbose, mute them while measuring
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            (local, remote) = bench(players, count)
+        print("{:>8} {:>12.1f} {:>12.1f}".format(players, local, remote))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from network import *
+from engine import *
+import asyncio
+import contextlib
+import os
+import random
+import threading
+import time
+
+################################################################################
+#                        PREDICTION TEST HARNESS                               #
+################################################################################
+
+### Constants ###
+
+MAP = "maps/map1"
+PORT = 8000
+LATENCIES = [ 0, 50, 150 ] # one way (in ms)
+LOSSES = [ 0, 0.05, 0.2 ] # probability that a move is lost
+CLIENTS = 2 # of each kind
+KINDS = [ { "prediction": True }, { "prediction": False }, { "prediction": False, "replicated": False } ]
+RATE = 8 # moves per second and per client
+DURATION = 3 # in s
+SETTLE = 2 # time to wait after the last move (in s)
+STEP = 1000 / FPS
+
+### Class Proxy ###
+
+# Local TCP proxy between the clients and the server: everything is delayed by
+# `latency` ms in each direction, and the moves sent by the clients are lost
+# with probability `loss` (the other messages are kept, the stream is
+# re-framed as text).
+
+class Proxy:
+
+    def __init__(self, port, target, latency, loss):
+        self.port = port
+        self.target = target
+        self.latency = latency
+        self.loss = loss
+        self.lost = 0
+        self.loop = None
+
+    # run the proxy in a thread
+    def start(self):
+        ready = threading.Event()
+        def run():
+            self.loop = asyncio.new_event_loop()
+            server = self.loop.run_until_complete(asyncio.start_server(self.handle, "localhost", self.port))
+            ready.set()
+            self.loop.run_forever()
+            server.close()
+        threading.Thread(target = run, daemon = True).start()
+        ready.wait()
+
+    def stop(self):
+        def shutdown():
+            for task in asyncio.all_tasks(self.loop): task.cancel()
+            self.loop.call_soon(self.loop.stop)
+        self.loop.call_soon_threadsafe(shutdown)
+
+    async def handle(self, reader, writer):
+        (upstream_reader, upstream_writer) = await asyncio.open_connection("localhost", self.target)
+        decoder = FrameDecoder(BinaryCodec(SERVER_MESSAGES, CLIENT_MESSAGES))
+        asyncio.ensure_future(self.pipe(reader, upstream_writer, decoder))
+        asyncio.ensure_future(self.pipe(upstream_reader, writer, None))
+
+    async def pipe(self, reader, writer, decoder):
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await reader.read(RECV_SIZE)
+            if not data: break
+            if decoder:
+                decoder.feed(data)
+                data = b""
+                for message in decoder.frames():
+                    if message.startswith("MOV") and random.random() < self.loss:
+                        self.lost += 1
+                        continue
+                    data += encode(message[:-1])
+            # the delay is the same for all the chunks, so they stay in order
+            if data: loop.call_later(self.latency / 1000, writer.write, data)
+        loop.call_later(self.latency / 1000, writer.close)
+
+### Class Client ###
+
+# Client controller that records when each numbered move is sent and
+# confirmed, and counts the corrections of its position by the states when
+# it does not predict its moves
+
+class Client(NetworkClientController):
+
+    def receive_state(self, message):
+        character = self.model.look(self.nickname)
+        before = character.pos if character else None
+        NetworkClientController.receive_state(self, message)
+        character = self.model.look(self.nickname)
+        if not self.prediction and character and before and character.pos != before: self.corrections += 1
+
+    def keyboard_move_character(self, direction):
+        NetworkClientController.keyboard_move_character(self, direction)
+        if self.prediction: self.sent[self.input] = time.perf_counter()
+        return True
+
+    def confirm_move(self, message):
+        seq = int(message.split(" ")[1])
+        if seq in self.sent: self.delays.append(time.perf_counter() - self.sent.pop(seq))
+        NetworkClientController.confirm_move(self, message)
+
+### Functions ###
+
+# distance (in tiles) between a client character and the server one
+def divergence(server, client):
+    mine = client.model.look(client.nickname)
+    theirs = server.look(client.nickname)
+    if mine is None or theirs is None: return float("nan")
+    return abs(mine.pos[X] - theirs.pos[X]) + abs(mine.pos[Y] - theirs.pos[Y])
+
+# play with CLIENTS clients of each kind (with prediction, with the state only,
+# with the events only) behind a proxy; return for each kind the mean
+# divergence at the end and the number of corrections, and the mean delay until
+# a move is confirmed (in ms)
+def bench(latency, loss, port):
+    model = Model()
+    model.load_map(MAP)
+    server = NetworkServerController(model, port)
+    engine = Engine(model, controllers = [server])
+    threading.Thread(target = engine.run, daemon = True).start()
+    proxy = Proxy(port + 100, port, latency, loss)
+    proxy.start()
+    clients = []
+    for i in range(len(KINDS)*CLIENTS):
+        client = Client(Model(), "localhost", port + 100, "c{}".format(i), **KINDS[i // CLIENTS])
+        client.sent = {}
+        client.delays = []
+        clients.append(client)
+    start = time.perf_counter()
+    tick = 0
+    while time.perf_counter() - start < DURATION + SETTLE:
+        moving = time.perf_counter() - start < DURATION
+        for client in clients:
+            if client.ready and moving and random.random() < RATE / FPS:
+                client.keyboard_move_character(random.choice(DIRECTIONS))
+            client.tick(0)
+            if client.ready: client.model.tick(STEP)
+        tick += 1
+        wait = start + tick*STEP/1000 - time.perf_counter()
+        if wait > 0: time.sleep(wait)
+    results = []
+    for i in range(len(KINDS)):
+        kind = clients[i*CLIENTS:(i+1)*CLIENTS]
+        results.append(sum(divergence(model, client) for client in kind) / len(kind))
+        results.append(sum(client.corrections for client in kind))
+    delays = [ delay for client in clients for delay in client.delays ]
+    results.append(sum(delays) / len(delays) * 1000 if delays else float("nan"))
+    engine.stop()
+    proxy.stop()
+    for client in clients: client.close()
+    time.sleep(0.1)
+    server.listener.close()
+    return results
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    print("{:>8} {:>6} | {:^21} | {:^21} | {:^21} | {:>8}".format("latency", "loss", "prediction", "state only", "events only", "confirm"))
+    print("{:>8} {:>6} | {:>10} {:>10} | {:>10} {:>10} | {:>10} {:>10} | {:>8}".format("(ms)", "", "diverg.", "correct.", "diverg.", "correct.", "diverg.", "correct.", "(ms)"))
+    port = PORT
+    for latency in LATENCIES:
+        for loss in LOSSES:
+            # server and clients are verbose, mute them while measuring
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = bench(latency, loss, port)
+            port += 1
+            print("{:>8} {:>6.2f} | {:>10.2f} {:>10} | {:>10.2f} {:>10} | {:>10.2f} {:>10} | {:>8.0f}".format(latency, loss, *result))
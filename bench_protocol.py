@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from protocol import *
+import random
+import socket
+import sys
+import time
+
+################################################################################
+#                           PROTOCOL BENCHMARK                                 #
+################################################################################
+
+### Constants ###
+
+MESSAGES = 100000
+FUZZ_ROUNDS = 200
+CHUNKS = [ 1, 7, 64, 4096, 65536 ] # size of the pieces the stream is split into
+ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789 \n" + "éàç€"
+PLAYERS = [ 2, 10, 50 ]
+MOVES = 5 # moves per second and per player (keyboard repeat)
+DROPS = 0.1 # bomb drops per second and per player
+SERVDROPS = 0.6 # random bombs per second
+
+### Functions ###
+
+def random_message():
+    kind = random.choice(["MOVP", "DROP", "NEWP", "SERVDROP", "QUIT"])
+    return kind + " " + "".join(random.choice(ALPHABET) for _ in range(random.randint(0, 40)))
+
+# split `data` into pieces of random sizes, up to `size` bytes
+def split(data, size):
+    pieces = []
+    pos = 0
+    while pos < len(data):
+        n = random.randint(1, size)
+        pieces.append(data[pos:pos+n])
+        pos += n
+    return pieces
+
+# feed fragmented and coalesced streams, with garbage between frames, and
+# check that every message is decoded once and in order
+def fuzz(rounds = FUZZ_ROUNDS):
+    for _ in range(rounds):
+        messages = [ random_message() for _ in range(random.randint(1, 200)) ]
+        stream = b""
+        for message in messages:
+            if random.random() < 0.05: stream += b"noise"
+            stream += encode(message)
+        decoder = FrameDecoder()
+        decoded = []
+        for piece in split(stream, random.choice(CHUNKS)):
+            decoder.feed(piece)
+            decoded += decoder.frames()
+        assert decoded == [ message + "\n" for message in messages ], "fuzz: decoded messages differ"
+        assert len(decoder.buffer) < HEADER_SIZE, "fuzz: data left in buffer"
+
+def random_nickname():
+    return "".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(3, 12)))
+
+# random server message, in text
+def random_server_message(nicknames):
+    name = random.choice(list(SERVER_MESSAGES))
+    args = [name]
+    for field in SERVER_MESSAGES[name][1]:
+        if field in "pP": args.append(random.choice(nicknames))
+        elif field == 's': args.append(random_nickname())
+        elif field == 'h': args.append(str(random.randint(-100, 100)))
+        else: args.append(str(random.randint(0, 255)))
+    return " ".join(args)
+
+# feed mixed text and binary streams, and check that the binary messages are
+# decoded into the same text messages
+def fuzz_binary(rounds = FUZZ_ROUNDS):
+    for _ in range(rounds):
+        server = BinaryCodec(SERVER_MESSAGES, CLIENT_MESSAGES)
+        nicknames = [ random_nickname() for _ in range(random.randint(1, 20)) ]
+        # players are introduced in binary, so that the client learns their ids
+        messages = [ "NEWP {} 50 0 1 1".format(nickname) for nickname in nicknames ]
+        stream = b"".join(server.encode(message) for message in messages)
+        others = [ random_server_message(nicknames) for _ in range(random.randint(1, 200)) ]
+        stream += b"".join(server.encode(message) if random.random() < 0.8 else encode(message) for message in others)
+        messages += others
+        decoder = FrameDecoder(BinaryCodec(CLIENT_MESSAGES, SERVER_MESSAGES))
+        decoded = []
+        for piece in split(stream, random.choice(CHUNKS)):
+            decoder.feed(piece)
+            decoded += decoder.frames()
+        assert [ message.split() for message in decoded ] == [ message.split() for message in messages ], "fuzz: binary messages differ"
+
+# messages received by a client during `seconds` s of a game with `players` players
+def game_messages(players, seconds = 60):
+    nicknames = [ random_nickname() for _ in range(players) ]
+    messages = [ "WELC 1 50 3 3 maps/map0 ac036c0085292ef90b445c6b75b82c19" ]
+    messages += [ "NEWP {} 50 1 3 3".format(nickname) for nickname in nicknames[1:] ]
+    for _ in range(seconds):
+        for nickname in nicknames[1:]:
+            messages += [ "MOVP {} {}".format(nickname, random.choice(DIRECTIONS)) for _ in range(MOVES) ]
+            if random.random() < DROPS: messages.append("DROP " + nickname)
+        if random.random() < SERVDROPS: messages.append("SERVDROP 5 7")
+    return messages
+
+# encoding and decoding throughput (in messages/s) of the text and binary formats
+def bench_codec(messages):
+    server = BinaryCodec(SERVER_MESSAGES, CLIENT_MESSAGES)
+    decoder = FrameDecoder(BinaryCodec(CLIENT_MESSAGES, SERVER_MESSAGES))
+    results = []
+    for codec in [ encode, server.encode ]:
+        start = time.perf_counter()
+        stream = b"".join(codec(message) for message in messages)
+        encoding = len(messages) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        decoder.feed(stream)
+        decoder.frames()
+        decoding = len(messages) / (time.perf_counter() - start)
+        results.append((encoding, decoding))
+    return results
+
+# decoding throughput (in messages/s and MB/s) for a stream split into `size` byte pieces
+def bench_decode(messages, size):
+    stream = b"".join(encode(message) for message in messages)
+    pieces = [ stream[pos:pos+size] for pos in range(0, len(stream), size) ]
+    decoder = FrameDecoder()
+    count = 0
+    start = time.perf_counter()
+    for piece in pieces:
+        decoder.feed(piece)
+        count += len(decoder.frames())
+    elapsed = time.perf_counter() - start
+    assert count == len(messages)
+    return (count / elapsed, len(stream) / elapsed / 2**20)
+
+# throughput (in messages/s) through a socket pair, with one send per batch of messages
+def bench_socket(messages, batch = 50):
+    (a, b) = socket.socketpair()
+    sender = Connection(a)
+    receiver = Connection(b)
+    count = 0
+    start = time.perf_counter()
+    for i in range(0, len(messages), batch):
+        for message in messages[i:i+batch]:
+            sender.send(message)
+        while sender.outbox:
+            sender.flush()
+            count += len(receiver.receive())
+    while count < len(messages):
+        count += len(receiver.receive())
+    elapsed = time.perf_counter() - start
+    sender.close()
+    receiver.close()
+    return count / elapsed
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGES
+    fuzz()
+    print("fuzz: {} rounds ok".format(FUZZ_ROUNDS))
+    messages = [ random_message() for _ in range(count) ]
+    start = time.perf_counter()
+    for message in messages: encode(message)
+    print("encode: {:.0f} messages/s".format(count / (time.perf_counter() - start)))
+    print("{:>8} {:>14} {:>10}".format("chunk", "messages/s", "MB/s"))
+    for size in CHUNKS:
+        (rate, mbps) = bench_decode(messages, size)
+        print("{:>8} {:>14.0f} {:>10.1f}".format(size, rate, mbps))
+    print("socket pair: {:.0f} messages/s".format(bench_socket(messages)))
+    fuzz_binary()
+    print("binary fuzz: {} rounds ok".format(FUZZ_ROUNDS))
+    messages = game_messages(50)
+    (text, binary) = bench_codec(messages)
+    print("{:<8} {:>14} {:>14}".format("format", "encode/s", "decode/s"))
+    print("{:<8} {:>14.0f} {:>14.0f}".format("text", *text))
+    print("{:<8} {:>14.0f} {:>14.0f}".format("binary", *binary))
+    # bytes sent by the server during a game minute
+    print("{:>8} {:>16} {:>16} {:>7}".format("players", "text (KB/min)", "binary (KB/min)", "ratio"))
+    for players in PLAYERS:
+        messages = game_messages(players)
+        server = BinaryCodec(SERVER_MESSAGES, CLIENT_MESSAGES)
+        text = sum(len(encode(message)) for message in messages) * players / 2**10
+        binary = sum(len(server.encode(message)) for message in messages) * players / 2**10
+        print("{:>8} {:>16.1f} {:>16.1f} {:>7.2f}".format(players, text, binary, binary / text))
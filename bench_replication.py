@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from network import *
+from replication import *
+import contextlib
+import os
+import random
+import socket
+import sys
+import time
+
+################################################################################
+#                          REPLICATION BENCHMARK                               #
+################################################################################
+
+### Constants ###
+
+MAP = "maps/map1"
+PORT = 7970
+PLAYERS = [ 10, 50, 200 ]
+FRUITS = 20
+MOVES = 0.2 # probability that a player moves at each tick
+DROPS = 0.005 # probability that a player drops a bomb at each tick
+WARMUP = 300 # ticks before the observers join
+TICKS = 600
+STEP = 1000 / FPS
+
+### Functions ###
+
+# bytes available on each socket
+def drain(sockets):
+    size = 0
+    for s in sockets:
+        try:
+            while True:
+                data = s.recv(RECV_SIZE)
+                if not data: break
+                size += len(data)
+        except BlockingIOError:
+            pass
+    return size
+
+# run a game with `players` bots (half of them replicated), then two observers,
+# a legacy one and a replicated one, join; return the bytes they get when
+# joining, the bytes per tick and per bot, the cost of replicate() and the
+# number of records where the observers differ from the server at the end
+def bench(players, port, ticks = TICKS):
+    model = Model()
+    model.load_map(MAP)
+    for _ in range(FRUITS): model.add_fruit()
+    server = NetworkServerController(model, port)
+    bots = { False: [], True: [] } # replicated -> [(server socket, bot socket)]
+    for i in range(players):
+        (a, b) = socket.socketpair()
+        b.setblocking(False)
+        server.add_socket(a, ("127.0.0.1", i))
+        replicated = (i % 2 == 1)
+        server.handle_message(a, "PROT " + str(3 if replicated else 2))
+        server.handle_message(a, "JOIN bot{}".format(i))
+        bots[replicated].append((a, b))
+    # acknowledge every state at once
+    def acknowledge():
+        for (a, b) in bots[True]:
+            server.handle_message(a, "ACKS " + str(server.replicator.seq))
+
+    def step(clients = ()):
+        for (a, b) in bots[False] + bots[True]:
+            if a not in server.save_sock: continue
+            if random.random() < MOVES: server.handle_message(a, "MOVE " + str(random.choice(DIRECTIONS)))
+            if random.random() < DROPS: server.handle_message(a, "DROP")
+        start = time.perf_counter()
+        server.replicate()
+        elapsed = time.perf_counter() - start
+        server.tick(0)
+        model.tick(STEP)
+        for client in clients:
+            client.tick(0)
+            client.model.tick(STEP)
+        acknowledge()
+        return elapsed
+
+    for _ in range(WARMUP): step()
+    for replicated in bots: drain([ b for (a, b) in bots[replicated] ])
+
+    # observers join, the bytes they receive until they have caught up are counted
+    observers = []
+    for replicated in [False, True]:
+        observer = NetworkClientController(Model(), "localhost", port, "observer{}".format(len(observers)), replicated = replicated, threaded = False)
+        server.tick(0) # accept
+        observer.flush()
+        server.tick(0) # join
+        while observer.tick(0): pass
+        observers.append(observer)
+    joins = [ observer.connection.received for observer in observers ]
+    for replicated in bots: drain([ b for (a, b) in bots[replicated] ])
+
+    elapsed = 0
+    traffic = { False: 0, True: 0 }
+    for _ in range(ticks):
+        elapsed += step(observers)
+        for replicated in bots: traffic[replicated] += drain([ b for (a, b) in bots[replicated] ])
+    for observer in observers: observer.tick(0)
+    state = model.state()
+    drift = [ len(diff(state, observer.model.state())) for observer in observers ]
+    bandwidth = [ traffic[replicated] / ticks / max(1, len(bots[replicated])) for replicated in [False, True] ]
+    for (a, b) in bots[False] + bots[True]:
+        a.close()
+        b.close()
+    server.listener.close()
+    return joins + bandwidth + [elapsed / ticks * 1e6] + drift
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    players = [ int(arg) for arg in sys.argv[1:] ] or PLAYERS
+    print("{:>8} {:>12} {:>12} {:>12} {:>12} {:>12} {:>8} {:>8}".format("players", "join event", "join state", "event B/t", "state B/t", "replic. us", "drift e", "drift s"))
+    port = PORT
+    for count in players:
+        # server and clients are verbose, mute them while measuring
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = bench(count, port)
+        port += 1
+        print("{:>8} {:>12} {:>12} {:>12.1f} {:>12.1f} {:>12.1f} {:>8} {:>8}".format(count, *result))
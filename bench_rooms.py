@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from protocol import *
+from rooms import *
+import contextlib
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+################################################################################
+#                              ROOM SERVER BENCHMARK                           #
+################################################################################
+
+### Constants ###
+
+PORT = 7960
+MAP = "maps/map1"
+ROOMS = [ 10, 100, 300 ]
+PLAYERS = 4 # per room
+MOVES = 0.2 # probability that a player moves at each tick
+DROPS = 0.002 # probability that a player drops a bomb at each tick
+TICKS = 300
+PROCESSES = 10 # server processes started to measure the memory of a match
+STEP = 1000 / FPS
+
+### Functions ###
+
+# resident memory of a process (in KiB)
+def rss(pid = "self"):
+    with open("/proc/{}/status".format(pid)) as _file:
+        for line in _file:
+            if line.startswith("VmRSS:"): return int(line.split()[1])
+    return 0
+
+# bytes available on each socket, dropped
+def drain(sockets):
+    for s in sockets:
+        try:
+            while s.recv(RECV_SIZE): pass
+        except BlockingIOError:
+            pass
+
+# host `rooms` rooms of PLAYERS bots in one server; return the time per tick
+# of the server, the mean and max cost of a room per tick (in ms), and the
+# memory per room (in MiB)
+def bench(rooms, port, ticks = TICKS):
+    before = rss()
+    server = RoomServer(port, [MAP], size = PLAYERS)
+    bots = []
+    for i in range(rooms*PLAYERS):
+        (a, b) = socket.socketpair()
+        b.setblocking(False)
+        server.add_socket(a, ("127.0.0.1", i))
+        b.send(encode("JOIN bot{}".format(i)))
+        bots.append(b)
+        server.tick(0)
+    elapsed = 0
+    for tick in range(ticks):
+        for b in bots:
+            if random.random() < MOVES: b.send(encode("MOVE " + str(random.choice(DIRECTIONS))))
+            if random.random() < DROPS: b.send(encode("DROP"))
+        if tick == 0: server.report() # forget the joins
+        start = time.perf_counter()
+        server.tick(0)
+        elapsed += time.perf_counter() - start
+        drain(bots)
+    costs = [ cost for (_, _, cost) in server.costs() ]
+    memory = (rss() - before) / 1024 / max(1, len(server.rooms))
+    for b in bots: b.close()
+    server.listener.close()
+    return (len(server.rooms), elapsed / ticks * 1000, statistics.mean(costs), max(costs), memory)
+
+# start PROCESSES servers with one match each; return the median memory of a
+# server process (in MiB)
+def processes(port):
+    servers = [ subprocess.Popen([ sys.executable, "bomber_server.py", str(port + i), MAP ], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL) for i in range(PROCESSES) ]
+    for i in range(PROCESSES):
+        start = time.perf_counter()
+        while time.perf_counter() - start < 10:
+            try:
+                socket.create_connection(("localhost", port + i)).close()
+                break
+            except OSError:
+                time.sleep(0.01)
+    memory = statistics.median(rss(server.pid) for server in servers) / 1024
+    for server in servers:
+        server.kill()
+        server.wait()
+    return memory
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    counts = [ int(arg) for arg in sys.argv[1:] ] or ROOMS
+    print("one process per match: {:.1f} MiB per match".format(processes(PORT)))
+    print("{:>6} {:>8} {:>10} {:>12} {:>12} {:>12}".format("rooms", "players", "tick ms", "room ms", "max room ms", "MiB/room"))
+    port = PORT + PROCESSES
+    for rooms in counts:
+        # server is verbose, mute it while measuring
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = bench(rooms, port)
+        port += 1
+        print("{:>6} {:>8} {:>10.2f} {:>12.3f} {:>12.3f} {:>12.2f}".format(result[0], rooms*PLAYERS, *result[1:]))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from network import *
+import contextlib
+import os
+import select
+import socket
+import sys
+import time
+
+################################################################################
+#                         IDLE CONNECTIONS BENCHMARK                           #
+################################################################################
+
+### Constants ###
+
+PORT = 7950
+CONNECTIONS = [ 100, 1000, 5000 ]
+TICKS = 500
+
+### Functions ###
+
+# duration of a call (in us)
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1e6
+
+def median(values):
+    return sorted(values)[len(values)//2]
+
+# median cost of a server tick (in us) with `count` idle connections, with the
+# server selector, and with select.select() over all the sockets, as before
+# (the median leaves out the ticks where the server broadcasts a random bomb)
+def bench(count, port, ticks = TICKS):
+    model = Model()
+    model.load_map(DEFAULT_MAP)
+    server = NetworkServerController(model, port)
+    clients = []
+    for _ in range(count):
+        s = socket.create_connection(("localhost", port))
+        clients.append(s)
+        server.tick(0)
+    sockets = [ key.fileobj for key in server.selector.get_map().values() ]
+    after = median([ timed(server.tick, 0) for _ in range(ticks) ])
+    try:
+        before = median([ timed(select.select, sockets, [], [], 0) for _ in range(ticks) ])
+    except ValueError:
+        before = None # file descriptor above FD_SETSIZE
+    for s in clients: s.close()
+    for s in sockets: s.close()
+    return (before, after)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    connections = [ int(arg) for arg in sys.argv[1:] ] or CONNECTIONS
+    print("{:>12} {:>12} {:>14}".format("connections", "select (us)", "selector (us)"))
+    port = PORT
+    for count in connections:
+        # server is verbose, mute it while measuring
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            (before, after) = bench(count, port)
+        port += 1
+        before = "n/a" if before is None else "{:.1f}".format(before)
+        print("{:>12} {:>12} {:>14.1f}".format(count, before, after))
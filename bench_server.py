@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from protocol import *
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+################################################################################
+#                            SERVER LOAD TEST                                  #
+################################################################################
+
+### Constants ###
+
+HOST = "localhost"
+PORT = 7900
+MAP = "maps/map1"
+MODES = [ "select", "async" ]
+CLIENTS = [ 10, 100, 1000 ]
+RATE = 1 # moves per second and per client
+PROBE = 0.2 # delay between two probes (in s)
+DURATION = 5 # in s
+TIMEOUT = 60 # max time to connect all the clients (in s)
+
+### Functions ###
+
+# server process, muted
+def run_server(mode, port):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        model = Model()
+        model.load_map(MAP)
+        for _ in range(10): model.add_fruit()
+        if mode == "async":
+            from async_network import AsyncServerController
+            asyncio.run(AsyncServerController(model, port).serve())
+        else:
+            from network import NetworkServerController
+            from engine import Engine
+            Engine(model, controllers = [NetworkServerController(model, port)]).run()
+
+### Class Stats ###
+
+class Stats:
+
+    def __init__(self):
+        self.joined = 0
+        self.closed = 0
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []
+        self.probe = None # time the last probe was sent
+
+    def reset(self):
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []
+
+    def percentile(self, p):
+        if not self.latencies: return float("nan")
+        values = sorted(self.latencies)
+        return values[min(len(values)-1, int(p*len(values)))] * 1000
+
+### Class Bot ###
+
+# Simulated player: it joins, then moves at random every 1/RATE s. The probe
+# bot drops bombs, and the observer bot measures the delay until the server
+# tells it about these drops.
+
+class Bot:
+
+    def __init__(self, nickname, stats, observer = False):
+        self.nickname = nickname
+        self.stats = stats
+        self.observer = observer
+        self.writer = None
+
+    async def connect(self, port):
+        (reader, self.writer) = await asyncio.open_connection(HOST, port)
+        self.writer.write(encode("JOIN " + self.nickname))
+        asyncio.ensure_future(self.read_loop(reader))
+
+    async def read_loop(self, reader):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data: break
+                decoder.feed(data)
+                for message in decoder.frames():
+                    self.stats.frames += 1
+                    self.stats.bytes += len(message) + HEADER_SIZE
+                    if message.startswith("WELC "):
+                        self.stats.joined += 1
+                    elif self.observer and message.startswith("DROP probe") and self.stats.probe:
+                        self.stats.latencies.append(time.perf_counter() - self.stats.probe)
+                        self.stats.probe = None
+        except ConnectionError:
+            pass
+        self.writer.close()
+        self.stats.closed += 1
+
+    async def move_loop(self):
+        await asyncio.sleep(random.random() / RATE)
+        while not self.writer.is_closing():
+            self.writer.write(encode("MOVE " + str(random.choice(DIRECTIONS))))
+            await asyncio.sleep(1 / RATE)
+
+    async def probe_loop(self):
+        while not self.writer.is_closing():
+            self.stats.probe = time.perf_counter()
+            self.writer.write(encode("DROP"))
+            await asyncio.sleep(PROBE)
+
+async def load(port, count):
+    stats = Stats()
+    bots = [ Bot("bot{}".format(i), stats) for i in range(count-2) ]
+    probe = Bot("probe", stats)
+    observer = Bot("observer", stats, True)
+    for bot in bots + [observer, probe]:
+        await bot.connect(port)
+    start = time.perf_counter()
+    while stats.joined < count and time.perf_counter() - start < TIMEOUT:
+        await asyncio.sleep(0.1)
+    tasks = [ asyncio.ensure_future(bot.move_loop()) for bot in bots ]
+    tasks.append(asyncio.ensure_future(probe.probe_loop()))
+    await asyncio.sleep(1)
+    stats.reset()
+    await asyncio.sleep(DURATION)
+    result = (stats.joined, stats.closed, stats.frames / DURATION, stats.bytes / DURATION / 2**10, stats.percentile(0.5), stats.percentile(0.99))
+    for task in tasks: task.cancel()
+    for bot in bots + [observer, probe]: bot.writer.close()
+    return result
+
+def bench(mode, count, port):
+    server = multiprocessing.Process(target = run_server, args = (mode, port), daemon = True)
+    server.start()
+    time.sleep(1)
+    try:
+        return asyncio.run(load(port, count))
+    finally:
+        server.terminate()
+        server.join()
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    clients = [ int(arg) for arg in sys.argv[1:] ] or CLIENTS
+    print("{:<7} {:>7} {:>7} {:>7} {:>10} {:>8} {:>9} {:>9}".format("mode", "clients", "joined", "closed", "frames/s", "KB/s", "p50 (ms)", "p99 (ms)"))
+    port = PORT
+    for count in clients:
+        for mode in MODES:
+            result = bench(mode, count, port)
+            port += 1
+            print("{:<7} {:>7} {:>7} {:>7} {:>10.0f} {:>8.1f} {:>9.1f} {:>9.1f}".format(mode, count, *result))
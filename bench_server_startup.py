@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+################################################################################
+#                           SERVER STARTUP BENCHMARK                           #
+################################################################################
+
+### Constants ###
+
+PORT = 7950
+RUNS = 5
+TIMEOUT = 10 # max time for a server to listen (in s)
+
+# the server entry point as it was, with PyGame and the view imported and
+# initialized before it runs
+BEFORE = """
+import os, runpy, sys
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+import pygame
+from view import *
+from async_network import *
+pygame.display.init()
+pygame.font.init()
+sys.argv = [ "bomber_server.py" ] + sys.argv[1:]
+runpy.run_path("bomber_server.py", run_name = "__main__")
+"""
+
+MODES = [ ("before", [ "-c", BEFORE ], []), ("select", [ "bomber_server.py" ], []),
+          ("async", [ "bomber_server.py" ], [ "--async" ]), ("aoi", [ "bomber_server.py" ], [ "--aoi" ]) ]
+
+### Functions ###
+
+# resident memory of a process (in KiB)
+def rss(pid):
+    with open("/proc/{}/status".format(pid)) as _file:
+        for line in _file:
+            if line.startswith("VmRSS:"): return int(line.split()[1])
+    return 0
+
+# start a server; return the time until it accepts connections (in ms), and
+# its resident memory then (in MiB)
+def launch(command, options, port):
+    start = time.perf_counter()
+    process = subprocess.Popen([ sys.executable ] + command + [ str(port) ] + options, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    ready = None
+    while time.perf_counter() - start < TIMEOUT:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            ready = (time.perf_counter() - start) * 1000
+            break
+        except OSError:
+            time.sleep(0.001)
+    memory = rss(process.pid) / 1024 if ready is not None else float("nan")
+    process.kill()
+    process.wait()
+    return (ready if ready is not None else float("nan"), memory)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    print("{:<8} {:>14} {:>10}".format("server", "listening ms", "RSS MiB"))
+    port = PORT
+    for (name, command, options) in MODES:
+        results = []
+        for _ in range(runs):
+            results.append(launch(command, options, port))
+            port += 1
+        print("{:<8} {:>14.1f} {:>10.1f}".format(name, statistics.median(r[0] for r in results), statistics.median(r[1] for r in results)))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from protocol import *
+from shards import *
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+################################################################################
+#                             SHARDED WORLD BENCHMARK                          #
+################################################################################
+
+### Constants ###
+
+HOST = "localhost"
+PORT = 7970
+WIDTH = 256 # size of the generated map
+HEIGHT = 65
+WORKERS = [ 1, 2, 4 ]
+PLAYERS = 400
+RATE = 4 # moves per second and per player
+TURN = 0.1 # probability that a player changes its direction at each move
+DURATION = 5 # in s
+TIMEOUT = 30 # max time to connect all the players (in s)
+
+### Functions ###
+
+# CPU time used by a process so far (in s)
+def cpu(pid):
+    with open("/proc/{}/stat".format(pid)) as _file:
+        fields = _file.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def percentile(values, p):
+    if not values: return float("nan")
+    values = sorted(values)
+    return values[min(len(values)-1, int(p*len(values)))] * 1000
+
+### Class Stats ###
+
+class Stats:
+
+    def __init__(self):
+        self.joined = 0
+        self.reset()
+
+    def reset(self):
+        self.confirmations = [] # time from a move to its confirmation (in s)
+        self.handoffs = [] # time from TPSP to WELC on the next shard (in s)
+
+### Class Bot ###
+
+# Simulated player speaking protocol version 3: it walks in a direction and
+# turns now and then, acknowledges the states, and follows its character
+# when it is handed over to another shard.
+
+class Bot:
+
+    def __init__(self, nickname, stats):
+        self.nickname = nickname
+        self.stats = stats
+        self.writer = None
+        self.direction = random.choice(DIRECTIONS)
+        self.input = 0
+        self.sent = {} # move number -> time sent
+        self.switched = None # time the last TPSP was received
+
+    async def connect(self, port, join = "JOIN"):
+        (reader, self.writer) = await asyncio.open_connection(HOST, port)
+        self.writer.write(encode("PROT " + str(PROTOCOL_VERSION)))
+        self.writer.write(encode(join + " " + self.nickname))
+        asyncio.ensure_future(self.read_loop(reader, self.writer))
+
+    async def read_loop(self, reader, writer):
+        decoder = FrameDecoder(BinaryCodec(CLIENT_MESSAGES, SERVER_MESSAGES))
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data: break
+                decoder.feed(data)
+                for message in decoder.frames():
+                    self.handle_message(message.rstrip("\n"))
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def handle_message(self, message):
+        if message.startswith("SNAP "):
+            (seq, base, _, part, count) = message.split(" ", 6)[1:6]
+            if int(part) == int(count) - 1: self.writer.write(encode("ACKS " + seq))
+        elif message.startswith("MACK "):
+            sent = self.sent.pop(int(message.split(" ")[1]), None)
+            if sent: self.stats.confirmations.append(time.perf_counter() - sent)
+        elif message.startswith("WELC "):
+            if self.switched: self.stats.handoffs.append(time.perf_counter() - self.switched)
+            else: self.stats.joined += 1
+            self.switched = None
+        elif message.startswith("TPSP "):
+            self.switched = time.perf_counter()
+            self.writer.close()
+            self.sent = {}
+            (_, _, port, token) = message.split(" ")
+            asyncio.ensure_future(self.connect(int(port), "RESM " + token))
+
+    async def move_loop(self):
+        await asyncio.sleep(random.random() / RATE)
+        while True:
+            if random.random() < TURN: self.direction = random.choice(DIRECTIONS)
+            if self.switched is None and not self.writer.is_closing():
+                self.input = (self.input + 1) % 65536
+                self.sent[self.input] = time.perf_counter()
+                self.writer.write(encode("MOVN " + str(self.direction) + " " + str(self.input)))
+            await asyncio.sleep(1 / RATE)
+
+# play with PLAYERS bots spread over the shards; return the CPU used by each
+# worker (in % of a core), the confirmation times, and the handoffs
+async def load(world, players):
+    stats = Stats()
+    bots = [ Bot("bot{}".format(i), stats) for i in range(players) ]
+    for (i, bot) in enumerate(bots):
+        await bot.connect(world.ports[i % len(world.ports)])
+    start = time.perf_counter()
+    while stats.joined < players and time.perf_counter() - start < TIMEOUT:
+        await asyncio.sleep(0.1)
+    tasks = [ asyncio.ensure_future(bot.move_loop()) for bot in bots ]
+    await asyncio.sleep(1)
+    stats.reset()
+    before = [ cpu(process.pid) for process in world.processes ]
+    await asyncio.sleep(DURATION)
+    used = [ (cpu(process.pid) - used) / DURATION * 100 for (process, used) in zip(world.processes, before) ]
+    for task in tasks: task.cancel()
+    for bot in bots: bot.writer.close()
+    return (stats.joined, used, stats.confirmations, stats.handoffs)
+
+def bench(map_file, workers, players, port):
+    world = ShardedWorld(port, map_file, workers)
+    # workers are verbose, mute them
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        world.start()
+    time.sleep(1)
+    try:
+        return asyncio.run(load(world, players))
+    finally:
+        world.stop()
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    random.seed(0)
+    players = int(sys.argv[1]) if len(sys.argv) > 1 else PLAYERS
+    m = Map()
+    m.generate(WIDTH, HEIGHT)
+    with tempfile.TemporaryDirectory() as directory:
+        map_file = os.path.join(directory, "map")
+        with open(map_file, "w") as _file:
+            _file.write("\n".join(m.array) + "\n")
+        print("{}x{} map, {} players moving {} times per second".format(WIDTH, HEIGHT, players, RATE))
+        print("{:>7} {:>7} {:>12} {:>12} {:>10} {:>10} {:>10} {:>12}".format("workers", "joined", "max CPU %", "total CPU %", "move p50", "move p99", "handoffs", "handoff p50"))
+        port = PORT
+        for workers in WORKERS:
+            (joined, used, confirmations, handoffs) = bench(map_file, workers, players, port)
+            port += workers
+            print("{:>7} {:>7} {:>12.1f} {:>12.1f} {:>10.1f} {:>10.1f} {:>10} {:>12.1f}".format(workers, joined, max(used), sum(used),
+                  percentile(confirmations, 0.5), percentile(confirmations, 0.99), len(handoffs), percentile(handoffs, 0.5)))
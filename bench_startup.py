@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+import statistics
+import subprocess
+import sys
+import time
+
+################################################################################
+#                               STARTUP BENCHMARK                              #
+################################################################################
+
+### Constants ###
+
+RUNS = 5
+MAP = "maps/map1"
+CACHE = "images/atlas.cache"
+
+# client side startup, in a new process: the view is created and renders its
+# first frame, then a second view is created; the times are printed in ms.
+# Without a shared atlas, each view loads the images again, as before the atlas
+CHILD = """
+import os, sys, time
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+from model import *
+import view
+import pygame
+view.ATLAS_CACHE = {cache!r}
+if {shared} is False: view.load_atlas = lambda: view.Atlas(view.SPRITES, None)
+pygame.display.init()
+pygame.font.init()
+model = Model()
+model.load_map({map!r})
+start = time.perf_counter()
+first = view.GraphicView(model, "bench")
+first.tick(0)
+frame = time.perf_counter() - start
+start = time.perf_counter()
+second = view.GraphicView(model, "bench")
+again = time.perf_counter() - start
+print("FRAME", frame*1000, again*1000, file = sys.stderr, flush = True)
+"""
+
+### Functions ###
+
+# start a client process; return the time from its launch to its first frame,
+# the time to create its first view and render a frame, and the time to
+# create another view (in ms)
+def launch(cache, shared = True):
+    code = CHILD.format(cache = cache, shared = shared, map = MAP)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code], stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True)
+    for line in process.stderr:
+        if line.startswith("FRAME"):
+            launched = (time.perf_counter() - start) * 1000
+            (frame, again) = [ float(value) for value in line.split()[1:] ]
+            break
+    process.wait()
+    return (launched, frame, again)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    print("{:<10} {:>14} {:>12} {:>12}".format("sprites", "launch ms", "view ms", "again ms"))
+    for (name, cache, shared) in [ ("per view", None, False), ("images", None, True), ("cache", CACHE, True) ]:
+        if cache: launch(cache) # make sure the cache is up to date
+        results = [ launch(cache, shared) for _ in range(runs) ]
+        medians = [ statistics.median(result[i] for result in results) for i in range(3) ]
+        print("{:<10} {:>14.1f} {:>12.2f} {:>12.2f}".format(name, *medians))
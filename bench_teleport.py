@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+from network import *
+from engine import Engine
+import contextlib
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import time
+
+################################################################################
+#                              TELEPORT BENCHMARK                              #
+################################################################################
+
+### Constants ###
+
+PORT = 7980
+MAPS = [ "maps/map0", "maps/map1" ]
+# tile next to the teleporter of each map, and the move onto it
+SPAWNS = [ ((10, 5), DIRECTION_RIGHT), ((24, 6), DIRECTION_LEFT) ]
+TELEPORTS = 40
+TIMEOUT = 5 # max time for a teleport (in s)
+
+### Class BenchServer ###
+
+# Server that places the characters next to its teleporter, without random
+# bombs; with `legacy`, its teleporters only tell the client where to go, as
+# they used to.
+
+class BenchServer(NetworkServerController):
+
+    def __init__(self, model, port, spawn, legacy):
+        super().__init__(model, port)
+        self.spawn = spawn
+        self.legacy = legacy
+
+    def random_position(self):
+        return self.spawn
+
+    def alea_bomb(self):
+        pass
+
+    def teleport_user(self, s):
+        if not self.legacy: return super().teleport_user(s)
+        (host, port) = self.teleports[self.port]
+        self.send_message("TPSP "+host+" "+str(port), s)
+
+### Class LegacyClient ###
+
+# Client switching as it used to: it checks that the other server is up with
+# a first connection, then connects again, joins with its health and kind,
+# and parses the map again.
+
+class LegacyClient(NetworkClientController):
+
+    def switch_server(self, message):
+        parts = message.split(" ")
+        self.switched = time.perf_counter()
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.connect((parts[1], int(parts[2])))
+            s.close()
+        except:
+            print("TELEPORT ERROR: Second server unreachable...")
+            return
+        self.host = parts[1]
+        self.port = int(parts[2])
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.connect((self.host, self.port))
+        self.join_special(s)
+
+    def load_map(self, path, digest = None):
+        self.model.map = Map()
+        self.model.load_map(path)
+        return True
+
+    def peer_server(self, message):
+        pass
+
+### Functions ###
+
+# server process, muted
+def run_server(index, legacy):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        model = Model()
+        model.load_map(MAPS[index])
+        server = BenchServer(model, PORT + 2*legacy + index, SPAWNS[index][0], legacy)
+        server.teleports = { PORT + 2*legacy: ("localhost", PORT + 2*legacy + 1), PORT + 2*legacy + 1: ("localhost", PORT + 2*legacy) }
+        Engine(model, controllers = [server]).run()
+
+# step on the teleporters back and forth; return the times from the move onto
+# a teleporter to the welcome of the other server (in ms)
+def bench(legacy, count = TELEPORTS):
+    servers = [ multiprocessing.Process(target = run_server, args = (index, legacy), daemon = True) for index in range(2) ]
+    for server in servers: server.start()
+    time.sleep(1)
+    times = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        model = Model()
+        client = (LegacyClient if legacy else NetworkClientController)(model, "localhost", PORT + 2*legacy, "traveller", threaded = False)
+        index = 0
+        try:
+            while len(times) < count:
+                # wait for our character, and give time to connect beforehand
+                start = time.perf_counter()
+                while (model.look("traveller") is None or time.perf_counter() - start < 0.2) and time.perf_counter() - start < TIMEOUT:
+                    client.tick(10)
+                if model.look("traveller") is None: break
+                teleports = client.stats.teleports
+                start = time.perf_counter()
+                client.keyboard_move_character(SPAWNS[index][1])
+                while client.stats.teleports == teleports and time.perf_counter() - start < TIMEOUT:
+                    client.tick(1)
+                if client.stats.teleports == teleports: break
+                times.append((time.perf_counter() - start) * 1000)
+                index = 1 - index
+        finally:
+            client.close()
+            for server in servers:
+                server.terminate()
+                server.join()
+    return times
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else TELEPORTS
+    print("{:<10} {:>10} {:>10} {:>10} {:>10}".format("teleport", "count", "mean ms", "p50 ms", "max ms"))
+    for (name, legacy) in [ ("reconnect", True), ("handoff", False) ]:
+        times = bench(legacy, count)
+        if not times:
+            print("{:<10} {:>10}".format(name, 0))
+            continue
+        print("{:<10} {:>10} {:>10.2f} {:>10.2f} {:>10.2f}".format(name, len(times), statistics.mean(times), statistics.median(times), max(times)))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # no window
+from model import *
+from view import *
+import contextlib
+import random
+import sys
+import time
+import pygame
+
+################################################################################
+#                               VIEW BENCHMARK                                 #
+################################################################################
+
+### Constants ###
+
+FRAMES = 300
+MAPS = [ "maps/map1", (65, 65), (129, 129) ]
+LOADS = [ (4, 4), (20, 20) ] # (characters, fruits)
+MOVES = 0.2 # probability that a character moves at each frame
+DROPS = 0.005 # probability that a character drops a bomb at each frame
+STEP = 1000 / FPS
+
+### Class FullView ###
+
+# View that redraws the whole map and flips the display at each frame, as the
+# view did before the background and the dirty tiles
+
+class FullView(GraphicView):
+
+    def tick(self, dt):
+        self.background = None
+        GraphicView.tick(self, dt)
+
+### Functions ###
+
+# render `frames` frames of a game; return the frames per second, and the
+# CPU time per frame (in ms)
+def bench(mapname, characters, fruits, full, frames = FRAMES):
+    random.seed(0)
+    model = Model()
+    if isinstance(mapname, tuple):
+        model.map.generate(*mapname)
+    else:
+        model.load_map(mapname)
+    for i in range(characters): model.add_character("bot{}".format(i), i == 0)
+    for _ in range(fruits): model.add_fruit()
+    view = (FullView if full else GraphicView)(model, "bench")
+    elapsed = 0
+    cpu = 0
+    for _ in range(frames):
+        for character in model.characters:
+            if random.random() < MOVES: model.move_character(character.nickname, random.choice(DIRECTIONS))
+            if random.random() < DROPS: model.drop_bomb(character.nickname)
+        while len(model.fruits) < fruits: model.add_fruit()
+        model.tick(STEP)
+        start = time.perf_counter()
+        start_cpu = time.process_time()
+        view.tick(STEP)
+        elapsed += time.perf_counter() - start
+        cpu += time.process_time() - start_cpu
+    return (model.map.width, model.map.height, frames / elapsed, cpu / frames * 1000)
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else FRAMES
+    pygame.display.init()
+    pygame.font.init()
+    print("{:<12} {:>9} {:>6} {:>6} {:>8} {:>10} {:>10}".format("map", "size", "chars", "fruits", "view", "frames/s", "cpu ms"))
+    for mapname in MAPS:
+        for (characters, fruits) in LOADS:
+            for full in [True, False]:
+                # model is verbose, mute it while measuring
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    result = bench(mapname, characters, fruits, full, frames)
+                name = mapname if isinstance(mapname, str) else "generated"
+                size = "{}x{}".format(result[0], result[1])
+                print("{:<12} {:>9} {:>6} {:>6} {:>8} {:>10.0f} {:>10.2f}".format(name, size, characters, fruits, "full" if full else "dirty", result[2], result[3]))
+    pygame.quit()
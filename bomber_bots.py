@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+# The bots never import PyGame nor the view: they only speak the protocol.
+
+from model import *
+from protocol import *
+from network import *
+import asyncio
+import collections
+import math
+import multiprocessing
+import random
+import resource
+import socket
+import sys
+import time
+
+################################################################################
+#                                    BOTS                                      #
+################################################################################
+
+# Headless players for load testing: each process runs many bots in an asyncio
+# loop, which speak the protocol of the client (version 3, binary frames):
+# they join, acknowledge the states, number their moves, follow their
+# character when a teleporter hands it over to another server, and may quit
+# and join again. What a bot does depends on its behaviour:
+#
+#   walker     walks in a direction, and turns now and then
+#   bomber     walks, and drops bombs
+#   traveller  walks to the nearest teleporter (asks for the map if needed)
+#   quitter    walks, quits after a while, then joins again
+#
+# The tool asks the server for its counters (STAT) before and after the
+# measure, and reports the duration of its ticks, the messages it handles and
+# the bytes it sends, with what the bots see: the messages and bytes they
+# get, the time until a move is confirmed (MOVN -> MACK), and the teleports.
+
+### Constants ###
+
+BOTS = 100
+PROCESSES = 1
+DURATION = 10 # time of the measure (in s)
+WARMUP = 1 # time between the last join and the measure (in s)
+MIX = "walker:70,bomber:20,traveller:5,quitter:5" # behaviour:weight,...
+BEHAVIOURS = [ "walker", "bomber", "traveller", "quitter" ]
+RATE = 4 # moves per second and per bot
+TURN = 0.1 # probability that a bot changes its direction at each move
+DROPS = 0.1 # probability that a bomber drops a bomb at each move
+LIFETIME = 5 # mean time a quitter plays before it quits (in s)
+PAUSE = 1 # time before a quitter joins again (in s)
+SEARCH = 10000 # max tiles explored to find a teleporter
+CONNECTIONS = 200 # new connections per second and per process
+TIMEOUT = 60 # max time to join (in s)
+PROBE_TIMEOUT = 5 # max time to get the counters of the server (in s)
+
+### Functions ###
+
+def percentile(values, p):
+    if not values: return float("nan")
+    values = sorted(values)
+    return values[min(len(values)-1, int(p*len(values)))] * 1000
+
+# upper bound of the p-th percentile of the tick durations (in ms), given the
+# number of ticks in each bucket of TICK_BUCKETS
+def tick_percentile(durations, p):
+    total = sum(durations)
+    if not total: return float("nan")
+    count = 0
+    for (bound, ticks) in zip(TICK_BUCKETS + [ math.inf ], durations):
+        count += ticks
+        if count >= p*total: return bound / 1000
+    return math.inf
+
+# behaviours by weight, from "behaviour:weight,..."
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        (behaviour, weight) = item.split(":")
+        if behaviour not in BEHAVIOURS: raise ValueError("unknown behaviour: " + behaviour)
+        weights[behaviour] = float(weight)
+    return weights
+
+# directions to the nearest teleporter, from the tiles on the way: pos -> direction
+def path_to_teleporter(m, start):
+    moves = [ (DIRECTION_LEFT, -1, 0), (DIRECTION_RIGHT, 1, 0), (DIRECTION_UP, 0, -1), (DIRECTION_DOWN, 0, 1) ]
+    previous = { start: None } # pos -> (previous pos, direction from it)
+    queue = collections.deque([ start ])
+    while queue and len(previous) < SEARCH:
+        pos = queue.popleft()
+        if pos != start and m.get_tile(*pos) == TELEPORTER:
+            path = {}
+            while previous[pos] is not None:
+                (pos, direction) = previous[pos]
+                path[pos] = direction
+            return path
+        for (direction, dx, dy) in moves:
+            (x, y) = (pos[X] + dx, pos[Y] + dy)
+            if 0 <= x < m.width and 0 <= y < m.height and (x, y) not in previous and m.walkable(x, y):
+                previous[(x, y)] = (pos, direction)
+                queue.append((x, y))
+    return {}
+
+### Class BotStats ###
+
+# What the bots of a process have seen since the last reset
+
+class BotStats:
+
+    def __init__(self):
+        self.joined = 0 # bots that have joined once, never reset
+        self.errors = 0 # failed connections, never reset
+        self.reset()
+
+    def reset(self):
+        self.sent = 0 # messages
+        self.received = 0 # messages
+        self.bytes = 0 # bytes received
+        self.joins = 0 # joins after a quit
+        self.quits = 0
+        self.closed = 0 # connections closed by the server
+        self.confirmations = [] # time from a move to its confirmation (in s)
+        self.teleports = [] # time from TPSP to the welcome of the other server (in s)
+
+    def merge(self, other):
+        for name in [ "joined", "errors", "sent", "received", "bytes", "joins", "quits", "closed" ]:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.confirmations += other.confirmations
+        self.teleports += other.teleports
+
+### Class Bot ###
+
+class Bot:
+
+    def __init__(self, nickname, behaviour, host, port, stats, maps):
+        self.nickname = nickname
+        self.behaviour = behaviour
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.maps = maps # shared by the bots of the process
+        self.writer = None
+        self.codec = None
+        self.binary = False
+        self.pos = None # position confirmed by the server, None until welcome
+        self.direction = random.choice(DIRECTIONS)
+        self.input = 0
+        self.sent = {} # move number -> time sent
+        self.map = None
+        self.digest = None # digest of the map of the server
+        self.path = {} # pos -> direction to the nearest teleporter
+        self.switched = None # time the last TPSP was received
+        self.joined = False # once joined, a new welcome is a rejoin
+        self.quit_time = None # time a quitter quits
+
+    async def connect(self, join):
+        (reader, writer) = await asyncio.open_connection(self.host, self.port)
+        self.writer = writer
+        self.codec = BinaryCodec(CLIENT_MESSAGES, SERVER_MESSAGES)
+        self.binary = False
+        self.send("PROT " + str(PROTOCOL_VERSION))
+        self.send(join)
+        asyncio.ensure_future(self.read_loop(reader, writer))
+
+    def send(self, message):
+        self.writer.write(self.codec.encode(message) if self.binary else encode(message))
+        self.stats.sent += 1
+
+    async def read_loop(self, reader, writer):
+        decoder = FrameDecoder(self.codec)
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                if not data: break
+                self.stats.bytes += len(data)
+                decoder.feed(data)
+                for message in decoder.frames():
+                    self.stats.received += 1
+                    self.handle_message(message.rstrip("\n"))
+        except ConnectionError:
+            pass
+        # the server has closed a connection we still use
+        if writer is self.writer and not writer.is_closing(): self.stats.closed += 1
+        writer.close()
+
+    def handle_message(self, message):
+        if message.startswith("PROT "):
+            self.binary = int(message.split()[1]) >= 2
+        elif message.startswith("SNAP "):
+            (seq, base, _, part, count) = message.split(" ", 6)[1:6]
+            if int(part) == int(count) - 1: self.send("ACKS " + seq)
+        elif message.startswith("MACK "):
+            (number, x, y) = (int(field) for field in message.split()[1:4])
+            self.pos = (x, y)
+            sent = self.sent.pop(number, None)
+            if sent: self.stats.confirmations.append(time.perf_counter() - sent)
+        elif message.startswith("WELC "):
+            self.arrive(message)
+        elif message.startswith("MAPD "):
+            m = self.maps.receive(message)
+            if m is not None and m.digest() == self.digest: self.use_map(m)
+        elif message.startswith("TPSP "):
+            self.switch(message)
+
+    def arrive(self, message):
+        parts = message.split()
+        self.pos = (int(parts[3]), int(parts[4]))
+        if self.switched is not None:
+            self.stats.teleports.append(time.perf_counter() - self.switched)
+            self.switched = None
+        elif self.joined:
+            self.stats.joins += 1
+        else:
+            self.joined = True
+            self.stats.joined += 1
+        if self.behaviour == "quitter":
+            self.quit_time = time.perf_counter() + random.expovariate(1 / LIFETIME)
+        # travellers need the map, which they ask for if they lack it
+        self.map = None
+        self.path = {}
+        self.digest = parts[6] if len(parts) > 6 else None
+        if self.behaviour == "traveller":
+            m = self.maps.find(self.digest, parts[5])
+            if m is not None: self.use_map(m)
+            elif self.digest: self.send("GETM " + self.digest)
+
+    def use_map(self, m):
+        self.map = m
+        self.path = path_to_teleporter(m, self.pos)
+
+    # follow our character to another server
+    def switch(self, message):
+        parts = message.split()
+        self.switched = time.perf_counter()
+        self.writer.close()
+        self.pos = None
+        self.sent = {}
+        (self.host, self.port) = (parts[1], int(parts[2]))
+        # older servers don't hand the character over
+        join = "RESM " + parts[3] if len(parts) > 3 else "JOIN"
+        asyncio.ensure_future(self.reconnect(join + " " + self.nickname))
+
+    async def reconnect(self, join, delay = 0):
+        await asyncio.sleep(delay)
+        try:
+            await self.connect(join)
+        except OSError:
+            self.stats.errors += 1
+
+    async def play(self):
+        await asyncio.sleep(random.random() / RATE)
+        while True:
+            if self.pos is not None and not self.writer.is_closing(): self.act()
+            await asyncio.sleep(1 / RATE)
+
+    def act(self):
+        if self.quit_time is not None and time.perf_counter() > self.quit_time:
+            self.send("QUIT")
+            self.writer.close()
+            self.stats.quits += 1
+            self.pos = None
+            self.quit_time = None
+            asyncio.ensure_future(self.reconnect("JOIN " + self.nickname, PAUSE))
+            return
+        if self.map is not None and self.pos not in self.path:
+            self.path = path_to_teleporter(self.map, self.pos)
+        if self.pos in self.path:
+            self.direction = self.path[self.pos]
+        elif random.random() < TURN:
+            self.direction = random.choice(DIRECTIONS)
+        self.input = (self.input + 1) % 65536
+        self.sent[self.input] = time.perf_counter()
+        self.send("MOVN " + str(self.direction) + " " + str(self.input))
+        if self.behaviour == "bomber" and random.random() < DROPS:
+            self.send("DROP")
+
+    def close(self):
+        if self.writer: self.writer.close()
+
+### Functions ###
+
+# bots of a process: join, tell the main process, play, and send what they
+# have seen during the measure
+async def load(index, host, port, behaviours, duration, ready, start, results):
+    stats = BotStats()
+    maps = MapCache(None)
+    bots = [ Bot("bot{}_{}".format(index, i), behaviour, host, port, stats, maps) for (i, behaviour) in enumerate(behaviours) ]
+    for bot in bots:
+        await bot.reconnect("JOIN " + bot.nickname)
+        await asyncio.sleep(1 / CONNECTIONS)
+    begin = time.perf_counter()
+    while stats.joined + stats.errors < len(bots) and time.perf_counter() - begin < TIMEOUT:
+        await asyncio.sleep(0.1)
+    tasks = [ asyncio.ensure_future(bot.play()) for bot in bots ]
+    ready.put(stats.joined)
+    while not start.is_set():
+        await asyncio.sleep(0.01)
+    stats.reset()
+    await asyncio.sleep(duration)
+    results.put(stats)
+    for task in tasks: task.cancel()
+    for bot in bots: bot.close()
+
+def run_process(index, host, port, behaviours, duration, ready, start, results):
+    # a socket per bot
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    random.seed()
+    asyncio.run(load(index, host, port, behaviours, duration, ready, start, results))
+
+# connection that asks the server for its counters, without joining
+def open_probe(host, port):
+    s = socket.create_connection((host, port), PROBE_TIMEOUT)
+    s.sendall(encode("PROT " + str(PROTOCOL_VERSION)))
+    return (s, FrameDecoder(BinaryCodec(CLIENT_MESSAGES, SERVER_MESSAGES)))
+
+# counters of the server (ticks, messages, bytes, durations), None if it
+# doesn't answer
+def probe(s, decoder):
+    try:
+        s.sendall(encode("STAT"))
+        while True:
+            data = s.recv(RECV_SIZE)
+            if not data: return None
+            decoder.feed(data)
+            for message in decoder.frames():
+                if message.startswith("STAT "):
+                    fields = [ int(field) for field in message.split()[1:] ]
+                    return (fields[0], fields[1], fields[2], fields[3:])
+    except OSError:
+        return None
+
+# what the bots have seen during `duration` s, and the server during `elapsed` s
+def report(duration, elapsed, stats, before, after):
+    print("bots:      {} joined, {} failed to connect, {} closed by the server, {} quits, {} joins again".format(stats.joined, stats.errors, stats.closed, stats.quits, stats.joins))
+    print("bots:      {:.0f} messages/s sent, {:.0f} messages/s received, {:.1f} KiB/s received".format(stats.sent / duration, stats.received / duration, stats.bytes / duration / 2**10))
+    print("moves:     {} confirmed in {:.1f} ms p50, {:.1f} ms p90, {:.1f} ms p99".format(len(stats.confirmations),
+          percentile(stats.confirmations, 0.5), percentile(stats.confirmations, 0.9), percentile(stats.confirmations, 0.99)))
+    print("teleports: {} in {:.1f} ms p50, {:.1f} ms p99".format(len(stats.teleports), percentile(stats.teleports, 0.5), percentile(stats.teleports, 0.99)))
+    if before is None or after is None:
+        print("server:    no counters (STAT not answered)")
+        return
+    (ticks, messages, sent) = (after[0] - before[0], after[1] - before[1], after[2] - before[2])
+    durations = [ a - b for (a, b) in zip(after[3], before[3]) ]
+    print("server:    {:.1f} ticks/s, tick <= {:.2f} ms p50, {:.2f} ms p90, {:.2f} ms p99, {:.2f} ms max".format(ticks / elapsed,
+          tick_percentile(durations, 0.5), tick_percentile(durations, 0.9), tick_percentile(durations, 0.99), tick_percentile(durations, 1)))
+    print("server:    {:.0f} messages/s handled, {:.1f} KiB/s sent".format(messages / elapsed, sent / elapsed / 2**10))
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    options = [ arg for arg in sys.argv[1:] if arg.startswith("--") ]
+    args = [ arg for arg in sys.argv[1:] if not arg.startswith("--") ]
+    if len(args) not in (2, 3):
+        print("Usage: {} host port [bots] [--processes=N] [--duration=S] [--mix=behaviour:weight,...]".format(sys.argv[0]))
+        sys.exit()
+    host = args[0]
+    port = int(args[1])
+    count = int(args[2]) if len(args) > 2 else BOTS
+    processes = next((int(arg.split("=")[1]) for arg in options if arg.startswith("--processes=")), PROCESSES)
+    duration = next((float(arg.split("=")[1]) for arg in options if arg.startswith("--duration=")), DURATION)
+    weights = parse_mix(next((arg.split("=")[1] for arg in options if arg.startswith("--mix=")), MIX))
+
+    behaviours = random.choices(list(weights), list(weights.values()), k = count)
+    mix = ", ".join("{} {}".format(behaviours.count(behaviour), behaviour) for behaviour in weights)
+    print("=> {} bots ({}) in {} processes on {}:{}, measured during {} s".format(count, mix, processes, host, port, duration))
+
+    (s, decoder) = open_probe(host, port)
+    ready = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    start = multiprocessing.Event()
+    workers = [ multiprocessing.Process(target = run_process, args = (index, host, port, behaviours[index::processes], duration, ready, start, results), daemon = True)
+                for index in range(processes) ]
+    for worker in workers: worker.start()
+    joined = sum(ready.get(timeout = 2*TIMEOUT) for _ in workers)
+    print("=> {} bots joined".format(joined))
+    time.sleep(WARMUP)
+
+    before = probe(s, decoder)
+    begin = time.perf_counter()
+    start.set()
+    stats = BotStats()
+    for _ in workers: stats.merge(results.get())
+    after = probe(s, decoder)
+    elapsed = time.perf_counter() - begin
+    s.close()
+    for worker in workers: worker.join()
+    report(duration, elapsed, stats, before, after)
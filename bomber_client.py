@@ -42,8 +42,7 @@ kb = KeyboardController(client)
 
 #Attente des premières données permettant d'afficher la grille
 while not client.ready:
-    client.tick()
-    continue
+    client.tick(100)
 
 view = GraphicView(model, nickname)
 
@@ -52,9 +51,9 @@ while True:
     # make sure game doesn't run at more than FPS frames per second
     dt = clock.tick(FPS)
     if not kb.tick(dt): break
-    model.tick(dt)
-
+    # apply what the server has sent before the model moves on
     client.tick()
+    model.tick(dt)
     view.tick(dt)
 
 # quit
@@ -2,17 +2,14 @@
 # -*- coding: Utf-8 -*
 # Author: aurelien.esnard@u-bordeaux.fr
 
+# The server never imports PyGame nor the view, and only imports the modules
+# of the mode it runs in, so that it starts fast and small.
+
 from model import *
-from view import *
-from network import *
-import socket
-import select
 import sys
-import pygame
 
 ### python version ###
 print("python version: {}.{}.{}".format(sys.version_info[0], sys.version_info[1], sys.version_info[2]))
-print("pygame version: ", pygame.version.ver)
 
 
 ################################################################################
@@ -20,34 +17,53 @@ print("pygame version: ", pygame.version.ver)
 ################################################################################
 
 # parse arguments
-if len(sys.argv) == 2:
-    port = int(sys.argv[1])
+options = [ arg for arg in sys.argv[1:] if arg.startswith("--") ]
+args = [ arg for arg in sys.argv[1:] if not arg.startswith("--") ]
+use_async = "--async" in options
+use_rooms = "--rooms" in options
+shards = next((int(arg.split("=")[1]) for arg in options if arg.startswith("--shards=")), 0)
+interest = None
+if "--aoi" in options:
+    from interest import InterestManager
+    interest = InterestManager()
+if len(args) == 1:
+    port = int(args[0])
     map_file = DEFAULT_MAP
-elif len(sys.argv) == 3:
-    port = int(sys.argv[1])
-    map_file = sys.argv[2]
+elif len(args) == 2:
+    port = int(args[0])
+    map_file = args[1]
 else:
-    print("Usage: {} port [map_file]".format(sys.argv[0]))
+    print("Usage: {} port [map_file] [--async | --rooms | --shards=N] [--aoi]".format(sys.argv[0]))
     sys.exit()
 
-# initialization
-pygame.display.init()
-pygame.font.init()
-clock = pygame.time.Clock()
-model = Model()
-model.load_map(map_file)
-for _ in range(10): model.add_fruit()
-server = NetworkServerController(model, port)
-# view = GraphicView(model, "server")
-
-# main loop
-while True:
-    # make sure game doesn't run at more than FPS frames per second
-    dt = clock.tick(FPS)
-    server.tick(dt)
-    model.tick(dt)
-    # view.tick(dt)
+# initialization (with --rooms and --shards, each room or shard has its own model)
+if not use_rooms and not shards:
+    model = Model()
+    model.load_map(map_file)
+    for _ in range(10): model.add_fruit()
+
+# main loop (the engine steps the server and the model at FPS frames per second)
+if shards:
+    from shards import ShardedWorld
+    world = ShardedWorld(port, map_file, shards, interest)
+    world.run()
+elif use_rooms:
+    from rooms import RoomServer
+    from engine import Engine
+    server = RoomServer(port, [map_file], interest)
+    engine = Engine(None, controllers = [server])
+    engine.run()
+elif use_async:
+    from async_network import AsyncServerController
+    import asyncio
+    server = AsyncServerController(model, port, interest)
+    asyncio.run(server.serve())
+else:
+    from network import NetworkServerController
+    from engine import Engine
+    server = NetworkServerController(model, port, interest)
+    engine = Engine(model, controllers = [server])
+    engine.run()
 
 # quit
 print("Game Over!")
-pygame.quit()
@@ -0,0 +1,85 @@
+# -*- coding: Utf-8 -*
+
+from model import *
+import time
+
+################################################################################
+#                                 ENGINE                                       #
+################################################################################
+
+### Constants ###
+
+STEP = 1000 / FPS # duration of a simulation step (in ms)
+MAX_STEPS = 5 # max number of steps run in a single advance, to let a late engine catch up
+
+### Class Engine ###
+
+# Headless engine: it advances the model (and its controllers) in fixed-size
+# steps, without any pygame dependency. It can either follow the wall clock
+# (run) or go as fast as possible (run_steps), e.g. for benchmarks. Without a
+# model, the controllers step their own models. The duration of each step,
+# controllers and model included, is counted in the `totals` of the
+# controllers that keep them (see network.LoadStats).
+
+class Engine:
+
+    # initialize engine
+    def __init__(self, model, step = STEP, controllers = None):
+        self.model = model
+        self.step = step
+        self.controllers = controllers if controllers is not None else []
+        self.totals = [ controller.totals for controller in self.controllers if hasattr(controller, "totals") ]
+        self.accumulator = 0 # wall time not yet simulated (in ms)
+        self.ticks = 0 # number of steps done
+        self.time = 0 # simulated time (in ms)
+        self.running = False
+
+    # advance the world by exactly one step
+    def tick(self):
+        start = time.perf_counter()
+        for controller in self.controllers:
+            controller.tick(self.step)
+        if self.model is not None: self.model.tick(self.step)
+        duration = time.perf_counter() - start
+        for totals in self.totals: totals.tick(duration)
+        self.ticks += 1
+        self.time += self.step
+
+    # advance the world by `dt` ms of wall time, return the number of steps done
+    def advance(self, dt):
+        self.accumulator += dt
+        steps = 0
+        while self.accumulator >= self.step:
+            if steps == MAX_STEPS:
+                # too late, drop the remaining time rather than spiral down
+                self.accumulator = 0
+                break
+            self.tick()
+            self.accumulator -= self.step
+            steps += 1
+        return steps
+
+    # run `count` steps as fast as possible, return the elapsed wall time (in s)
+    def run_steps(self, count):
+        start = time.perf_counter()
+        for _ in range(count):
+            self.tick()
+        return time.perf_counter() - start
+
+    # run in real time until stopped, or during `duration` ms
+    def run(self, duration = None):
+        self.running = True
+        last = time.perf_counter()
+        end = None if duration is None else last + duration/1000
+        while self.running:
+            now = time.perf_counter()
+            if end is not None and now >= end: break
+            self.advance((now - last)*1000)
+            last = now
+            wait = self.step - self.accumulator
+            if wait > 0: time.sleep(wait/1000)
+        self.running = False
+
+    # stop a running engine (at the end of the current step)
+    def stop(self):
+        self.running = False
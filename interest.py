@@ -0,0 +1,52 @@
+# -*- coding: Utf-8 -*
+
+from model import *
+
+################################################################################
+#                            INTEREST MANAGEMENT                               #
+################################################################################
+
+# The map is divided in square cells of `cell` tiles, and a client only gets
+# what happens in the cells at most `radius` cells away from the cell of its
+# character. With a cell of one tile, the region is a square of radius
+# `radius` tiles around the character.
+
+### Constants ###
+
+CELL = 8 # size of a cell (in tiles)
+RADIUS = 1 # view radius (in cells)
+
+### Class InterestManager ###
+
+class InterestManager:
+
+    def __init__(self, cell = CELL, radius = RADIUS):
+        self.cell = cell
+        self.radius = radius
+
+    def cell_of(self, pos):
+        return (pos[X] // self.cell, pos[Y] // self.cell)
+
+    # is position `pos` in the region of a viewer at position `center`
+    def sees(self, center, pos):
+        (cx, cy) = self.cell_of(center)
+        (x, y) = self.cell_of(pos)
+        return abs(x - cx) <= self.radius and abs(y - cy) <= self.radius
+
+    # keys of the records of a state (see Model.state), by cell
+    def index(self, state):
+        cells = {}
+        for (key, values) in state.items():
+            pos = (values[2], values[3]) if key[0] == "C" else (key[1], key[2])
+            cells.setdefault(self.cell_of(pos), []).append(key)
+        return cells
+
+    # records of a state (indexed by `cells`) in the region of a viewer at position `center`
+    def view(self, state, cells, center):
+        (cx, cy) = self.cell_of(center)
+        view = {}
+        for x in range(cx - self.radius, cx + self.radius + 1):
+            for y in range(cy - self.radius, cy + self.radius + 1):
+                for key in cells.get((x, y), ()):
+                    view[key] = state[key]
+        return view
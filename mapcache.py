@@ -0,0 +1,140 @@
+# -*- coding: Utf-8 -*
+
+from model import *
+import base64
+import os
+import struct
+import zlib
+
+################################################################################
+#                                  MAP CACHE                                   #
+################################################################################
+
+# Maps are designated by the digest of their content (see Map.digest), which
+# the server gives in its welcome, after the path of the map:
+#
+#   WELC <kind> <health> <x> <y> <path> <digest>
+#
+# A client that has no map with this digest asks the server for it:
+#
+#   GETM <digest>                           (client)
+#   MAPD <digest> <part> <parts> <data>     (server)
+#
+# where the <data> of the <parts> messages make the map in a compact encoding:
+# the zlib compression of "<width> <height>\n" followed by the tiles, in base64.
+# The client keeps the maps it has parsed or received in memory, and their
+# compact encoding on disk, in a file of MAP_CACHE named after their digest.
+
+### Constants ###
+
+MAP_CACHE = "maps/cache" # directory of the maps received, None to keep them in memory only
+DIGEST_SIZE = 32 # length of a digest (hex)
+MAP_PART_SIZE = 60000 # max size of the data of a MAPD message, sent in a text frame
+
+### Functions ###
+
+# compact encoding of a map (bytes)
+def pack_map(m):
+    m.page_in(0, 0, m.width, m.height)
+    return zlib.compress(b"%d %d\n" % (m.width, m.height) + bytes(m.tiles))
+
+def unpack_map(data):
+    (header, tiles) = zlib.decompress(data).split(b"\n", 1)
+    (width, height) = (int(field) for field in header.split())
+    if len(tiles) != width*height: raise ValueError("bad map size")
+    m = Map()
+    m.set_tiles(width, height, tiles)
+    return m
+
+# messages carrying a map to a client
+def map_messages(m, size = MAP_PART_SIZE):
+    data = base64.b64encode(pack_map(m)).decode()
+    chunks = [ data[i:i+size] for i in range(0, len(data), size) ]
+    return [ "MAPD {} {} {} {}".format(m.digest(), part, len(chunks), chunk) for (part, chunk) in enumerate(chunks) ]
+
+# digests come from the server, and name files: only accept hex ones
+def valid_digest(digest):
+    return len(digest) == DIGEST_SIZE and all(c in "0123456789abcdef" for c in digest)
+
+### Class MapCache ###
+
+class MapCache:
+
+    def __init__(self, directory = MAP_CACHE):
+        self.directory = directory
+        self.maps = {} # digest -> map
+        self.paths = {} # path -> digest of the maps parsed from a file
+        self.parts = {} # digest -> data of the parts received so far
+
+    # map of a given digest, looked up in memory, then on disk, then in the
+    # file `path` if its content matches; None if we don't have it. Without
+    # digest (older servers only send the path), the map of the file.
+    def find(self, digest, path):
+        if digest is None: digest = self.paths.get(path)
+        if digest in self.maps:
+            return self.maps[digest]
+        m = self.load(digest) if digest else None
+        if m is None: m = self.parse(path, digest)
+        return m
+
+    # keep a map, in memory and on disk
+    def add(self, m, data = None):
+        self.maps[m.digest()] = m
+        self.save(m, data)
+
+    def load(self, digest):
+        if not self.directory or not valid_digest(digest): return None
+        try:
+            with open(os.path.join(self.directory, digest), "rb") as _file:
+                m = unpack_map(_file.read())
+        except (OSError, ValueError, zlib.error):
+            return None
+        if m.digest() != digest: return None
+        self.maps[digest] = m
+        return m
+
+    def parse(self, path, digest):
+        try:
+            m = open_map(path)
+        except (OSError, IndexError, ValueError, struct.error):
+            return None
+        if digest is not None and m.digest() != digest: return None
+        # the file is already on disk
+        self.paths[path] = m.digest()
+        self.maps[m.digest()] = m
+        return m
+
+    def save(self, m, data = None):
+        if not self.directory: return
+        cache = os.path.join(self.directory, m.digest())
+        try:
+            os.makedirs(self.directory, exist_ok = True)
+            with open(cache + ".tmp", "wb") as _file:
+                _file.write(data if data is not None else pack_map(m))
+            os.replace(cache + ".tmp", cache)
+        except OSError:
+            print("Warning: can't save the map in \"{}\"".format(cache))
+
+    # handle a MAPD message, return the map once complete (None before, or if
+    # the map received is not the expected one)
+    def receive(self, message):
+        (digest, part, count, chunk) = message.split(" ", 4)[1:]
+        parts = self.parts.setdefault(digest, [])
+        if int(part) != len(parts):
+            print("Error: unexpected part {} of map {}".format(part, digest))
+            del self.parts[digest]
+            return None
+        parts.append(chunk)
+        if len(parts) < int(count): return None
+        del self.parts[digest]
+        try:
+            data = base64.b64decode("".join(parts))
+            m = unpack_map(data)
+        except (ValueError, zlib.error):
+            print("Error: can't decode map {}".format(digest))
+            return None
+        if m.digest() != digest:
+            print("Error: map {} does not match its digest".format(digest))
+            return None
+        self.add(m, data)
+        return m
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: Utf-8 -*
+
+from model import *
+import random
+import sys
+
+################################################################################
+#                                MAP GENERATOR                                 #
+################################################################################
+
+# Maps of any size, generated row by row from a seed, so that the same seed
+# always gives the same map: walls around, pillars on the tiles of even
+# coordinates as in the classic maps, and corridors on the odd rows. On the
+# even rows, the tiles between the pillars are either walls or passages
+# between the corridors above and below, with at least one passage per row,
+# so that every tile that is not a wall can be reached from any other. The
+# background changes by zones of ZONE x ZONE tiles, and teleporters are
+# spread over the corridors.
+
+### Constants ###
+
+WALLS_RATE = 0.3 # probability of a wall between two pillars
+ZONE = 32 # side of the zones of the same background (in tiles)
+TELEPORTERS = 1 # teleporters per map
+
+### Functions ###
+
+# translation tables of random bytes to the tiles between the pillars, by background
+def wall_tables():
+    threshold = round(WALLS_RATE * 256)
+    tables = {}
+    for background in BACKGROUNDS:
+        tiles = [ 'w' if b < threshold // 2 else 'z' if b < threshold else background for b in range(256) ]
+        tables[background] = "".join(tiles).encode()
+    return tables
+
+# rows of a generated map (bytes)
+def generate_rows(width, height, seed = None, teleporters = TELEPORTERS):
+    if width < 3 or height < 3: raise ValueError("a map is at least 3x3")
+    rng = random.Random(seed)
+    tables = wall_tables()
+    zones = range(0, width, ZONE)
+    # teleporters, on the corridors: y -> x
+    spots = {}
+    for _ in range(teleporters):
+        (x, y) = (rng.randrange(1, width - 1), rng.randrange(1, height - 1, 2))
+        # keep a tile to start on, even on the smallest maps
+        if (x, y) != (1, 1): spots.setdefault(y, []).append(x)
+    pillars = b'x' * len(range(0, width, 2))
+    for y in range(height):
+        if y == 0 or y == height - 1:
+            yield b'x' * width
+            continue
+        if y % ZONE == 0 or y == 1:
+            backgrounds = [ rng.choice(BACKGROUNDS) for _ in zones ]
+            corridor = b''.join(backgrounds[i].encode() * min(ZONE, width - x) for (i, x) in enumerate(zones))
+        if y % 2 == 1:
+            row = bytearray(corridor)
+            for x in spots.get(y, ()): row[x] = ord(TELEPORTER)
+        else:
+            noise = rng.randbytes(width)
+            row = bytearray(b''.join(noise[x:x+ZONE].translate(tables[backgrounds[i]]) for (i, x) in enumerate(zones)))
+            row[0::2] = pillars
+            # a passage between the corridors above and below
+            x = rng.randrange(1, width - 1, 2)
+            row[x] = corridor[x]
+        row[0] = row[width-1] = ord('x')
+        yield bytes(row)
+
+# generated map, in memory
+def generate_map(width, height, seed = None, teleporters = TELEPORTERS):
+    m = Map()
+    m.set_tiles(width, height, b''.join(generate_rows(width, height, seed, teleporters)))
+    return m
+
+# write a generated map, as text or as a chunked file
+def write_map(filename, width, height, seed = None, teleporters = TELEPORTERS, chunked = False):
+    rows = generate_rows(width, height, seed, teleporters)
+    if chunked:
+        write_chunked_map(filename, width, height, rows)
+        return
+    with open(filename, "wb") as _file:
+        for row in rows:
+            _file.write(row + b'\n')
+
+################################################################################
+#                                 MAIN                                         #
+################################################################################
+
+if __name__ == "__main__":
+    options = [ arg for arg in sys.argv[1:] if arg.startswith("--") ]
+    args = [ arg for arg in sys.argv[1:] if not arg.startswith("--") ]
+    if len(args) != 3:
+        print("Usage: {} width height map_file [--seed=N] [--teleporters=N] [--chunked]".format(sys.argv[0]))
+        sys.exit()
+    seed = next((int(arg.split("=")[1]) for arg in options if arg.startswith("--seed=")), None)
+    teleporters = next((int(arg.split("=")[1]) for arg in options if arg.startswith("--teleporters=")), TELEPORTERS)
+    write_map(args[2], int(args[0]), int(args[1]), seed, teleporters, "--chunked" in options)
+    print("=> map \"{}\" of size {}x{} generated".format(args[2], args[0], args[1]))
@@ -1,7 +1,10 @@
 # -*- coding: Utf-8 -*
 # Author: aurelien.esnard@u-bordeaux.fr
 
+import hashlib
+import mmap
 import random
+import struct
 import sys
 
 ################################################################################
@@ -10,6 +13,9 @@ import sys
 
 ### Constants ###
 
+# time
+FPS = 60
+
 # position / direction
 X = 0
 Y = 1
@@ -24,6 +30,19 @@ DIRECTIONS_STR = ["left", "right", "up", "down"]
 WALLS = ('w', 'x', 'z')
 BACKGROUNDS = ('0', '1', '2')
 DEFAULT_MAP = "maps/map0"
+TELEPORTER = '3'
+
+# chunked map files, see ChunkedMap
+CHUNK = 64 # side of a chunk (in tiles), so that a chunk fills a page
+CHUNKED_MAGIC = b"BMAP"
+CHUNKED_HEADER = struct.Struct("!4sIII16s") # magic, width, height, chunk side, digest
+CHUNKED_OFFSET = 4096 # the chunks start on a page boundary
+
+# tile flags, indexed by tile byte
+WALKABLE = 1 # characters can walk on the tile
+PASSABLE = 2 # a blast goes through the tile (background)
+TILE_FLAGS = bytes((0 if chr(b) in WALLS else WALKABLE) | (PASSABLE if chr(b) in BACKGROUNDS else 0) for b in range(256))
+PASSABLE_BYTES = bytes(1 if chr(b) in BACKGROUNDS else 0 for b in range(256)) # translation table
 
 # fruit
 BANANA = 0
@@ -38,49 +57,332 @@ BATMAN = 2
 CHARACTERS = [DK, LINK, BATMAN]
 CHARACTERS_STR = ["dk", "link", "batman"]
 HEALTH = 50
-MAX_RANGE = 5
+MAX_RANGE = 5 # at most 15, blast extents are stored on 4 bits
 COUNTDOWN = 5
 IMMUNITY = 1500 # in ms
 DISARMED = 2000 # in ms
 
+### Class Occupancy ###
+
+# per-tile index of the objects (characters, fruits or bombs) lying on a map
+
+class Occupancy:
+    def __init__(self):
+        self.tiles = {} # (x,y) -> list of objects
+
+    def add(self, obj):
+        self.tiles.setdefault(obj.pos, []).append(obj)
+
+    def remove(self, obj):
+        objs = self.tiles.get(obj.pos)
+        if objs and obj in objs:
+            objs.remove(obj)
+            if not objs: del self.tiles[obj.pos]
+
+    # move an object to a new position and update the index accordingly
+    def move(self, obj, pos):
+        self.remove(obj)
+        obj.pos = pos
+        self.add(obj)
+
+    # objects at position `pos` (a copy, safe to modify the index while iterating)
+    def get(self, pos):
+        return list(self.tiles.get(pos, ()))
+
+    def clear(self):
+        self.tiles = {}
+
+### Class MapRows ###
+
+# read-only view on the rows of a map, for the `m.array[y][x]` callers
+
+class MapRows:
+    def __init__(self, m):
+        self.map = m
+
+    def __len__(self):
+        return self.map.height
+
+    def __getitem__(self, y):
+        if y < 0: y += self.map.height
+        if y < 0 or y >= self.map.height: raise IndexError("map row out of range")
+        self.map.page_in(0, y, self.map.width, y+1)
+        i = y*self.map.width
+        return self.map.tiles[i:i+self.map.width].decode("latin-1")
+
+    def __iter__(self):
+        for y in range(self.map.height):
+            yield self[y]
+
 ### Class Map ###
 
+# The map is stored as a flat bytearray of tiles (one byte per tile, row by row),
+# tile (x,y) being at index y*width+x.
+
 class Map:
     def __init__(self):
-        self.array = []
+        self.tiles = bytearray()
         self.width = 0
         self.height = 0
+        self.version = 0 # incremented each time the tiles change, so that views can cache them
+        self.blast = None # blast extents of a bomb on each tile, see build_blast()
+        self.hashed = None # (version, digest) of the tiles, see digest()
+        # occupancy indexes, kept up to date by the model
+        self.characters_at = Occupancy()
+        self.fruits_at = Occupancy()
+        self.bombs_at = Occupancy()
+
+    # rows of the map as strings (read-only)
+    @property
+    def array(self):
+        return MapRows(self)
 
     def load(self, filename):
-        with open(filename, "r") as _file:
-            _array = []
-            for row in _file:
-                _row = []
-                for square in row:
-                    if square != '\n':
-                        _row.append(square)
-                _array.append(_row)
-            self.array = _array
-            self.height = len(self.array)
-            self.width = len(self.array[0])
+        with open(filename, "rb") as _file:
+            rows = [ row.rstrip(b'\r') for row in _file.read().split(b'\n') ]
+        while rows and not rows[-1]: rows.pop()
+        width = len(rows[0])
+        self.set_tiles(width, len(rows), b''.join(row[:width].ljust(width, b' ') for row in rows))
+
+    # generate a map of size `width`x`height`, with walls around and pillars inside
+    def generate(self, width, height):
+        border = b'x' * width
+        odd = bytearray(b'0' * width)
+        odd[0] = odd[width-1] = ord('x')
+        even = bytearray(odd)
+        even[0::2] = b'x' * len(range(0, width, 2))
+        rows = [ border if y == 0 or y == height-1 else (even if y % 2 == 0 else odd) for y in range(height) ]
+        self.set_tiles(width, height, b''.join(rows))
+
+    # use the tiles of a map of size `width`x`height`, row by row
+    def set_tiles(self, width, height, tiles):
+        self.tiles = bytearray(tiles)
+        self.height = height
+        self.width = width
+        self.version += 1
+        self.build_blast()
+
+    # content digest of the map (hex), computed again only when the tiles change
+    def digest(self):
+        if self.hashed is None or self.hashed[0] != self.version:
+            data = b"%d %d\n" % (self.width, self.height) + self.tiles
+            self.hashed = (self.version, hashlib.blake2b(data, digest_size = 16).hexdigest())
+        return self.hashed[1]
+
+    # make sure the tiles of a region (x1 and y1 excluded) are in memory,
+    # they always are but in chunked maps
+    def page_in(self, x0, y0, x1, y1):
+        pass
 
     def get_tile(self, x, y):
-        return self.array[y][x]
+        return chr(self.tiles[y*self.width+x])
+
+    # change a tile, the blast table is rebuilt when next needed
+    def set_tile(self, x, y, tile):
+        self.tiles[y*self.width+x] = ord(tile)
+        self.version += 1
+        self.blast = None
+
+    def walkable(self, x, y):
+        return TILE_FLAGS[self.tiles[y*self.width+x]] & WALKABLE != 0
+
+    def passable(self, x, y):
+        return TILE_FLAGS[self.tiles[y*self.width+x]] & PASSABLE != 0
+
+    # build the table of blast extents for a bomb of range MAX_RANGE on every tile:
+    # 2 bytes per tile, (right << 4 | left) then (down << 4 | up), where each extent
+    # counts the background tiles reached in that direction, bomb tile included
+    def build_blast(self):
+        # The whole map is handled as a big integer with one 8-bit lane per tile,
+        # set to 1 for background tiles. A zero lane ends each row, so that runs
+        # stop at the edges. Shifting by k tiles (or k rows) and and-ing gives
+        # the lanes where the k next tiles are backgrounds, and summing these
+        # masks for k < MAX_RANGE gives the extent in each lane.
+        width = self.width
+        stride = width + 1
+        lanes = bytearray(stride*self.height)
+        passable = self.tiles.translate(PASSABLE_BYTES)
+        for y in range(self.height):
+            lanes[y*stride:y*stride+width] = passable[y*width:(y+1)*width]
+        p = int.from_bytes(lanes, "little")
+        mask = (1 << (8*len(lanes))) - 1
+
+        def extent(step):
+            run = total = p
+            for k in range(1, MAX_RANGE):
+                if step > 0: run &= p >> (8*step*k)
+                else: run &= (p << (-8*step*k)) & mask
+                total += run
+            return total
+
+        horizontal = (extent(-1) + (extent(1) << 4)).to_bytes(len(lanes), "little")
+        vertical = (extent(-stride) + (extent(stride) << 4)).to_bytes(len(lanes), "little")
+        blast = bytearray(2*width*self.height)
+        blast[0::2] = b''.join(horizontal[y*stride:y*stride+width] for y in range(self.height))
+        blast[1::2] = b''.join(vertical[y*stride:y*stride+width] for y in range(self.height))
+        self.blast = blast
+
+    # blast range [xmin, xmax, ymin, ymax] of a bomb at position `pos`
+    def blast_range(self, pos, max_range = MAX_RANGE):
+        if max_range != MAX_RANGE: return self.cast_blast(pos, max_range)
+        if self.blast is None: self.build_blast()
+        i = 2*(pos[Y]*self.width + pos[X])
+        h = self.blast[i]
+        v = self.blast[i+1]
+        return [pos[X]-(h & 15)+1, pos[X]+(h >> 4)-1, pos[Y]-(v & 15)+1, pos[Y]+(v >> 4)-1]
+
+    # compute the blast range by casting rays from `pos` (slow, no table)
+    def cast_blast(self, pos, max_range = MAX_RANGE):
+        for xmax in range(pos[X], pos[X]+max_range+1):
+            if xmax >= self.width or not self.passable(xmax, pos[Y]): break
+        for ymax in range(pos[Y], pos[Y]+max_range+1):
+            if ymax >= self.height or not self.passable(pos[X], ymax): break
+        for xmin in range(pos[X], pos[X]-max_range-1, -1):
+            if xmin < 0 or not self.passable(xmin, pos[Y]): break
+        for ymin in range(pos[Y], pos[Y]-max_range-1, -1):
+            if ymin < 0 or not self.passable(pos[X], ymin): break
+        return [xmin+1, xmax-1, ymin+1, ymax-1]
 
     def random(self):
         while True:
             x = random.randint(0, self.width-1)
             y = random.randint(0, self.height-1)
-            if self.array[y][x] in BACKGROUNDS:
+            if self.passable(x, y):
                 break
         return (x,y)
 
+### Class ChunkedMap ###
+
+# Large map read from a chunked file, which starts with a header (see
+# CHUNKED_HEADER) padded to CHUNKED_OFFSET bytes, followed by the tiles in
+# chunks of CHUNK x CHUNK tiles, row by row in each chunk, and chunk by chunk
+# in each row of chunks (the chunks on the right and bottom edges are padded
+# with walls). The file is memory-mapped, and a chunk is copied to the tiles,
+# kept row by row in an anonymous mapping whose pages only take memory once
+# written, the first time a tile of the chunk is looked at. The blast table is
+# built by chunk as well, when a bomb is dropped in the chunk.
+
+class ChunkedMap(Map):
+    def __init__(self):
+        super().__init__()
+        self.data = None # mapping of the file
+        self.loaded = bytearray() # 1 for the chunks copied to the tiles
+        self.columns = 0 # chunks per row
+        self.blasts = {} # chunk -> (x, y, map of the chunk and its surroundings)
+        self.stored = None # (version, digest) given by the file
+
+    def load(self, filename):
+        with open(filename, "rb") as _file:
+            (magic, width, height, chunk, digest) = CHUNKED_HEADER.unpack(_file.read(CHUNKED_HEADER.size))
+            if magic != CHUNKED_MAGIC or chunk != CHUNK: raise ValueError("not a chunked map: " + filename)
+            self.data = mmap.mmap(_file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.width = width
+        self.height = height
+        self.columns = (width + CHUNK - 1) // CHUNK
+        self.loaded = bytearray(self.columns * ((height + CHUNK - 1) // CHUNK))
+        self.tiles = mmap.mmap(-1, max(1, width*height))
+        self.blasts = {}
+        self.version += 1
+        self.stored = (self.version, digest.hex())
+
+    def page_in(self, x0, y0, x1, y1):
+        for cy in range(max(0, y0) // CHUNK, (min(y1, self.height) - 1) // CHUNK + 1):
+            for cx in range(max(0, x0) // CHUNK, (min(x1, self.width) - 1) // CHUNK + 1):
+                if not self.loaded[cy*self.columns + cx]: self.copy_chunk(cx, cy)
+
+    def copy_chunk(self, cx, cy):
+        source = CHUNKED_OFFSET + (cy*self.columns + cx)*CHUNK*CHUNK
+        x = cx*CHUNK
+        width = min(CHUNK, self.width - x)
+        for y in range(cy*CHUNK, min((cy+1)*CHUNK, self.height)):
+            i = y*self.width + x
+            self.tiles[i:i+width] = self.data[source:source+width]
+            source += CHUNK
+        self.loaded[cy*self.columns + cx] = 1
+
+    def get_tile(self, x, y):
+        if not self.loaded[(y // CHUNK)*self.columns + x // CHUNK]: self.copy_chunk(x // CHUNK, y // CHUNK)
+        return chr(self.tiles[y*self.width+x])
+
+    def set_tile(self, x, y, tile):
+        if not self.loaded[(y // CHUNK)*self.columns + x // CHUNK]: self.copy_chunk(x // CHUNK, y // CHUNK)
+        self.tiles[y*self.width+x] = ord(tile)
+        self.version += 1
+        self.blasts = {}
+
+    def walkable(self, x, y):
+        if not self.loaded[(y // CHUNK)*self.columns + x // CHUNK]: self.copy_chunk(x // CHUNK, y // CHUNK)
+        return TILE_FLAGS[self.tiles[y*self.width+x]] & WALKABLE != 0
+
+    def passable(self, x, y):
+        if not self.loaded[(y // CHUNK)*self.columns + x // CHUNK]: self.copy_chunk(x // CHUNK, y // CHUNK)
+        return TILE_FLAGS[self.tiles[y*self.width+x]] & PASSABLE != 0
+
+    # the blast table is built by chunk, see blast_range
+    def build_blast(self):
+        self.blasts = {}
+
+    def blast_range(self, pos, max_range = MAX_RANGE):
+        if max_range != MAX_RANGE: return self.cast_blast(pos, max_range)
+        chunk = (pos[X] // CHUNK, pos[Y] // CHUNK)
+        if chunk not in self.blasts:
+            # the chunk, and the tiles a blast from it may reach
+            x0 = max(0, chunk[X]*CHUNK - MAX_RANGE + 1)
+            y0 = max(0, chunk[Y]*CHUNK - MAX_RANGE + 1)
+            x1 = min(self.width, (chunk[X]+1)*CHUNK + MAX_RANGE - 1)
+            y1 = min(self.height, (chunk[Y]+1)*CHUNK + MAX_RANGE - 1)
+            self.page_in(x0, y0, x1, y1)
+            m = Map()
+            m.set_tiles(x1 - x0, y1 - y0, b''.join(self.tiles[y*self.width+x0:y*self.width+x1] for y in range(y0, y1)))
+            self.blasts[chunk] = (x0, y0, m)
+        (x0, y0, m) = self.blasts[chunk]
+        (xmin, xmax, ymin, ymax) = m.blast_range((pos[X] - x0, pos[Y] - y0))
+        return [xmin + x0, xmax + x0, ymin + y0, ymax + y0]
+
+    # the digest of the file, as long as the tiles have not changed
+    def digest(self):
+        if self.stored[0] == self.version: return self.stored[1]
+        self.page_in(0, 0, self.width, self.height)
+        return super().digest()
+
+### Functions ###
+
+def chunked_map(filename):
+    with open(filename, "rb") as _file:
+        return _file.read(len(CHUNKED_MAGIC)) == CHUNKED_MAGIC
+
+# map loaded from a file, text or chunked
+def open_map(filename):
+    m = ChunkedMap() if chunked_map(filename) else Map()
+    m.load(filename)
+    return m
+
+# write a chunked map file from the rows of a map (bytes), read only once
+def write_chunked_map(filename, width, height, rows):
+    digest = hashlib.blake2b(b"%d %d\n" % (width, height), digest_size = 16)
+    with open(filename, "wb") as _file:
+        _file.write(bytes(CHUNKED_OFFSET))
+        band = []
+        y = -1
+        for (y, row) in enumerate(rows):
+            if len(row) != width: raise ValueError("row {} of size {} instead of {}".format(y, len(row), width))
+            digest.update(row)
+            band.append(row)
+            if len(band) == CHUNK or y == height - 1:
+                band += [ b'x' * width ] * (CHUNK - len(band))
+                for x in range(0, width, CHUNK):
+                    _file.write(b''.join(row[x:x+CHUNK].ljust(CHUNK, b'x') for row in band))
+                band = []
+        if y != height - 1: raise ValueError("{} rows instead of {}".format(y + 1, height))
+        _file.seek(0)
+        _file.write(CHUNKED_HEADER.pack(CHUNKED_MAGIC, width, height, CHUNK, digest.digest()))
+
 ### Class Fruit ###
 
 class Fruit:
     def __init__(self, kind, m, pos):
         self.map = m
-        self.pos = pos
+        self.pos = tuple(pos)
         self.kind = kind
 
 ### Class Bomb ###
@@ -88,20 +390,18 @@ class Fruit:
 class Bomb:
     def __init__(self, m, pos):
         self.map = m
-        self.pos = pos
+        self.pos = tuple(pos)
         self.max_range = MAX_RANGE
         self.countdown = COUNTDOWN
         self.time_to_explode = (COUNTDOWN+1)*1000-1 # in ms
-        # compute bomb range
-        for xmax in range(self.pos[X], self.pos[X]+self.max_range+1):
-            if xmax >= m.width or self.map.array[self.pos[Y]][xmax] not in BACKGROUNDS: break
-        for ymax in range(self.pos[Y], self.pos[Y]+self.max_range+1):
-            if ymax >= m.height or self.map.array[ymax][self.pos[X]] not in BACKGROUNDS: break
-        for xmin in range(self.pos[X], self.pos[X]-self.max_range-1, -1):
-            if xmin < 0 or self.map.array[self.pos[Y]][xmin] not in BACKGROUNDS: break
-        for ymin in range(self.pos[Y], self.pos[Y]-self.max_range-1, -1):
-            if ymin < 0 or self.map.array[ymin][self.pos[X]] not in BACKGROUNDS: break
-        self.range = [xmin+1, xmax-1, ymin+1, ymax-1]
+        # bomb range, looked up in the blast table of the map
+        self.range = m.blast_range(self.pos, self.max_range)
+
+    # tiles reached by the blast
+    def blast(self):
+        tiles = [(x, self.pos[Y]) for x in range(self.range[DIRECTION_LEFT], self.range[DIRECTION_RIGHT]+1)]
+        tiles += [(self.pos[X], y) for y in range(self.range[DIRECTION_UP], self.range[DIRECTION_DOWN]+1) if y != self.pos[Y]]
+        return tiles
 
     def tick(self, dt):
         # subtract the passed time `dt` from the timer each frame
@@ -121,34 +421,37 @@ class Character:
         self.immunity = 0 # the character gets immunity against bomb during this time (in ms)
         self.disarmed = 0 # the character cannot drop a bomb during this time (in ms)
         self.nickname = nickname
-        self.pos = pos
+        self.pos = tuple(pos)
         self.direction = DIRECTION_RIGHT
 
     def move(self, direction):
+        pos = self.pos
         # move right
         if direction == DIRECTION_RIGHT:
             if self.pos[X] < (self.map.width - 1):
-                if self.map.array[self.pos[Y]][self.pos[X] + 1] not in WALLS:
-                    self.pos = (self.pos[X]+1, self.pos[Y])
+                if self.map.walkable(self.pos[X] + 1, self.pos[Y]):
+                    pos = (self.pos[X]+1, self.pos[Y])
             self.direction = DIRECTION_RIGHT
         # move left
         elif direction == DIRECTION_LEFT:
             if self.pos[X] > 0:
-                if self.map.array[self.pos[Y]][self.pos[X] - 1] not in WALLS:
-                    self.pos = (self.pos[X]-1, self.pos[Y])
+                if self.map.walkable(self.pos[X] - 1, self.pos[Y]):
+                    pos = (self.pos[X]-1, self.pos[Y])
             self.direction = DIRECTION_LEFT
         # move up
         elif direction == DIRECTION_UP:
             if self.pos[Y] > 0:
-                if self.map.array[self.pos[Y] - 1][self.pos[X]] not in WALLS:
-                    self.pos = (self.pos[X], self.pos[Y]-1)
+                if self.map.walkable(self.pos[X], self.pos[Y] - 1):
+                    pos = (self.pos[X], self.pos[Y]-1)
             self.direction = DIRECTION_UP
         # move down
         elif direction == DIRECTION_DOWN:
             if self.pos[Y] < (self.map.height - 1):
-                if self.map.array[self.pos[Y] + 1][self.pos[X]] not in WALLS:
-                    self.pos = (self.pos[X], self.pos[Y]+1)
+                if self.map.walkable(self.pos[X], self.pos[Y] + 1):
+                    pos = (self.pos[X], self.pos[Y]+1)
             self.direction = DIRECTION_DOWN
+        if pos != self.pos:
+            self.map.characters_at.move(self, pos)
 
     def eat(self, fruit):
         if fruit.pos[X] == self.pos[X] and fruit.pos[Y] == self.pos[Y]:
@@ -189,16 +492,20 @@ class Model:
         self.fruits = []
         self.bombs = []
         self.player = None
+        self.nicknames = {} # nickname -> character
+        self.time = 0 # simulated time (in ms)
 
     # look for a character, return None if not found
     def look(self, nickname):
-        # https://stackoverflow.com/questions/9542738/python-find-in-list
-        character = next( (c for c in self.characters if (c.nickname == nickname)), None) # first occurence
-        return character
+        return self.nicknames.get(nickname)
 
     # load map from file
     def load_map(self, filename):
         self.mappath = filename
+        # large maps may come in chunked files
+        chunked = chunked_map(filename)
+        if chunked != isinstance(self.map, ChunkedMap):
+            self.map = ChunkedMap() if chunked else Map()
         self.map.load(filename)
         print("=> load map \"{}\" of size {}x{}".format(filename, self.map.width, self.map.height))
 
@@ -207,6 +514,8 @@ class Model:
         character = self.look(nickname)
         try:
             self.characters.remove(character)
+            self.map.characters_at.remove(character)
+            del self.nicknames[nickname]
             print("=> kill \"{}\"".format(nickname))
             return True
         except:
@@ -227,29 +536,40 @@ class Model:
     def add_fruit(self, kind = None, pos = None):
         if pos is None: pos = self.map.random()
         if kind is None: kind = random.choice(FRUITS)
-        self.fruits.append(Fruit(kind, self.map, pos))
+        fruit = Fruit(kind, self.map, pos)
+        self.fruits.append(fruit)
+        self.map.fruits_at.add(fruit)
         print("=> add fruit ({}) at position ({},{})".format(FRUITS_STR[kind], pos[X], pos[Y]))
 
     # add a new character
     def add_character(self, nickname, isplayer = False, kind = None, pos = None):
         character = self.look(nickname)
-        try:
-            if pos is None: pos = self.map.random()
-            if kind is None: kind = random.choice(CHARACTERS)
-            character = Character(nickname, kind, self.map, pos)
-            print("=> add character \"{}\" ({}) as position ({},{})".format(nickname, CHARACTERS_STR[kind], pos[X], pos[Y]))
-            self.characters.append(character)
-            if isplayer: self.player = character
-        except:
+        if character:
             print("Error: nickname \"{}\" already used!".format(nickname))
+            return character
+        if pos is None: pos = self.map.random()
+        if kind is None: kind = random.choice(CHARACTERS)
+        character = Character(nickname, kind, self.map, pos)
+        print("=> add character \"{}\" ({}) as position ({},{})".format(nickname, CHARACTERS_STR[kind], pos[X], pos[Y]))
+        self.characters.append(character)
+        self.map.characters_at.add(character)
+        self.nicknames[nickname] = character
+        if isplayer: self.player = character
         return character
 
+    # add a new bomb
+    def add_bomb(self, pos):
+        bomb = Bomb(self.map, pos)
+        self.bombs.append(bomb)
+        self.map.bombs_at.add(bomb)
+        return bomb
+
     # drop a bomb
     def drop_bomb(self, nickname):
         character = self.look(nickname)
         try:
             if character.disarmed == 0:
-                self.bombs.append(Bomb(self.map, character.pos))
+                self.add_bomb(character.pos)
                 character.disarmed = DISARMED
             print("=> drop bomb at position ({},{})".format(character.pos[X], character.pos[Y]))
         except:
@@ -264,31 +584,106 @@ class Model:
         except:
             print("Error: nickname \"{}\" not found!".format(nickname))
 
+    # state of the world, as a dict of records: key -> values, where timers are
+    # stored as deadlines (in ms of model time), so that records only change
+    # on events. Bombs and fruits lying on the same tile with the same features
+    # are counted in a single record.
+    def state(self):
+        state = {}
+        for character in self.characters:
+            state[("C", character.nickname)] = self.record(character)
+        for bomb in self.bombs:
+            key = ("B", bomb.pos[X], bomb.pos[Y], round(self.time + bomb.time_to_explode))
+            state[key] = (state[key][0] + 1,) if key in state else (1,)
+        for fruit in self.fruits:
+            key = ("F", fruit.pos[X], fruit.pos[Y], fruit.kind)
+            state[key] = (state[key][0] + 1,) if key in state else (1,)
+        return state
+
+    # values of the record of a character in the state
+    def record(self, character):
+        def deadline(timer):
+            return round(self.time + timer) if timer > 0 else 0
+        return (character.kind, character.health, character.pos[X], character.pos[Y], character.direction, deadline(character.immunity), deadline(character.disarmed))
+
+    # objects of the model matching a record key
+    def lookup(self, key):
+        if key[0] == "C":
+            character = self.look(key[1])
+            return [character] if character else []
+        if key[0] == "B":
+            return [ bomb for bomb in self.map.bombs_at.get((key[1], key[2])) if round(self.time + bomb.time_to_explode) == key[3] ]
+        return [ fruit for fruit in self.map.fruits_at.get((key[1], key[2])) if fruit.kind == key[3] ]
+
+    # update the model with changed records (key -> values, or None if removed)
+    def apply_state(self, changes):
+        for (key, values) in changes.items():
+            objects = self.lookup(key)
+            if key[0] == "C":
+                if values is None:
+                    if objects: self.kill_character(key[1])
+                    continue
+                (kind, health, x, y, direction, immunity, disarmed) = values
+                character = objects[0] if objects else self.add_character(key[1], False, kind, (x, y))
+                character.kind = kind
+                character.health = health
+                if character.pos != (x, y): self.map.characters_at.move(character, (x, y))
+                character.direction = direction
+                character.immunity = max(0, immunity - self.time) if immunity else 0
+                character.disarmed = max(0, disarmed - self.time) if disarmed else 0
+                continue
+            count = values[0] if values else 0
+            for obj in objects[count:]:
+                if key[0] == "B":
+                    self.bombs.remove(obj)
+                    self.map.bombs_at.remove(obj)
+                else:
+                    self.fruits.remove(obj)
+                    self.map.fruits_at.remove(obj)
+            for _ in range(len(objects), count):
+                if key[0] == "B":
+                    bomb = self.add_bomb((key[1], key[2]))
+                    bomb.tick(bomb.time_to_explode - (key[3] - self.time))
+                else:
+                    self.add_fruit(key[3], (key[1], key[2]))
+
     def empty_model(self):
         self.characters = []
         self.fruits = []
         self.bombs = []
+        self.nicknames = {}
+        self.map.characters_at.clear()
+        self.map.fruits_at.clear()
+        self.map.bombs_at.clear()
 
     # update model at each clock tick
     def tick(self, dt):
+        self.time += dt
+
         # update bombs (and remove it)
-        for bomb in self.bombs:
+        for bomb in self.bombs[:]:
             bomb.tick(dt)
             if bomb.countdown == -1:
                 self.bombs.remove(bomb)
+                self.map.bombs_at.remove(bomb)
 
-        # update characters and eat fruits
+        # update characters and eat fruits lying on their tile
         for character in self.characters:
             character.tick(dt)
-            for fruit in self.fruits:
+            for fruit in self.map.fruits_at.get(character.pos):
                 if character.eat(fruit):
                     self.fruits.remove(fruit)
+                    self.map.fruits_at.remove(fruit)
 
-        # update characters after bomb explosion
+        # update characters standing in the blast of exploding bombs
         for bomb in self.bombs:
-            for character in self.characters:
-                if character.explosion(bomb):
-                    self.characters.remove(character)
-                    if character == self.player:
-                        self.player = None
-                        exit()
+            if bomb.countdown != 0: continue
+            for pos in bomb.blast():
+                for character in self.map.characters_at.get(pos):
+                    if character.explosion(bomb):
+                        self.characters.remove(character)
+                        self.map.characters_at.remove(character)
+                        del self.nicknames[character.nickname]
+                        if character == self.player:
+                            self.player = None
+                            exit()
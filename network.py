@@ -2,9 +2,120 @@
 # Author: aurelien.esnard@u-bordeaux.fr
 
 from model import *
+from protocol import *
+from replication import *
+from mapcache import *
+import bisect
 import socket
 import select
+import selectors
 import random
+import threading
+import time
+import collections
+import errno
+import secrets
+
+### Constants ###
+
+BACKLOG = 128 # pending connections on the server socket
+STATS_PERIOD = 10*FPS # number of ticks between two traffic reports
+MAX_INPUTS = 2*FPS # max number of moves a client keeps until the server confirms them
+INPUT_TIMEOUT = 1 # time after which a move that is still not confirmed is considered lost (in s)
+POLL_TIMEOUT = 0.1 # time the client I/O thread waits for data before checking if it must stop (in s)
+TELEPORTS = { 7777: ("localhost", 7778), 7778: ("localhost", 7777) } # server port -> where its teleporters lead to
+SESSION_TIMEOUT = 5 # time a character handed over by another server waits for its client (in s)
+CHANNEL_TIMEOUT = 1 # max time to connect to another server (in s)
+TICK_BUCKETS = [ round(10 * 2**(i/4)) for i in range(60) ] # upper bounds of the buckets of tick durations, from 10 us to 275 ms (in us)
+
+### Class TrafficStats ###
+
+# Server traffic counters: syscalls, bytes sent, and frames encoded for the
+# broadcasts, averaged per tick since the last reset.
+
+class TrafficStats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ticks = 0
+        self.sends = 0 # send syscalls
+        self.recvs = 0 # recv syscalls
+        self.bytes = 0 # bytes sent
+        self.frames = 0 # broadcast frames encoded
+
+    # (sends, recvs, bytes, frames) per tick
+    def per_tick(self):
+        ticks = max(1, self.ticks)
+        return (self.sends / ticks, self.recvs / ticks, self.bytes / ticks, self.frames / ticks)
+
+    def __str__(self):
+        return "{:.1f} sends, {:.1f} recvs, {:.0f} bytes, {:.1f} frames per tick".format(*self.per_tick())
+
+### Class LoadStats ###
+
+# Server counters since its start, which load tools ask for (STAT): ticks,
+# messages handled, bytes sent up to the last traffic report, and the number
+# of ticks by duration, in the buckets of TICK_BUCKETS (then the longer ones).
+
+class LoadStats:
+
+    def __init__(self):
+        self.ticks = 0
+        self.messages = 0
+        self.bytes = 0
+        self.durations = [0] * (len(TICK_BUCKETS) + 1)
+
+    # count a tick of `duration` s
+    def tick(self, duration):
+        self.ticks += 1
+        self.durations[bisect.bisect_left(TICK_BUCKETS, duration * 1000000)] += 1
+
+### Class ClientStats ###
+
+# Client counters: messages handled and queue depth per tick, time from the
+# read of the messages (the socket being readable, with the I/O thread as soon
+# as they arrive) to their handling, and time until the server confirms a move.
+
+class ClientStats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ticks = 0
+        self.messages = 0 # messages handled
+        self.depth = 0 # max number of messages queued at the start of a tick
+        self.waited = 0 # time from the read to the handling of the messages handled (in s)
+        self.latency = 0 # max time from the read to the handling of a message (in s)
+        self.moves = 0 # moves confirmed
+        self.confirmation = 0 # time until the moves are confirmed (in s)
+        self.teleports = 0 # switches to another server
+        self.teleport = 0 # time from the switch to the welcome of the other server (in s)
+
+    # (messages per tick, max depth, mean and max time from read to handling, mean confirmation
+    # time, teleports, mean teleport time), times in ms
+    def summary(self):
+        return (self.messages / max(1, self.ticks), self.depth, self.waited / max(1, self.messages) * 1000,
+                self.latency * 1000, self.confirmation / max(1, self.moves) * 1000,
+                self.teleports, self.teleport / max(1, self.teleports) * 1000)
+
+    def __str__(self):
+        return "{:.1f} messages per tick, {} queued at most, handled {:.1f} ms after read ({:.1f} ms max), moves confirmed in {:.1f} ms, {} teleports in {:.1f} ms".format(*self.summary())
+
+### Functions ###
+
+# Server socket listening on a port
+def listen(port):
+    sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM,0)
+    try:
+        sock.setsockopt(1,socket.SO_REUSEADDR,1024) # for testing
+    except:
+        print('Could not enable SO_REUSEADDR')
+    sock.bind(('',port))
+    sock.listen(BACKLOG)
+    return sock
 
 ################################################################################
 #                          NETWORK SERVER CONTROLLER                           #
@@ -12,127 +123,352 @@ import random
 
 class NetworkServerController:
 
-    def __init__(self, model, port):
+    # with an interest manager, clients only get what happens around them;
+    # without a port, the server hosts a room of a RoomServer (see rooms.py),
+    # which owns the server socket and shares its selector
+    def __init__(self, model, port, interest = None, selector = None):
         self.model = model
         self.port = port
+        self.interest = interest
 
         # Nicks -> key:"remote_addr+remote_port" -> nickname string
         # Dictionnary with all users' nicknames
         self.nicks = {}
         self.save_sock = {}
-
-        # Socket creation
-        sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM,0)
-        try:
-            sock.setsockopt(1,socket.SO_REUSEADDR,1024) # for testing
-        except:
-            print('Could not enable SO_REUSEADDR')
-        sock.bind(('',self.port))
-        sock.listen(1)
-
-        self.sockets = [sock]
-
+        # Player ids of the binary protocol, shared by all the connections
+        self.ids = {}
+
+        self.listener = None
+        self.open_sockets(selector)
+        # Client sockets -> connections
+        self.connections = {}
+        # Connections with queued messages
+        self.outgoing = set()
+        # Messages to broadcast at the end of the tick: (message, ignore, position)
+        self.broadcasts = []
+        self.codec = BinaryCodec(SERVER_MESSAGES, CLIENT_MESSAGES, self.ids)
+        self.stats = TrafficStats()
+        self.totals = LoadStats()
+        self.replicator = Replicator(model, interest)
+        # Last numbered move of each socket handled during the tick
+        self.moves = {}
+        # Where the teleporters lead to, and the connections to the servers
+        # characters are handed over to: (host, port) -> connection
+        self.teleports = TELEPORTS
+        self.channels = {}
+        # Sockets of the channels being connected -> (address, time started)
+        self.opening = {}
+        # Characters handed over by another server, waiting for their client:
+        # token -> (nickname, time received), and clients that have come
+        # before their character: token -> (socket, nickname, time received)
+        self.sessions = {}
+        self.pending = {}
+        # Sockets of the clients whose character has been handed over
+        self.departed = set()
+        # MAPD messages of the map, built on the first request: (digest, messages)
+        self.packed = None
+
+    # Sockets are registered once (epoll on Linux), with the buffered
+    # connection of each client socket attached (None for the server socket)
+    def open_sockets(self, selector):
+        self.selector = selector if selector is not None else selectors.DefaultSelector()
+        if self.port is not None:
+            self.listener = listen(self.port)
+            self.selector.register(self.listener, selectors.EVENT_READ, None)
+
+    # the engine waits between the steps (see Engine.run): only poll the
+    # sockets, a blocking select would make the steps last longer than `dt`
     def tick(self, dt):
-        (read,e1,e2) = select.select(self.sockets,[],[], dt/1000)
-
-        for s in read:
-            if(s == self.sockets[0]):
-                sockets = self.welcomeUser(s,self.sockets)
+        events = self.selector.select(0)
+
+        for (key, mask) in events:
+            s = key.fileobj
+            if key.data is None:
+                self.welcomeUser(s)
+            elif s in self.opening:
+                self.open_channel(s)
             else:
-                message = self.receive_message(s)
-                print("REC :", message)
+                self.receive(s)
 
+        self.update()
 
-                if message != None:
-                    user = self.uid_from_socket(s)
-                    # Handle user command
-                    print(user+": "+message)
-
-                    # The user is joining
-                    if(message.startswith("JOIN ") or message.startswith("JOSP ")):
-                        self.changeNickname(s,message)
-
-                    # The user is requesting to move
-                    if(message.startswith("MOVE")):
-                        self.moveCharacter(s, message)
-
-                    # The user is requesting to drop a bomb
-                    if(message.startswith("DROP")):
-                        self.dropBomb(s)
-
-                    # The user is leaving the game
-                    if(message.startswith("QUIT")):
-                        # Will be handled by socket disconnection, but if we want
-                        # To do something about it we can do it here
-                        self.kill_user(user, s)
-                        continue
+        return True
 
-                else:
-                    # Handle disconnection
-                    print (self.save_sock)
-                    if s in self.save_sock:
-                        user = self.save_sock[s]
-                        print(user+" has disconnected.")
+    # Handle the messages received on a client socket
+    def receive(self, s):
+        self.stats.recvs += 1
+        messages = self.peer(s).receive()
 
-                        self.kill_user(user,s)
-                    else:
-                        s.close()
-                        self.sockets.remove(s)
-                    continue
+        if messages != None:
+            for message in messages:
+                print("REC :", message)
+                if not self.handle_message(s, message): break
 
+        else:
+            self.disconnect(s)
 
+    # End of the tick: random bombs, then send everything queued during the tick
+    def update(self):
         if random.randint(0, 1000)%100 == 0:
             self.alea_bomb()
 
-        return True
-
-    def tell_clients(self,message,ignore=[]):
-        print(message)
-        for d in self.sockets:
-            # Send encoded message to all peers excepted host and ignored
-            if(d not in ignore and d != self.sockets[0]):
-                self.send_message(message, d)
-
-    def send_message(self, message, s):
-        taille = "%5d "%(len(message) + 1)
-        to_send = "BEGIN " + taille + message + "\n"
-        s.send(to_send.encode())
-        print("SENDING :", to_send)
+        self.expire()
+
+        self.confirm_moves()
+        self.replicate()
+        self.flush()
+        self.count_tick()
+
+    # Report the traffic from time to time
+    def count_tick(self):
+        self.stats.ticks += 1
+        if self.stats.ticks == STATS_PERIOD:
+            print("=> traffic:", self.stats)
+            self.totals.bytes += self.stats.bytes
+            self.stats.reset()
+
+    # Handle disconnection
+    def disconnect(self, s):
+        print (self.save_sock)
+        for (token, pending) in list(self.pending.items()):
+            if pending[0] is s: del self.pending[token]
+        if s in self.save_sock:
+            user = self.save_sock[s]
+            print(user+" has disconnected.")
+
+            self.kill_user(user,s)
+        else:
+            self.close_socket(s)
+
+    # Handle a message from a user, return False if the user has left
+    def handle_message(self, s, message):
+        user = self.uid_from_socket(s)
+        # Handle user command
+        print(user+": "+message)
+        self.totals.messages += 1
+
+        # Clients whose character has been handed over can only leave
+        if s in self.departed and not message.startswith("QUIT"):
+            return True
+
+        # Another server on this host hands a character over to us
+        if(message.startswith("HAND ")):
+            if self.local(s): self.take_over(message)
+            else: print("Error: handoff from a remote server refused")
+
+        # The user follows its character handed over by another server
+        if(message.startswith("RESM ")):
+            self.resume(s, message)
+
+        # A load tool asks for our counters
+        if(message.startswith("STAT")):
+            self.report_load(s)
+
+        # The user lacks our map
+        if(message.startswith("GETM ")):
+            self.sendMap(s, message)
+
+        # The user asks for a protocol version
+        if(message.startswith("PROT ")):
+            self.negotiate(s, message)
+
+        # The user has received a state
+        if(message.startswith("ACKS ")):
+            self.acknowledge(s, message)
+
+        # The user is joining
+        if(message.startswith("JOIN ") or message.startswith("JOSP ")):
+            self.changeNickname(s,message)
+
+        # The user is requesting to move (MOVN: numbered move, to be confirmed)
+        if(message.startswith("MOVE") or message.startswith("MOVN")):
+            self.moveCharacter(s, message)
+
+        # The user is requesting to drop a bomb
+        if(message.startswith("DROP")):
+            self.dropBomb(s)
+
+        # The user is leaving the game
+        if(message.startswith("QUIT")):
+            # Will be handled by socket disconnection, but if we want
+            # To do something about it we can do it here
+            self.kill_user(user, s)
+            return False
 
-    def receive_message(self, s):
-        try:
-            message = s.recv(6)
-        except:
-            print("Socket error: can't receive data from server.")
-            return None
+        return True
 
-        if message.decode() == "BEGIN ":
-            taille = s.recv(6)
+    # Buffered connection of a client socket
+    def peer(self, s):
+        return self.connections[s]
 
-            try:
-                len = int(taille.decode())
-            except ValueError:
-                print("Value error, can't convert message's size")
-                print(message.decode())
-                return ""
+    # Client sockets (or what stands for them) and their connections
+    def peers(self):
+        return list(self.connections.items())
 
-            command = s.recv(len)
-            return command.decode()
+    # Queue a message for all peers excepted the ignored ones, and those who
+    # don't see position `pos` if any, it will be framed with the other
+    # broadcasts of the tick
+    def tell_clients(self,message,ignore=[],pos=None):
+        print(message)
+        self.broadcasts.append((message, ignore, pos))
+
+    # Position the region of interest of a peer is centered on, None if it sees everything
+    def center(self, s):
+        if self.interest is None or s not in self.save_sock: return None
+        character = self.model.look(self.nicks[self.save_sock[s]])
+        if character: self.peer(s).center = character.pos
+        return self.peer(s).center
+
+    # Frame the pending broadcasts once per format, and append them to the outboxes
+    def broadcast(self):
+        if not self.broadcasts: return
+        broadcasts = self.broadcasts
+        self.broadcasts = []
+
+        # player ids are shared, so binary frames are the same for all the clients
+        frames = {}
+        def framed(binary):
+            if binary not in frames:
+                codec = self.codec.encode if binary else encode
+                frames[binary] = [ codec(message) for (message, _, _) in broadcasts ]
+                self.stats.frames += len(broadcasts)
+            return frames[binary]
+
+        # broadcasts that each ignored peer must not receive
+        excluded = {}
+        for (i, (_, ignore, _)) in enumerate(broadcasts):
+            for s in ignore:
+                excluded.setdefault(s, set()).add(i)
+
+        # broadcasts seen from each cell, with interest management (peers
+        # that have not joined yet only get those without a position)
+        located = self.interest is not None and any(pos is not None for (_, _, pos) in broadcasts)
+        regions = {}
+        def visible(center):
+            cell = self.interest.cell_of(center) if center else None
+            if cell not in regions:
+                regions[cell] = [ i for (i, (_, _, pos)) in enumerate(broadcasts) if pos is None or (center and self.interest.sees(center, pos)) ]
+            return (cell, regions[cell])
+
+        payloads = {}
+        for (s, connection) in self.peers():
+            # replicated peers get the state instead
+            if connection.replicated: continue
+            (cell, indexes) = visible(self.center(s)) if located else (None, range(len(broadcasts)))
+            sequence = framed(connection.binary)
+            if s in excluded:
+                payload = b"".join(sequence[i] for i in indexes if i not in excluded[s])
+            else:
+                if (connection.binary, cell) not in payloads:
+                    payloads[(connection.binary, cell)] = b"".join(sequence[i] for i in indexes)
+                payload = payloads[(connection.binary, cell)]
+            if payload:
+                connection.outbox += payload
+                self.outgoing.add(connection)
+
+    # Queue a message, it will be sent at the end of the tick
+    def send_message(self, message, s):
+        # keep the order of the messages
+        self.broadcast()
+        connection = self.peer(s)
+        connection.send(message)
+        self.outgoing.add(connection)
+        print("SENDING :", message)
+
+    # Write the queued messages, with one send per socket
+    def flush(self):
+        self.broadcast()
+        self.flush_channels()
+        for connection in list(self.outgoing):
+            size = len(connection.outbox)
+            if not connection.flush():
+                print("Socket error: can't send data to client.")
+            self.stats.sends += 1
+            self.stats.bytes += size - len(connection.outbox)
+            if not connection.outbox:
+                self.outgoing.discard(connection)
+
+    # Write the handoffs, before the messages of the clients following them
+    def flush_channels(self):
+        now = time.perf_counter()
+        for (s, (address, started)) in list(self.opening.items()):
+            if now - started > CHANNEL_TIMEOUT:
+                print("TELEPORT ERROR: server {}:{} unreachable...".format(*address))
+                del self.opening[s]
+                self.selector.unregister(s)
+                self.channels.pop(address).close()
+        opening = { address for (address, _) in self.opening.values() }
+        for (address, channel) in list(self.channels.items()):
+            if address in opening: continue
+            if not channel.flush():
+                print("Socket error: can't send data to server {}:{}.".format(*address))
+                channel.close()
+                del self.channels[address]
 
     def uid_from_socket(self,s):
-        addr = s.getpeername()[0]
-        port = s.getpeername()[1]
-        return str(addr) + ":" + str(port)
+        return self.peer(s).uid
 
     # Handles a new connection
-    def welcomeUser(self,s,sockets):
+    def welcomeUser(self,s):
         # Add a new peer to the socket list
         remote = s.accept()
-        sockets.append(remote[0])
+        self.add_socket(remote[0], remote[1])
 
         print("A new player has connected.")
 
-        return sockets
+    def add_socket(self, s, addr):
+        connection = Connection(s, BinaryCodec(SERVER_MESSAGES, CLIENT_MESSAGES, self.ids))
+        connection.uid = str(addr[0]) + ":" + str(addr[1])
+        self.selector.register(s, selectors.EVENT_READ, connection)
+        self.connections[s] = connection
+
+    # Take over a connection accepted by a room server, still registered in
+    # the shared selector
+    def adopt(self, s, connection):
+        connection.codec = connection.decoder.codec = BinaryCodec(SERVER_MESSAGES, CLIENT_MESSAGES, self.ids)
+        self.connections[s] = connection
+
+    def close_socket(self, s):
+        connection = self.connections.pop(s)
+        self.selector.unregister(s)
+        self.outgoing.discard(connection)
+        s.close()
+
+    # Answer with the highest protocol version we both speak, and switch to it
+    def negotiate(self, s, message):
+        try:
+            version = min(int(message.split(" ")[1]), PROTOCOL_VERSION)
+        except ValueError:
+            print("Value error, can't convert protocol version")
+            return
+        self.send_message("PROT "+str(version), s)
+        self.peer(s).binary = (version >= 2)
+        self.peer(s).replicated = (version >= 3)
+
+    def acknowledge(self, s, message):
+        try:
+            self.peer(s).acked = int(message.split(" ")[1])
+        except ValueError:
+            print("Value error, can't convert state number")
+
+    # Send the changes of the world to the replicated peers that have joined,
+    # against the last state each of them has acknowledged
+    def replicate(self):
+        captured = self.replicator.capture()
+        for (s, connection) in self.peers():
+            if s not in self.save_sock: continue
+            if not connection.replicated:
+                if captured and self.interest: self.update_interest(s)
+                continue
+            if connection.sent == self.replicator.seq: continue
+            if self.interest:
+                messages = self.replicator.view_messages(connection.views, connection.acked, self.center(s))
+            else:
+                messages = self.replicator.messages(connection.acked)
+            for message in messages:
+                connection.send(message)
+            connection.sent = self.replicator.seq
+            self.outgoing.add(connection)
 
     def changeNickname(self,s,message):
         uid = self.uid_from_socket(s)
@@ -143,12 +479,17 @@ class NetworkServerController:
         nick = splitted[(len(splitted)-1)].split("\n")[0]
         print("Join recv:")
 
+        # A client that doesn't know about sessions follows its character
+        # handed over by another server with a plain join: the session is over
+        for token in [ token for (token, (name, _)) in self.sessions.items() if name == nick ]:
+            del self.sessions[token]
+
         # Add it to the dictionnary with the UID as the key
         self.nicks[uid] = nick
         self.save_sock[s] = uid
 
         # Add to the model and respond positively
-        self.model.add_character(nick)
+        self.model.add_character(nick, pos = self.random_position())
         char = self.model.look(nick)
 
         # If the player comes in a special way
@@ -159,25 +500,46 @@ class NetworkServerController:
         # Tell everyone else of the new player and its features
         char.immunity = 5000;
         #print("NICK:", nick[0:-1], "coucou")
-        self.tell_clients("NEWP "+nick+" "+str(char.health)+" "+str(char.kind)+" "+str(char.pos[X])+" "+str(char.pos[Y])+"\n",[s])
+        self.tell_clients("NEWP "+nick+" "+str(char.health)+" "+str(char.kind)+" "+str(char.pos[X])+" "+str(char.pos[Y])+"\n",[s],char.pos)
 
         # Tell the new player its features and gives him the map
-        self.send_message("WELC "+str(char.kind)+" "+str(char.health)+" "+str(char.pos[X])+" "+str(char.pos[Y])+" "+self.model.mappath+"\n", s)
+        self.welcome(s, char)
 
-        # Send to the new player all the info to catch up with the others
-        self.update_state(s)
+        # Send to the new player all the info to catch up with the others,
+        # replicated players get the whole state at the end of the tick
+        if not self.peer(s).replicated:
+            self.update_state(s)
+        self.advertise(s)
 
         print(uid+" has joined the game with the nickname "+nick)
 
+    # Tell a peer that gets the events about the characters entering and leaving its region
+    def update_interest(self, s):
+        connection = self.peer(s)
+        nick = self.nicks[self.save_sock[s]]
+        center = self.center(s)
+        view = self.interest.view(self.replicator.states[self.replicator.seq], self.replicator.cells, center) if center else {}
+        visible = { key[1] for key in view if key[0] == "C" and key[1] != nick }
+        for p in visible - connection.visible:
+            char = self.model.look(p)
+            if char:
+                self.send_message("NEWP "+p+" "+str(char.health)+" "+str(char.kind)+" "+str(char.pos[X])+" "+str(char.pos[Y])+"\n", s)
+        for p in connection.visible - visible:
+            self.send_message("QUIT "+p+"\n", s)
+        connection.visible = visible
+
     def update_state(self,s):
         uid = self.uid_from_socket(s)
         nick = self.nicks[uid]
 
-        # Tell about other players
+        # Tell about other players (those around, with interest management)
+        center = self.center(s)
         for p in self.nicks.values():
             if(p != nick):
                 char = self.model.look(p)
+                if char and center and not self.interest.sees(center, char.pos): continue
                 if char:
+                    self.peer(s).visible.add(p)
                     # NEWP nick kind x y
                     self.send_message("NEWP "+p+" "+str(char.health)+" "+str(char.kind)+" "+str(char.pos[X])+" "+str(char.pos[Y])+"\n", s)
 
@@ -188,21 +550,48 @@ class NetworkServerController:
 
         # Don't tell about the bombs since we will give invincibility for a short time for newcomers
 
-    def sendMap(self,s):
-        self.send_message(self.model.mappath, s)
+    # STAT ticks messages bytes durations...
+    def report_load(self, s):
+        totals = self.totals
+        durations = " ".join(str(count) for count in totals.durations)
+        self.send_message("STAT {} {} {} {}".format(totals.ticks, totals.messages, totals.bytes + self.stats.bytes, durations), s)
+
+    # WELC kind health x y path digest
+    def welcome(self, s, char):
+        self.send_message("WELC "+str(char.kind)+" "+str(char.health)+" "+str(char.pos[X])+" "+str(char.pos[Y])+" "+self.model.mappath+" "+self.model.map.digest()+"\n", s)
+
+    # Send the map to a user that lacks it, in its compact encoding
+    def sendMap(self,s,message):
+        parts = message.split()
+        if len(parts) < 2:
+            print("Error: malformed map request")
+            return
+        digest = parts[1]
+        if digest != self.model.map.digest():
+            print("Error: unknown map "+digest)
+            return
+        if self.packed is None or self.packed[0] != digest:
+            self.packed = (digest, map_messages(self.model.map))
+        for part in self.packed[1]:
+            self.send_message(part, s)
 
     def dropBomb(self,s):
         nick = self.nicks[self.uid_from_socket(s)]
         self.model.drop_bomb(nick)
+        character = self.model.look(nick)
         # DROP nick
-        self.tell_clients("DROP "+nick+"\n",[s])
+        self.tell_clients("DROP "+nick+"\n",[s],character.pos if character else None)
 
     def moveCharacter(self,s,message):
         nick = self.nicks[self.uid_from_socket(s)]
-        direction = message[5:]
-        self.model.move_character(nick,int(direction))
+        parts = message.split()
+        direction = int(parts[1])
+        self.model.move_character(nick,direction)
 
         character = self.model.look(nick)
+        # Dead characters don't move
+        if not character: return
+        if len(parts) > 2: self.moves[s] = int(parts[2])
 
         tile = self.model.map.get_tile(character.pos[X], character.pos[Y])
         if tile == "3":
@@ -210,31 +599,179 @@ class NetworkServerController:
             self.teleport_user(s)
         else:
             # MOVP nick direction
-            self.tell_clients("MOVP "+nick+" "+str(direction)+"\n",[s])
+            self.tell_clients("MOVP "+nick+" "+str(direction)+"\n",[s],character.pos)
+
+    # Confirm the last numbered move of each user handled during this tick,
+    # with the resulting position of its character
+    def confirm_moves(self):
+        for (s, seq) in self.moves.items():
+            if s not in self.save_sock: continue
+            character = self.model.look(self.nicks[self.save_sock[s]])
+            if character:
+                # MACK seq x y direction
+                self.send_message("MACK "+str(seq)+" "+str(character.pos[X])+" "+str(character.pos[Y])+" "+str(character.direction), s)
+        self.moves = {}
 
     def teleport_user(self,s):
-        # We can change the server depending in the teleporter tile
-        # This would require a teleporter object in the model
-        if self.port == 7777:
-            self.send_message("TPSP localhost 7778",s)
-        elif self.port == 7778:
-            self.send_message("TPSP localhost 7777",s)
+        # The teleporters lead to another server, which takes the character
+        # over and places it on its own map
+        if self.port not in self.teleports: return
+        (host, port) = self.teleports[self.port]
+        channel = self.channel(host, port)
+        if channel is None: return
+        nick = self.nicks[self.save_sock[s]]
+        self.hand_over(s, channel, host, port, True)
+        self.model.kill_character(nick)
+        self.tell_clients("QUIT "+nick+"\n",[s])
+
+    # Connection to another server, opened when first needed; the connection
+    # is not waited for: the messages are queued until the socket is writable
+    # (see open_channel), so that a slow server does not hold the tick back
+    def channel(self, host, port):
+        if (host, port) not in self.channels:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setblocking(False)
+            try:
+                error = s.connect_ex((host, port))
+            except OSError as e:
+                error = e.errno
+            if error not in (0, errno.EINPROGRESS):
+                print("TELEPORT ERROR: server {}:{} unreachable...".format(host, port))
+                s.close()
+                return None
+            self.channels[(host, port)] = Connection(s)
+            self.selector.register(s, selectors.EVENT_WRITE, self.channels[(host, port)])
+            self.opening[s] = ((host, port), time.perf_counter())
+            # replicated peers that have not joined get nothing
+            self.channels[(host, port)].send("PROT "+str(PROTOCOL_VERSION))
+        return self.channels[(host, port)]
+
+    # The socket of a channel is writable: it is connected, or has failed
+    def open_channel(self, s):
+        (address, _) = self.opening.pop(s)
+        self.selector.unregister(s)
+        if s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            print("TELEPORT ERROR: server {}:{} unreachable...".format(*address))
+            self.channels.pop(address).close()
+
+    # Servers the characters may be handed over to
+    def destinations(self):
+        return [ self.teleports[self.port] ] if self.port in self.teleports else []
+
+    # Tell a replicated client where its character may be handed over to, so
+    # that it connects there beforehand
+    def advertise(self, s):
+        if not self.peer(s).replicated: return
+        for (host, port) in self.destinations():
+            self.send_message("PEER "+host+" "+str(port), s)
+
+    # Is the peer of a socket on this host
+    def local(self, s):
+        return self.uid_from_socket(s).rsplit(":", 1)[0] in ("127.0.0.1", "::1", "::ffff:127.0.0.1")
+
+    # Ship the state of the character of a client to the server at the other
+    # end of `channel`, and tell the client to follow it there with a session
+    # token; with `spawn`, the other server places the character itself
+    def hand_over(self, s, channel, host, port, spawn = False):
+        nick = self.nicks[self.save_sock[s]]
+        values = self.model.record(self.model.look(nick))
+        if spawn: values = values[:2] + ("", "") + values[4:]
+        token = secrets.token_hex(8)
+        # HAND token time record
+        channel.send("HAND "+token+" "+str(round(self.model.time))+" "+encode_record(("C", nick), values))
+        self.send_message("TPSP "+host+" "+str(port)+" "+token, s)
+        self.departed.add(s)
+        print("=> hand \"{}\" over to {}:{}".format(nick, host, port))
+
+    # A character handed over by another server, it waits for its client
+    def take_over(self, message):
+        parts = message.split()
+        if len(parts) < 4:
+            print("Error: malformed handoff")
+            return
+        token = parts[1]
+        (key, values) = shift_record(*decode_record(parts[3]), round(self.model.time) - int(parts[2]))
+        spawn = values[2] is None
+        if spawn: values = values[:2] + self.random_position() + values[4:]
+        self.model.apply_state({ key: values })
+        if spawn: self.model.look(key[1]).immunity = 5000
+        self.sessions[token] = (key[1], time.perf_counter())
+        print("=> take over \"{}\"".format(key[1]))
+
+        # The client may have come first
+        if token in self.pending:
+            (s, nick, _) = self.pending.pop(token)
+            self.resume(s, "RESM "+token+" "+nick)
+
+    # The client of a character handed over by another server resumes it, or
+    # joins as a newcomer if there is no such character
+    def resume(self, s, message):
+        parts = message.split()
+        if len(parts) < 3:
+            print("Error: malformed resume")
+            return
+        (token, nick) = (parts[1], parts[2])
+        if token not in self.sessions:
+            self.pending[token] = (s, nick, time.perf_counter())
+            return
+        session = self.sessions.pop(token, None)
+        char = self.model.look(nick)
+        if session is None or session[0] != nick or char is None:
+            self.changeNickname(s, "JOIN "+nick)
+            return
+
+        uid = self.uid_from_socket(s)
+        self.nicks[uid] = nick
+        self.save_sock[s] = uid
+        self.tell_clients("NEWP "+nick+" "+str(char.health)+" "+str(char.kind)+" "+str(char.pos[X])+" "+str(char.pos[Y])+"\n",[s],char.pos)
+        self.welcome(s, char)
+        if not self.peer(s).replicated:
+            self.update_state(s)
+        self.advertise(s)
+        print(uid+" has resumed "+nick)
+
+    # Forget the characters handed over whose client has not come in time,
+    # and let the clients whose character has not come join as newcomers
+    def expire(self):
+        if not self.sessions and not self.pending: return
+        now = time.perf_counter()
+        for (token, (nick, received)) in list(self.sessions.items()):
+            if now - received > SESSION_TIMEOUT:
+                del self.sessions[token]
+                # unless a client has joined with its nickname meanwhile
+                if nick in self.nicks.values(): continue
+                if self.model.look(nick): self.model.kill_character(nick)
+        for (token, (s, nick, received)) in list(self.pending.items()):
+            if now - received > SESSION_TIMEOUT:
+                del self.pending[token]
+                self.changeNickname(s, "JOIN "+nick)
 
     def kill_user(self,user,s):
+        # The character of a departed user is not ours any more
+        if s in self.departed:
+            self.departed.discard(s)
+            del self.nicks[user]
+            del self.save_sock[s]
+            self.close_socket(s)
+            return
+
         # Tell the model to remove the user
         if(self.model.quit(self.nicks[user])):
             # If it works, delete it and tell everyone
             self.tell_clients("QUIT "+self.nicks[user]+"\n",[s])
             del self.nicks[user]
             del self.save_sock[s]
-            s.close()
-            self.sockets.remove(s)
+            self.close_socket(s)
+
+    # Random position for a new character or a random bomb
+    def random_position(self):
+        return self.model.map.random()
 
     def alea_bomb(self):
         print("Sever send BOMB !")
-        random_pos = self.model.map.random()
-        self.model.bombs.append(Bomb(self.model.map, random_pos))
-        self.tell_clients("SERVDROP " + str(random_pos[0]) + " " + str(random_pos[1]))
+        random_pos = self.random_position()
+        self.model.add_bomb(random_pos)
+        self.tell_clients("SERVDROP " + str(random_pos[0]) + " " + str(random_pos[1]), [], random_pos)
 
 
 
@@ -246,17 +783,35 @@ class NetworkServerController:
 
 class NetworkClientController:
 
-    def __init__(self, model, host, port, nickname):
+    def __init__(self, model, host, port, nickname, binary = True, replicated = True, prediction = True, threaded = True):
         self.model = model
         self.host = host
         self.port = port
         self.nickname = nickname
+        self.binary = binary # ask for the binary protocol
+        self.replicated = replicated # ask for the state replication (implies binary)
+        self.prediction = prediction # number the moves, and correct them with the server confirmations
+        self.input = 0 # number of the last move
+        self.corrections = 0 # number of mispredicted positions
+        self.threaded = threaded # read the server in an I/O thread, instead of polling it at each tick
+        self.stats = ClientStats()
         self.ready = False
+        self.maps = MapCache() # maps parsed or received, by digest
+        self.spares = {} # (host, port) -> socket connected beforehand to a server we may switch to
+        self.switched = None # time we were told to switch to another server
+
+        # Messages received and not handled yet: (connection, message, time
+        # received), or None as message once the connection is closed. The I/O
+        # thread only appends and the main loop only pops, which a deque
+        # supports without locking.
+        self.queue = collections.deque()
+        self.arrived = threading.Event()
+        self.stop = None
 
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.connect((self.host,self.port))
 
-        self.server = s
+        self.connect(s)
         self.send_message("JOIN " + self.nickname)
 
     #####################################################
@@ -267,12 +822,20 @@ class NetworkClientController:
         print("=> event \"quit\"")
         self.model.quit(self.nickname)
         self.send_message("QUIT")
+        self.flush()
         return False
 
     def keyboard_move_character(self, direction):
         print("=> event \"keyboard move direction\" {}".format(DIRECTIONS_STR[direction]))
         self.model.move_character(self.nickname,direction)
-        self.send_message("MOVE "+str(direction))
+        if self.prediction:
+            # keep the move until the server confirms it
+            self.input = (self.input + 1) % 65536
+            self.inputs.append((self.input, direction, time.perf_counter()))
+            if len(self.inputs) > MAX_INPUTS: del self.inputs[0]
+            self.send_message("MOVN "+str(direction)+" "+str(self.input))
+        else:
+            self.send_message("MOVE "+str(direction))
         return True
 
     def keyboard_drop_bomb(self):
@@ -281,100 +844,251 @@ class NetworkClientController:
         self.send_message("DROP")
         return True
 
+    # Use a new connection to the server (the protocol may have been
+    # negotiated beforehand)
+    def connect(self, s, negotiate = True):
+        self.server = s
+        self.connection = Connection(s, BinaryCodec(CLIENT_MESSAGES, SERVER_MESSAGES))
+        self.receiver = StateReceiver(self.model)
+        self.inputs = [] # moves not confirmed yet: (number, direction, time sent)
+        self.confirmed = None # last position confirmed by the server: (x, y, direction)
+        self.waiting = None # WELC waiting for its map, and the messages received since
+        self.deferred = []
+        if self.threaded:
+            self.stop = threading.Event()
+            threading.Thread(target = self.read, args = (self.connection, self.stop), daemon = True).start()
+        if negotiate and self.replicated:
+            self.send_message("PROT "+str(PROTOCOL_VERSION))
+        elif negotiate and self.binary:
+            self.send_message("PROT 2")
+
+    # Queue a message, it will be sent at the next flush
     def send_message(self, message):
-        taille = "%5d "%(len(message) + 1)
-        to_send = "BEGIN " + taille + message + "\n"
-        print("SENDING :", to_send)
-        try:
-            self.server.send(to_send.encode())
-        except:
+        print("SENDING :", message)
+        self.connection.send(message)
+
+    # Write the queued messages to the server
+    def flush(self):
+        if not self.connection.flush():
             print("Server unreachable")
             exit()
 
-    def receive_message(self):
-        try:
-            message = self.server.recv(6)
-        except:
-            print("Caught socket error, can't receive data from sevrer.")
-            return None
-
-        if message.decode() == "BEGIN ":
-            taille = self.server.recv(6)
+    # Close the connection to the server
+    def close(self):
+        if self.stop: self.stop.set()
+        self.server.close()
 
-            try:
-                len = int(taille.decode())
-            except ValueError:
-                print("Value error, can't convert message's size")
-                print(message.decode())
-                return ""
+    # Wait up to `timeout` s for data from the server, and queue the messages
+    # received; return False once the connection is closed
+    def poll(self, connection, timeout):
+        try:
+            ready = select.select([connection.sock], [], [], timeout)
+        except (OSError, ValueError):
+            return False # closed by us
+        if not ready[0]: return True
+        # stamped before the recv, decoding included
+        received = time.perf_counter()
+        messages = connection.receive()
+        if messages is None:
+            self.queue.append((connection, None, received))
+        else:
+            for message in messages: self.queue.append((connection, message, received))
+        self.arrived.set()
+        return messages is not None
 
-            command = self.server.recv(len)
-            return command.decode()
+    # Body of the I/O thread of a connection
+    def read(self, connection, stop):
+        while not stop.is_set() and self.poll(connection, POLL_TIMEOUT): pass
 
     ##############
     # time event #
     ##############
 
     def tick(self, dt=0):
-        # Check if some data has been sent by the server
-        ready = select.select([self.server], [], [], dt/1000)
+        # Send the messages queued since the last tick
+        self.flush()
+
+        # Give up the moves the server has not confirmed in time
+        if self.inputs and time.perf_counter() - self.inputs[0][2] > INPUT_TIMEOUT:
+            self.inputs = [ move for move in self.inputs if time.perf_counter() - move[2] <= INPUT_TIMEOUT ]
+            self.reconcile()
+
+        # Check if some data has been sent by the server (waiting at most dt ms)
+        if not self.threaded:
+            self.poll(self.connection, dt/1000)
+        elif not self.queue and dt:
+            self.arrived.wait(dt/1000)
+        self.arrived.clear()
+        self.count_tick()
+
+        # Handle all the messages received so far
+        handled = False
+        while self.queue:
+            (connection, message, received) = self.queue.popleft()
+
+            # Forget about the old server once we have switched
+            if connection is not self.connection: continue
+
+            if message is None:
+                print("Server unreachable")
+                exit()
+
+            self.stats.messages += 1
+            self.stats.waited += time.perf_counter() - received
+            self.stats.latency = max(self.stats.latency, time.perf_counter() - received)
+            handled = True
+
+            print(message)
+
+            for line in message.split("\n"):
+                self.handle_message(line)
+
+        if handled: self.flush()
+        return handled
+
+    # Report the queue metrics from time to time
+    def count_tick(self):
+        self.stats.ticks += 1
+        self.stats.depth = max(self.stats.depth, len(self.queue))
+        if self.stats.ticks == STATS_PERIOD:
+            print("=> client:", self.stats)
+            self.stats.reset()
+
+    def handle_message(self, line):
+
+        # Wait for the map before handling anything else
+        if self.waiting is not None and not line.startswith("MAPD "):
+            if line: self.deferred.append(line)
+            return
 
-        if ready[0]:
-            message = self.receive_message()
+        # The server sends (part of) the map we lack
+        if line.startswith("MAPD "):
+            self.receive_map(line)
 
-            if message:
-                print(message)
+        # The server agrees on a protocol version
+        if(line.startswith("PROT ")):
+            self.connection.binary = (int(line.split(" ")[1]) >= 2)
 
-                orders = message.split("\n")
+        # The server confirms our moves
+        if line.startswith("MACK "):
+            self.confirm_move(line)
 
-                for line in orders:
+        # The server sends (part of) its state
+        if line.startswith("SNAP ") and self.ready:
+            self.receive_state(line)
 
-                    # New user is joining
-                    if(line.startswith("NEWP ")):
-                        self.add_character(line)
+        # New user is joining
+        if(line.startswith("NEWP ")):
+            self.add_character(line)
 
-                    # New fruit to add
-                    if(line.startswith("NEWF ")):
-                        self.add_fruit(line)
+        # New fruit to add
+        if(line.startswith("NEWF ")):
+            self.add_fruit(line)
 
-                    # Another user is moving
-                    if(line.startswith("MOVP")):
-                        self.move_character(line)
+        # Another user is moving
+        if(line.startswith("MOVP")):
+            self.move_character(line)
 
-                    #message = data.decode()# Another user drops a bomb
-                    if(line.startswith("DROP ")):
-                        self.drop_bomb(line)
+        #message = data.decode()# Another user drops a bomb
+        if(line.startswith("DROP ")):
+            self.drop_bomb(line)
 
-                    # The server is welcoming with map and pos
-                    if(line.startswith("WELC ")):
-                        self.arrive(line)
+        # The server is welcoming with map and pos
+        if(line.startswith("WELC ")):
+            self.arrive(line)
 
-                    # The server tells us of a quitting player
-                    if(line.startswith("QUIT ")):
-                        self.quit_player(line)
+        # The server tells us of a quitting player
+        if(line.startswith("QUIT ")):
+            self.quit_player(line)
 
-                    # The server drops a bomb
-                    if line.startswith("SERVDROP"):
-                        if self.ready:
-                            self.server_bomb(line)
+        # The server drops a bomb
+        if line.startswith("SERVDROP"):
+            if self.ready:
+                self.server_bomb(line)
 
-                    # The server tells us where the teleporter leads to
-                    if line.startswith("TPSP"):
-                        self.switch_server(line)
-        else:
-            return False
+        # The server tells us where the teleporter leads to
+        if line.startswith("TPSP"):
+            self.switch_server(line)
 
-        return True
+        # The server tells us where we may be handed over to
+        if line.startswith("PEER "):
+            self.peer_server(line)
 
     def arrive(self,message):
         print("Arriving")
         parts = message.split(" ")
         path = parts[5]
-        self.model.load_map(path)
+        # older servers only send the path of the map
+        digest = parts[6] if len(parts) > 6 else None
+        if not self.load_map(path, digest):
+            if digest is None:
+                print("Error: map \"{}\" not found".format(path))
+                return
+            self.waiting = message
+            self.send_message("GETM "+digest)
+            return
         self.ready = True
         self.model.add_character(self.nickname, True, int(parts[1]),[int(parts[3]),int(parts[4])])
         char = self.model.look(self.nickname)
         char.health = int(parts[2])
+        if self.switched is not None:
+            self.stats.teleports += 1
+            self.stats.teleport += time.perf_counter() - self.switched
+            self.switched = None
+
+    # Use the map of a server if we have it, return False otherwise
+    def load_map(self, path, digest = None):
+        m = self.maps.find(digest, path)
+        if m is None: return False
+        self.model.map = m
+        self.model.mappath = path
+        return True
+
+    # Arrive once the whole map has come, then handle what came meanwhile
+    def receive_map(self, message):
+        m = self.maps.receive(message)
+        if m is None or self.waiting is None: return
+        (welcome, deferred) = (self.waiting, self.deferred)
+        self.waiting = None
+        self.deferred = []
+        self.arrive(welcome)
+        for line in deferred:
+            self.handle_message(line)
+
+    def receive_state(self, message):
+        character = self.model.look(self.nickname)
+        predicted = character.pos if character else None
+        seq = self.receiver.receive(message)
+        if seq is not None:
+            self.model.player = self.model.look(self.nickname)
+            self.reconcile(predicted)
+            self.send_message("ACKS "+str(seq))
+
+    def confirm_move(self, message):
+        parts = message.split(" ")
+        seq = int(parts[1])
+        # forget the moves handled by the server
+        for (i, (number, direction, sent)) in enumerate(self.inputs):
+            if number == seq:
+                self.stats.moves += 1
+                self.stats.confirmation += time.perf_counter() - sent
+                del self.inputs[:i+1]
+                break
+        self.confirmed = (int(parts[2]), int(parts[3]), int(parts[4]))
+        self.reconcile()
+
+    # Put our character back where the server has confirmed it, and replay
+    # the moves the server has not handled yet
+    def reconcile(self, predicted = None):
+        character = self.model.look(self.nickname)
+        if character is None or self.confirmed is None: return
+        if predicted is None: predicted = character.pos
+        (x, y, direction) = self.confirmed
+        if character.pos != (x, y): self.model.map.characters_at.move(character, (x, y))
+        character.direction = direction
+        for (number, direction, sent) in self.inputs:
+            character.move(direction)
+        if character.pos != predicted: self.corrections += 1
 
     def add_fruit(self,message):
         # Split the message into arguments
@@ -415,33 +1129,60 @@ class NetworkClientController:
         pos = message.split(" ")
         x = int(pos[1])
         y = int(pos[2])
-        self.model.bombs.append(Bomb(self.model.map, (x, y)))
+        self.model.add_bomb((x, y))
 
     def switch_server(self,message):
-        address = message.split(" ")[1].split("\n")[0]
-        port = message.split(" ")[2].split("\n")[0]
-
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((address, int(port)))
-            s.close()
-        except:
-            print("TELEPORT ERROR: Second server unreachable...")
-            return
+        parts = message.split(" ")
+        address = parts[1]
+        port = int(parts[2])
+        token = parts[3] if len(parts) > 3 else None
+        self.switched = time.perf_counter()
+
+        # Use the connection opened beforehand, if any
+        s = self.spares.pop((address, port), None)
+        negotiate = s is None
+        if s is None:
+            try:
+                s = socket.create_connection((address, port), CHANNEL_TIMEOUT)
+            except OSError:
+                print("TELEPORT ERROR: Second server unreachable...")
+                self.switched = None
+                return
 
         self.host = address
-        self.port = int(port)
-        self.join_special()
-
-    def join_special(self):
-        me = self.model.look(self.nickname)
-        message = "JOSP "+str(me.health)+" "+str(me.kind)+ " " +self.nickname
+        self.port = port
+        self.join_special(s, token, negotiate)
+
+    # Join another server with our character: it resumes the state handed
+    # over by the previous server with a session token, or only gets our
+    # health and kind from us without
+    def join_special(self, s, token = None, negotiate = True):
+        if token:
+            message = "RESM "+token+" "+self.nickname
+        else:
+            me = self.model.look(self.nickname)
+            message = "JOSP "+str(me.health)+" "+str(me.kind)+ " " +self.nickname
 
         self.model.empty_model()
-        self.server.close()
-
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((self.host,self.port))
+        self.close()
 
-        self.server = s
+        self.connect(s, negotiate)
         self.send_message(message)
+
+    # Connect beforehand to a server we may be handed over to, in the background
+    def peer_server(self, message):
+        parts = message.split(" ")
+        address = (parts[1], int(parts[2]))
+        if not self.replicated or address in self.spares: return
+        threading.Thread(target = self.prewarm, args = address, daemon = True).start()
+
+    # Connect to a server and agree on the protocol, without joining: a
+    # replicated peer that has not joined gets nothing
+    def prewarm(self, host, port):
+        try:
+            s = socket.create_connection((host, port), CHANNEL_TIMEOUT)
+            s.sendall(encode("PROT "+str(PROTOCOL_VERSION)))
+        except OSError:
+            print("Could not connect to {}:{} beforehand".format(host, port))
+            return
+        self.spares[(host, port)] = s
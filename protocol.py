@@ -0,0 +1,244 @@
+# -*- coding: Utf-8 -*
+
+import struct
+
+################################################################################
+#                                 PROTOCOL                                     #
+################################################################################
+
+# Each message is sent in a text frame "BEGIN <length> <message>\n", where
+# <length> is the size in bytes of "<message>\n", written on 5 characters.
+#
+# Peers that agree on protocol version 2 (the client sends "PROT 2", and the
+# server answers "PROT 2") may also send binary frames: a 0xFF byte, the size
+# of the payload on 2 bytes, then the payload, made of the opcode of the message
+# and its packed fields. Players are designated by numeric ids instead of
+# nicknames. Both kinds of frames can be mixed in a stream, and messages without
+# a binary form are always sent as text.
+#
+# With protocol version 3, the server no longer relays the game events to the
+# client: it replicates the state of its model instead (see replication.py).
+
+### Constants ###
+
+MAGIC = b"BEGIN "
+HEADER_SIZE = 12 # "BEGIN " + "%5d "
+MAX_LENGTH = 99999
+RECV_SIZE = 65536
+
+PROTOCOL_VERSION = 3
+BINARY_MAGIC = 0xFF
+BINARY_HEADER = struct.Struct("!BH")
+
+# binary messages: name -> (opcode, fields), where each field is 'b' (unsigned
+# byte), 'h' (short), 'H' (unsigned short), 's' (string), 'p' (player, sent as
+# its id) or 'P' (player, sent as its id and its nickname)
+CLIENT_MESSAGES = {
+    "JOIN": (1, "s"),
+    "JOSP": (2, "hbs"),
+    "MOVE": (3, "b"),
+    "DROP": (4, ""),
+    "QUIT": (5, ""),
+    "MOVN": (6, "bH"),
+    "RESM": (7, "ss"),
+    "GETM": (8, "s"),
+}
+SERVER_MESSAGES = {
+    "WELC": (64, "bhHHss"),
+    "NEWP": (65, "PhbHH"),
+    "NEWF": (66, "bHH"),
+    "MOVP": (67, "pb"),
+    "DROP": (68, "p"),
+    "QUIT": (69, "p"),
+    "SERVDROP": (70, "HH"),
+    "TPSP": (71, "sHs"),
+    "MACK": (72, "HHHb"),
+    "PEER": (73, "sH"),
+}
+FIELDS = { 'b': struct.Struct("!B"), 'h': struct.Struct("!h"), 'H': struct.Struct("!H") }
+
+### Functions ###
+
+# frame a message
+def encode(message):
+    data = message.encode() + b"\n"
+    if len(data) > MAX_LENGTH: raise ValueError("message too long")
+    return MAGIC + b"%5d " % len(data) + data
+
+### Class BinaryCodec ###
+
+# Translate text messages into binary frames, and binary payloads back into
+# text messages, so that the handlers only deal with text.
+
+class BinaryCodec:
+
+    def __init__(self, encoding, decoding, ids = None):
+        self.encoding = encoding
+        self.decoding = { opcode: (name, fields) for (name, (opcode, fields)) in decoding.items() }
+        self.ids = ids if ids is not None else {} # nickname -> id, may be shared by several codecs
+        self.names = {} # id -> nickname, learnt from the 'P' fields
+
+    def player_id(self, nickname):
+        if nickname not in self.ids: self.ids[nickname] = len(self.ids)
+        return self.ids[nickname]
+
+    # binary frame of a message, or text frame if it has no binary form
+    def encode(self, message):
+        parts = message.split()
+        spec = self.encoding.get(parts[0]) if parts else None
+        if spec is None or len(spec[1]) != len(parts) - 1: return encode(message)
+        payload = bytearray([spec[0]])
+        try:
+            for (field, arg) in zip(spec[1], parts[1:]):
+                if field in FIELDS:
+                    payload += FIELDS[field].pack(int(arg))
+                else:
+                    if field in "pP": payload += FIELDS['H'].pack(self.player_id(arg))
+                    if field in "sP":
+                        data = arg.encode()
+                        payload += FIELDS['b'].pack(len(data)) + data
+        except (ValueError, struct.error):
+            return encode(message)
+        return BINARY_HEADER.pack(BINARY_MAGIC, len(payload)) + payload
+
+    # text message of a binary payload (with a trailing "\n", as text frames)
+    def decode(self, payload):
+        (name, fields) = self.decoding[payload[0]]
+        args = [name]
+        pos = 1
+        for field in fields:
+            if field in FIELDS:
+                args.append(str(FIELDS[field].unpack_from(payload, pos)[0]))
+                pos += FIELDS[field].size
+                continue
+            if field in "pP":
+                player = FIELDS['H'].unpack_from(payload, pos)[0]
+                pos += 2
+            if field in "sP":
+                length = payload[pos]
+                arg = str(payload[pos+1:pos+1+length], "utf-8", "replace")
+                pos += 1 + length
+            if field == 'P': self.names[player] = arg
+            if field == 'p': arg = self.names.get(player, "#"+str(player))
+            args.append(arg)
+        return " ".join(args) + "\n"
+
+### Class FrameDecoder ###
+
+# Incremental decoder: bytes are fed as they are received, whatever the way
+# the stream has been split, and complete messages are extracted from the buffer.
+# Binary frames are decoded by `codec`, if any.
+
+class FrameDecoder:
+
+    def __init__(self, codec = None):
+        self.buffer = bytearray()
+        self.codec = codec
+
+    def feed(self, data):
+        self.buffer += data
+
+    # extract the complete messages (decoded, with their trailing "\n") from the buffer
+    def frames(self):
+        messages = []
+        buf = self.buffer
+        view = memoryview(buf)
+        pos = 0
+        while pos < len(buf):
+            if buf[pos] == BINARY_MAGIC:
+                if len(buf) - pos < BINARY_HEADER.size: break
+                end = pos + BINARY_HEADER.size + BINARY_HEADER.unpack_from(buf, pos)[1]
+                if end > len(buf): break
+                payload = bytes(view[pos+BINARY_HEADER.size:end])
+                pos = end
+                try:
+                    messages.append(self.codec.decode(payload))
+                except (AttributeError, KeyError, IndexError, struct.error):
+                    print("Binary frame error, can't decode message")
+                continue
+            if len(buf) - pos < HEADER_SIZE: break
+            if view[pos:pos+len(MAGIC)] != MAGIC:
+                # lost synchronization, skip to the next frame
+                nxt = buf.find(MAGIC, pos+1)
+                if nxt < 0:
+                    pos = len(buf) - len(MAGIC) + 1
+                    break
+                pos = nxt
+                continue
+            try:
+                length = int(bytes(view[pos+len(MAGIC):pos+HEADER_SIZE]))
+                if length < 0: raise ValueError
+            except ValueError:
+                print("Value error, can't convert message's size")
+                pos += len(MAGIC)
+                continue
+            end = pos + HEADER_SIZE + length
+            if end > len(buf): break
+            messages.append(str(view[pos+HEADER_SIZE:end], "utf-8", "replace"))
+            pos = end
+        view.release()
+        del buf[:pos]
+        return messages
+
+### Class Connection ###
+
+# Buffered connection over a non-blocking socket: incoming data is decoded into
+# messages, and outgoing frames are queued until the next flush, so that all the
+# messages of a tick are written with a single send. Messages are sent in text
+# frames, unless `binary` is set once the peer has agreed on it.
+
+class Connection:
+
+    def __init__(self, sock, codec = None):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.uid = None # identifier of the peer, set by the owner
+        self.codec = codec
+        self.binary = False
+        self.replicated = False # the peer gets the state instead of the events
+        self.acked = None # last state acknowledged by the peer
+        self.sent = None # last state sent to the peer
+        self.views = {} # states sent to the peer, with interest management
+        self.visible = set() # characters the peer knows about, with interest management
+        self.center = None # last position of the character of the peer
+        self.decoder = FrameDecoder(codec)
+        self.outbox = bytearray()
+        self.received = 0 # bytes received
+
+    # read available data, return the list of complete messages, or None if the connection is closed
+    def receive(self):
+        try:
+            data = self.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return []
+        except OSError:
+            print("Socket error: can't receive data.")
+            return None
+        if not data: return None
+        self.received += len(data)
+        self.decoder.feed(data)
+        return self.decoder.frames()
+
+    # frame of a message, in the format used on this connection
+    def frame(self, message):
+        if self.binary: return self.codec.encode(message)
+        return encode(message)
+
+    # queue a message
+    def send(self, message):
+        self.outbox += self.frame(message)
+
+    # write as many queued bytes as possible, return False on error
+    def flush(self):
+        if not self.outbox: return True
+        try:
+            sent = self.sock.send(self.outbox)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+        del self.outbox[:sent]
+        return True
+
+    def close(self):
+        self.sock.close()
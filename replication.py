@@ -0,0 +1,175 @@
+# -*- coding: Utf-8 -*
+
+from model import *
+
+################################################################################
+#                               REPLICATION                                    #
+################################################################################
+
+# The server replicates the state of its model (see Model.state) to the clients
+# that speak protocol version 3. Whenever the world has changed, it sends to
+# each client the records that differ from the last state this client
+# has acknowledged, or all the records if there is no such state:
+#
+#   SNAP <seq> <base> <time> <part> <parts> <record>...
+#
+# where <base> is the acknowledged state (-1 for a full snapshot), <time> the
+# model time of the server, and the records are split in <parts> messages.
+# A record is "<kind>,<key fields>,<values>", or "-<kind>,<key fields>" when
+# removed, e.g. "C,bob,1,50,3,4,1,0,0", "B,5,7,61000,1" or "-F,2,3,0". The
+# values that have not changed since the base state are left empty, e.g.
+# "C,bob,,,4,,2,,". Once the last part is received, the client updates its
+# model and answers "ACKS <seq>". The state is captured every PERIOD ticks, so
+# that the changes of several ticks share a message.
+
+### Constants ###
+
+VALUES = { "C": 7, "B": 1, "F": 1 } # number of values of each kind of record
+HISTORY = 2*FPS # number of states kept by the server
+PERIOD = 3 # number of ticks between two captures of the state
+PART_SIZE = 60000 # max size of the records of a message (in bytes)
+
+### Functions ###
+
+# changed records between two states: key -> values, or None if removed
+def diff(old, new):
+    changes = { key: values for (key, values) in new.items() if old.get(key) != values }
+    for key in old:
+        if key not in new: changes[key] = None
+    return changes
+
+# record of a key, given its values in the base state (None if new)
+def encode_record(key, values, old = None):
+    if values is None: return "-" + ",".join(str(field) for field in key)
+    if old is not None: values = tuple("" if value == before else value for (value, before) in zip(values, old))
+    return ",".join(str(field) for field in key + values)
+
+def decode_record(record):
+    removed = record[0] == "-"
+    if removed: record = record[1:]
+    (kind, fields) = record.split(",", 1)
+    if not removed:
+        fields = fields.rsplit(",", VALUES[kind])
+        values = tuple(int(value) if value else None for value in fields[1:])
+        fields = fields[0]
+    # nicknames may contain commas, other keys are made of numbers
+    key = (kind, fields) if kind == "C" else (kind,) + tuple(int(field) for field in fields.split(","))
+    return (key, None if removed else values)
+
+# record with its deadlines shifted by `offset` ms, to move it to the clock of
+# another model
+def shift_record(key, values, offset):
+    if key[0] == "B":
+        key = key[:3] + (key[3] + offset,)
+    if key[0] == "C" and values is not None:
+        values = values[:5] + tuple(deadline + offset if deadline else 0 for deadline in values[5:])
+    return (key, values)
+
+# messages carrying the changes from state `base` (`old`) to state `seq`
+def encode_state(seq, base, time, changes, old):
+    parts = [[]]
+    size = 0
+    for (key, values) in changes.items():
+        record = encode_record(key, values, old.get(key))
+        if size + len(record) > PART_SIZE and parts[-1]:
+            parts.append([])
+            size = 0
+        parts[-1].append(record)
+        size += len(record) + 1
+    header = "SNAP {} {} {} ".format(seq, base, round(time))
+    return [ header + "{} {} ".format(part, len(parts)) + " ".join(records) for (part, records) in enumerate(parts) ]
+
+### Class Replicator ###
+
+# Server side: keep the last states of the model, and build the messages that
+# bring a client from the state it has acknowledged to the current one. With
+# an interest manager, each client only gets the records in its region, and
+# its views of the state are kept by the server (see view_messages).
+
+class Replicator:
+
+    def __init__(self, model, interest = None):
+        self.model = model
+        self.interest = interest
+        self.seq = 0
+        self.states = { 0: {} } # seq -> state
+        self.cache = {} # base -> messages to the current state
+        self.cells = {} # keys of the current state by cell, with an interest manager
+        self.ticks = 0
+
+    # capture the state of the model every PERIOD calls, return True if it has changed
+    def capture(self):
+        self.ticks += 1
+        if self.ticks % PERIOD: return False
+        state = self.model.state()
+        if state == self.states[self.seq]: return False
+        self.seq += 1
+        self.states[self.seq] = state
+        self.states.pop(self.seq - HISTORY, None)
+        self.cache = {}
+        if self.interest: self.cells = self.interest.index(state)
+        return True
+
+    # messages for a client that has acknowledged state `base` (None if none)
+    def messages(self, base):
+        if base == self.seq: return []
+        if base not in self.states: base = -1
+        if base not in self.cache:
+            old = self.states.get(base, {})
+            changes = diff(old, self.states[self.seq])
+            self.cache[base] = encode_state(self.seq, base, self.model.time, changes, old)
+        return self.cache[base]
+
+    # messages for a client seeing the region around `center`, given its views
+    # (seq -> records sent), updated with the current one: records entering the
+    # region are sent in full, and records leaving it are removed. As for the
+    # states, only the last HISTORY views are kept, even without acks.
+    def view_messages(self, views, base, center):
+        view = self.interest.view(self.states[self.seq], self.cells, center) if center else {}
+        if base is None: base = -1
+        for seq in [ seq for seq in views if seq < base or seq <= self.seq - HISTORY ]: del views[seq]
+        if base not in views: base = -1
+        old = views.get(base, {})
+        views[self.seq] = view
+        changes = diff(old, view)
+        if base >= 0 and not changes: return []
+        return encode_state(self.seq, base, self.model.time, changes, old)
+
+### Class StateReceiver ###
+
+# Client side: rebuild the states of the server from the SNAP messages, and
+# update the model with them.
+
+class StateReceiver:
+
+    def __init__(self, model):
+        self.model = model
+        self.states = {} # seq -> state, from the last acknowledged one
+        self.changes = {} # records of the state being received
+
+    # handle a SNAP message, return the seq of the state to acknowledge once complete
+    def receive(self, message):
+        parts = message.split(" ")
+        (seq, base, time, part, count) = (int(field) for field in parts[1:6])
+        for record in parts[6:]:
+            if record:
+                (key, values) = decode_record(record)
+                self.changes[key] = values
+        if part < count - 1: return None
+        if base >= 0 and base not in self.states:
+            print("Error: unknown state {}".format(base))
+            self.changes = {}
+            return None
+        state = dict(self.states.get(base, {}))
+        for (key, values) in self.changes.items():
+            if values is None: state.pop(key, None)
+            elif None in values: state[key] = tuple(before if value is None else value for (value, before) in zip(values, state[key]))
+            else: state[key] = values
+        self.changes = {}
+        # the server won't use states older than base any more
+        self.states = { s: self.states[s] for s in self.states if s >= base }
+        self.states[seq] = state
+        # bring the model to the server state, whatever happened locally
+        self.model.time = time
+        self.model.apply_state(diff(self.model.state(), state))
+        return seq
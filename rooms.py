@@ -0,0 +1,182 @@
+# -*- coding: Utf-8 -*
+
+from model import *
+from protocol import *
+from network import *
+import selectors
+import time
+
+################################################################################
+#                                 ROOM SERVER                                  #
+################################################################################
+
+# A single server socket and a single selector for many independent matches
+# (rooms), each with its own model and its own players, handled by a
+# NetworkServerController without server socket. A new connection waits in
+# the lobby until it joins: it may first choose a room with "ROOM <name>",
+# otherwise it goes to the first room that is not full, and a room is created
+# when there is none. The messages received in the lobby (the protocol
+# negotiation) are then handed to the room with the JOIN. All the rooms are
+# stepped in the same loop, and the time spent in each of them is measured.
+# The rooms share the counters of the server (see LoadStats), which the
+# lobby gives too (STAT).
+
+### Constants ###
+
+ROOM_SIZE = 8 # max number of players in a room created by the server
+FRUITS = 10 # fruits added to a new room
+
+### Class Room ###
+
+class Room:
+
+    def __init__(self, name, map_file, interest = None, selector = None, totals = None):
+        self.name = name
+        self.model = Model()
+        self.model.load_map(map_file)
+        for _ in range(FRUITS): self.model.add_fruit()
+        self.server = NetworkServerController(self.model, None, interest, selector)
+        if totals is not None: self.server.totals = totals
+        self.ticks = 0
+        self.cost = 0 # time spent in the room since the last report (in s)
+
+    def players(self):
+        return len(self.server.connections)
+
+    # end of the tick of the room, then step its model
+    def tick(self, dt):
+        start = time.perf_counter()
+        self.server.update()
+        self.model.tick(dt)
+        self.cost += time.perf_counter() - start
+        self.ticks += 1
+
+### Class RoomServer ###
+
+class RoomServer:
+
+    def __init__(self, port, maps = [DEFAULT_MAP], interest = None, size = ROOM_SIZE):
+        self.maps = maps # maps of the new rooms, in turn
+        self.interest = interest
+        self.size = size
+        self.rooms = {} # name -> room
+        self.count = 0 # rooms created so far
+        self.ticks = 0
+        # the server socket, and the sockets of all the rooms
+        self.listener = listen(port)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ, None)
+        self.waiting = {} # socket in the lobby -> (room name or None, messages received)
+        self.located = {} # socket -> room
+        self.totals = LoadStats() # counters of all the rooms, the steps being counted by the engine
+
+    # only poll, the engine waits between the steps (see Engine.run)
+    def tick(self, dt):
+        events = self.selector.select(0)
+
+        for (key, mask) in events:
+            s = key.fileobj
+            if key.data is None:
+                self.welcome(s)
+            elif s in self.located:
+                room = self.located[s]
+                start = time.perf_counter()
+                room.server.receive(s)
+                room.cost += time.perf_counter() - start
+                if s not in room.server.connections: del self.located[s]
+            elif s in self.waiting:
+                self.wait(s, key.data)
+
+        for room in list(self.rooms.values()):
+            room.tick(dt)
+            # empty rooms are closed
+            if room.players() == 0: del self.rooms[room.name]
+
+        self.ticks += 1
+        if self.ticks % STATS_PERIOD == 0:
+            self.report()
+
+        return True
+
+    def welcome(self, s):
+        (sock, addr) = s.accept()
+        self.add_socket(sock, addr)
+        print("A new player has connected.")
+
+    # a new connection waits in the lobby
+    def add_socket(self, s, addr):
+        connection = Connection(s)
+        connection.uid = str(addr[0]) + ":" + str(addr[1])
+        self.selector.register(s, selectors.EVENT_READ, connection)
+        self.waiting[s] = (None, [])
+
+    # Keep the messages of a connection in the lobby until it joins a room
+    def wait(self, s, connection):
+        messages = connection.receive()
+        if messages is None:
+            del self.waiting[s]
+            self.selector.unregister(s)
+            s.close()
+            return
+        for (i, message) in enumerate(messages):
+            (name, received) = self.waiting[s]
+            if message.split()[:1] == ["STAT"]:
+                self.report_load(connection)
+                continue
+            if message.split()[:1] == ["ROOM"]:
+                # without a name, the first room that is not full
+                parts = message.split()
+                self.waiting[s] = (parts[1] if len(parts) > 1 else None, received)
+                continue
+            received.append(message)
+            if message.startswith("JOIN ") or message.startswith("JOSP ") or message.startswith("RESM "):
+                # the room handles what follows the join in the same batch
+                del self.waiting[s]
+                self.enter(s, connection, self.room(name), received + messages[i+1:])
+                return
+
+    # Room of a given name, or the first room that is not full, created if needed
+    def room(self, name = None):
+        if name is None:
+            name = next((room.name for room in self.rooms.values() if room.players() < self.size), None)
+        if name is None: name = "room{}".format(self.count)
+        if name not in self.rooms:
+            self.rooms[name] = Room(name, self.maps[self.count % len(self.maps)], self.interest, self.selector, self.totals)
+            self.count += 1
+            print("=> open room \"{}\"".format(name))
+        return self.rooms[name]
+
+    # STAT ticks messages bytes durations..., for all the rooms
+    def report_load(self, connection):
+        totals = self.totals
+        sent = totals.bytes + sum(room.server.stats.bytes for room in self.rooms.values())
+        durations = " ".join(str(count) for count in totals.durations)
+        connection.send("STAT {} {} {} {}".format(totals.ticks, totals.messages, sent, durations))
+        if not connection.flush():
+            print("Socket error: can't send data to client.")
+
+    # Hand a connection and the messages received in the lobby to a room
+    def enter(self, s, connection, room, received):
+        room.server.adopt(s, connection)
+        self.located[s] = room
+        start = time.perf_counter()
+        for message in received:
+            print("REC :", message)
+            if not room.server.handle_message(s, message): break
+        room.cost += time.perf_counter() - start
+        if s not in room.server.connections: del self.located[s]
+
+    # (room name, players, mean cost of a tick in ms) of each room since the last report
+    def costs(self):
+        return [ (room.name, room.players(), room.cost / max(1, room.ticks) * 1000) for room in self.rooms.values() ]
+
+    # Report the cost of the rooms from time to time
+    def report(self):
+        costs = self.costs()
+        if costs:
+            total = sum(cost for (_, _, cost) in costs)
+            (name, players, worst) = max(costs, key = lambda room: room[2])
+            print("=> rooms: {} rooms, {} players, {:.3f} ms per tick, slowest \"{}\" ({} players) {:.3f} ms".format(len(costs), sum(room[1] for room in costs), total, name, players, worst))
+        for room in self.rooms.values():
+            room.cost = 0
+            room.ticks = 0
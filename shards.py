@@ -0,0 +1,222 @@
+# -*- coding: Utf-8 -*
+
+from model import *
+from protocol import *
+from network import *
+from replication import *
+from engine import Engine
+import bisect
+import multiprocessing
+import random
+import selectors
+import socket
+
+################################################################################
+#                                SHARDED WORLD                                 #
+################################################################################
+
+# A large map is split in vertical strips (shards), each simulated by its own
+# worker process, with its own server socket on consecutive ports. A worker is
+# the authority for the objects lying in its strip, and mirrors those within
+# HALO tiles of a border to the neighbour across it, over a socket pair:
+#
+#   GHST <time> <record>...   changes of the mirrored records
+#
+# where <time> is the model time of the sender, and the records those of the
+# replication (see replication.py), with their deadlines shifted to the clock
+# of the receiver. The mirrored objects (ghosts) are simulated as the others,
+# so that a blast crossing a border hits the characters on both sides, and
+# they are overwritten by the changes their owner sends. When a character
+# crosses a border, it is handed over to the neighbour through the same link
+# (see NetworkServerController.hand_over), and its client follows it there.
+# Clients see the ghosts through the replication (protocol version 3);
+# clients that get the events only see their shard.
+
+### Constants ###
+
+HOST = "localhost" # address of the workers, given to the clients
+HALO = 16 # width of the strip mirrored to a neighbour (in tiles), at least MAX_RANGE
+FRUITS = 10 # fruits added to each shard
+SMOOTHING = 0.1 # weight of the last measure in the clock offset of a neighbour
+
+### Functions ###
+
+# position of a record of the state (see Model.state)
+def position(key, values):
+    return (values[2], values[3]) if key[0] == "C" else (key[1], key[2])
+
+### Class ShardServer ###
+
+class ShardServer(NetworkServerController):
+
+    # `bounds` are the left borders of the shards, then the width of the map,
+    # and `links` the sockets to the neighbours: index -> socket
+    def __init__(self, model, index, bounds, ports, links, interest = None):
+        super().__init__(model, ports[index], interest)
+        self.index = index
+        self.bounds = bounds
+        self.ports = ports
+        self.links = {} # socket -> neighbour
+        self.neighbours = {} # neighbour -> connection
+        for (neighbour, s) in links.items():
+            connection = Connection(s)
+            self.selector.register(s, selectors.EVENT_READ, connection)
+            self.links[s] = neighbour
+            self.neighbours[neighbour] = connection
+        self.mirrors = { neighbour: {} for neighbour in links } # records last mirrored to each neighbour
+        self.offsets = {} # neighbour -> our model time minus its own (in ms)
+        self.handoffs = 0
+
+    def owns(self, pos):
+        return self.bounds[self.index] <= pos[X] < self.bounds[self.index+1]
+
+    def shard_of(self, pos):
+        return min(max(bisect.bisect_right(self.bounds, pos[X]) - 1, 0), len(self.ports) - 1)
+
+    def random_position(self):
+        while True:
+            pos = self.model.map.random()
+            if self.owns(pos): return pos
+
+    def receive(self, s):
+        if s in self.links: self.receive_link(s)
+        else: super().receive(s)
+
+    def update(self):
+        state = self.model.state()
+        self.cross_borders(state)
+        super().update()
+        self.mirror(state)
+
+    def count_tick(self):
+        if self.stats.ticks + 1 == STATS_PERIOD:
+            print("=> shard {}: {} players, {} characters, {} handoffs".format(self.index, len(self.save_sock) - len(self.departed), len(self.model.characters), self.handoffs))
+            self.handoffs = 0
+        super().count_tick()
+
+    def destinations(self):
+        return [ (HOST, self.ports[neighbour]) for neighbour in self.neighbours ]
+
+    # Hand the characters that have crossed a border over to the neighbour
+    def cross_borders(self, state):
+        for (s, uid) in list(self.save_sock.items()):
+            key = ("C", self.nicks[uid])
+            if s in self.departed or key not in state: continue
+            pos = position(key, state[key])
+            neighbour = self.shard_of(pos)
+            if self.owns(pos) or neighbour not in self.neighbours: continue
+            self.hand_over(s, self.neighbours[neighbour], HOST, self.ports[neighbour])
+            self.handoffs += 1
+
+    # Send to each neighbour the changes of our records within HALO tiles of its border
+    def mirror(self, state):
+        (left, right) = (self.bounds[self.index], self.bounds[self.index+1])
+        for (neighbour, connection) in self.neighbours.items():
+            mirror = {}
+            for (key, values) in state.items():
+                pos = position(key, values)
+                if not self.owns(pos): continue
+                if (pos[X] < left + HALO) if neighbour < self.index else (pos[X] >= right - HALO):
+                    mirror[key] = values
+            changes = diff(self.mirrors[neighbour], mirror)
+            self.mirrors[neighbour] = mirror
+            records = []
+            size = 0
+            for (key, values) in changes.items():
+                record = encode_record(key, values)
+                if size + len(record) > PART_SIZE:
+                    connection.send("GHST {} {}".format(round(self.model.time), " ".join(records)))
+                    records = []
+                    size = 0
+                records.append(record)
+                size += len(record) + 1
+            if records: connection.send("GHST {} {}".format(round(self.model.time), " ".join(records)))
+            if not connection.flush():
+                print("Socket error: can't send data to shard {}.".format(neighbour))
+
+    def receive_link(self, s):
+        neighbour = self.links[s]
+        messages = self.neighbours[neighbour].receive()
+        if messages is None:
+            print("=> shard {} has left".format(neighbour))
+            self.selector.unregister(s)
+            del self.links[s]
+            del self.neighbours[neighbour]
+            del self.mirrors[neighbour]
+            s.close()
+            return
+        for message in messages:
+            if message.startswith("HAND "):
+                self.take_over(message)
+                continue
+            parts = message.split()
+            # the clocks of two shards may drift apart: their offset is
+            # measured on every ghosts, and smoothed, as it includes the transit
+            measured = round(self.model.time) - int(parts[1])
+            offset = self.offsets.get(neighbour, measured)
+            self.offsets[neighbour] = offset + SMOOTHING * (measured - offset)
+            offset = round(self.offsets[neighbour])
+            self.update_ghosts([ shift_record(*decode_record(record), offset) for record in parts[2:] ])
+
+    # Update the ghosts with the changes of their owners, excepted the
+    # characters that have crossed the border since
+    def update_ghosts(self, records):
+        changes = {}
+        for (key, values) in records:
+            if key[0] == "C":
+                character = self.model.look(key[1])
+                if character and self.owns(character.pos): continue
+            changes[key] = values
+        self.model.apply_state(changes)
+
+### Class ShardedWorld ###
+
+# Start the workers of a map split in `count` shards, on ports `port` to
+# `port+count-1`.
+
+class ShardedWorld:
+
+    def __init__(self, port, map_file, count, interest = None):
+        m = open_map(map_file)
+        self.map_file = map_file
+        self.interest = interest
+        self.ports = [ port + i for i in range(count) ]
+        self.bounds = [ i * m.width // count for i in range(count) ] + [ m.width ]
+        # a socket pair between each pair of neighbours: index -> neighbour -> socket
+        self.links = [ {} for _ in range(count) ]
+        for i in range(count - 1):
+            (a, b) = socket.socketpair()
+            self.links[i][i+1] = a
+            self.links[i+1][i] = b
+        self.processes = []
+
+    def start(self):
+        for index in range(len(self.ports)):
+            process = multiprocessing.Process(target = self.run_shard, args = (index,), daemon = True)
+            process.start()
+            self.processes.append(process)
+        # the workers have their own copies of the sockets
+        for links in self.links:
+            for s in links.values(): s.close()
+
+    # body of a worker
+    def run_shard(self, index):
+        for (i, links) in enumerate(self.links):
+            if i == index: continue
+            for s in links.values(): s.close()
+        random.seed() # don't share the random sequence of the parent
+        model = Model()
+        model.load_map(self.map_file)
+        server = ShardServer(model, index, self.bounds, self.ports, self.links[index], self.interest)
+        for _ in range(FRUITS): model.add_fruit(pos = server.random_position())
+        print("=> shard {} on port {}: columns {} to {}".format(index, self.ports[index], self.bounds[index], self.bounds[index+1]-1))
+        Engine(model, controllers = [server]).run()
+
+    def run(self):
+        self.start()
+        for process in self.processes: process.join()
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
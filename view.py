@@ -2,6 +2,7 @@
 # Author: aurelien.esnard@u-bordeaux.fr
 
 from model import *
+import os
 import pygame
 
 ################################################################################
@@ -10,12 +11,17 @@ import pygame
 
 ### Constants ###
 
-FPS = 60
 WIN_TITLE = "Bomber Man"
 SPRITE_SIZE = 30 # 30x30 pixels
 YELLOW = (255, 255, 0)
 BLUE = (0, 0, 255)
 RED = (255, 0, 0)
+BLACK = (0, 0, 0)
+GLYPH_CACHE = 256 # max number of rendered texts kept by the view
+VIEW_WIDTH = 32 # max width of the window (in tiles), larger maps scroll
+VIEW_HEIGHT = 24 # max height of the window (in tiles)
+ATLAS_WIDTH = 8 # sprites per row of the atlas
+ATLAS_CACHE = "images/atlas.cache" # raw copy of the atlas, None to always build it from the images
 
 ### Sprites ###
 
@@ -29,6 +35,80 @@ SPRITE_FRUITS = [ "images/misc/banana.png", "images/misc/cherry.png" ]
 SPRITE_DK = [ "images/dk/left.png", "images/dk/right.png", "images/dk/up.png", "images/dk/down.png" ]
 SPRITE_LINK = [ "images/link/left.png", "images/link/right.png", "images/link/up.png", "images/link/down.png" ]
 SPRITE_BATMAN = [ "images/batman/left.png", "images/batman/right.png", "images/batman/up.png", "images/batman/down.png" ]
+SPRITES = SPRITE_BACKGROUNDS + [ SPRITE_BLANK, SPRITE_HEART ] + SPRITE_WALLS + [ SPRITE_BOMB, SPRITE_FIRE ] + SPRITE_FRUITS + SPRITE_DK + SPRITE_LINK + SPRITE_BATMAN
+
+### Class Atlas ###
+
+# All the sprites packed in a single surface, built once per process (see
+# load_atlas) from the images, or from a raw copy saved in `ATLAS_CACHE`, which
+# is rebuilt when an image is more recent. The cache starts with a line
+# "ATLAS <width> <height> <count>", then a line "<x> <y> <w> <h> <path>" per
+# sprite, then the RGBA pixels.
+
+class Atlas:
+
+    def __init__(self, paths = SPRITES, cache = ATLAS_CACHE):
+        self.rects = {} # path -> rectangle of the sprite in the atlas
+        self.sheet = None
+        if not (cache and self.load(paths, cache)):
+            self.build(paths)
+            if cache: self.save(cache)
+        # the same pixels, with and without transparency (needs a display mode)
+        self.alpha = self.sheet.convert_alpha()
+        self.opaque = self.sheet.convert()
+
+    # pack the images in rows of ATLAS_WIDTH sprites
+    def build(self, paths):
+        images = [ pygame.image.load(path).convert_alpha() for path in paths ]
+        width = SPRITE_SIZE*ATLAS_WIDTH
+        height = SPRITE_SIZE*((len(images) + ATLAS_WIDTH - 1) // ATLAS_WIDTH)
+        self.sheet = pygame.Surface((width, height), pygame.SRCALPHA)
+        for (i, (path, image)) in enumerate(zip(paths, images)):
+            rect = pygame.Rect(((i % ATLAS_WIDTH)*SPRITE_SIZE, (i // ATLAS_WIDTH)*SPRITE_SIZE), image.get_size())
+            # copy the pixels as they are, transparency included
+            self.sheet.blit(image, rect, special_flags = pygame.BLEND_RGBA_MAX)
+            self.rects[path] = rect
+
+    # read the cache, return False if it is missing or out of date
+    def load(self, paths, cache):
+        try:
+            if any(os.path.getmtime(path) > os.path.getmtime(cache) for path in paths): return False
+            with open(cache, "rb") as _file:
+                (magic, width, height, count) = _file.readline().split()
+                rects = {}
+                for _ in range(int(count)):
+                    (x, y, w, h, path) = _file.readline().decode().split()
+                    rects[path] = pygame.Rect(int(x), int(y), int(w), int(h))
+                pixels = _file.read()
+            if magic != b"ATLAS" or set(rects) != set(paths): return False
+            self.sheet = pygame.image.fromstring(pixels, (int(width), int(height)), "RGBA")
+        except (OSError, ValueError):
+            return False
+        self.rects = rects
+        return True
+
+    def save(self, cache):
+        try:
+            with open(cache + ".tmp", "wb") as _file:
+                _file.write("ATLAS {} {} {}\n".format(self.sheet.get_width(), self.sheet.get_height(), len(self.rects)).encode())
+                for (path, rect) in self.rects.items():
+                    _file.write("{} {} {} {} {}\n".format(rect.x, rect.y, rect.w, rect.h, path).encode())
+                _file.write(pygame.image.tostring(self.sheet, "RGBA"))
+            os.replace(cache + ".tmp", cache)
+        except OSError:
+            print("Warning: can't save the sprite atlas in \"{}\"".format(cache))
+
+    # sprite of an image, as a subsurface of the atlas
+    def get(self, path, alpha = True):
+        return (self.alpha if alpha else self.opaque).subsurface(self.rects[path])
+
+# atlas shared by the views
+atlas = None
+
+def load_atlas():
+    global atlas
+    if atlas is None: atlas = Atlas(SPRITES, ATLAS_CACHE)
+    return atlas
 
 ### Class PyGameView ###
 
@@ -37,22 +117,26 @@ class GraphicView:
     # initialize PyGame graphic view
     def __init__(self, model, playername = ""):
         self.model = model
-        self.width = model.map.width*SPRITE_SIZE
-        self.height = model.map.height*SPRITE_SIZE
+        (self.width, self.height) = self.size(model.map)
         # create window
         self.win = pygame.display.set_mode((self.width, self.height))
-        # load sprites
-        self.sprite_walls = [ pygame.image.load(sprite).convert() for sprite in SPRITE_WALLS ]
-        self.sprite_backgrounds = [ pygame.image.load(sprite).convert() for sprite in SPRITE_BACKGROUNDS ]
-        self.sprite_blank = pygame.image.load(SPRITE_BLANK).convert()
-        self.sprite_heart = pygame.image.load(SPRITE_HEART).convert_alpha()
-        self.sprite_fruits = [ pygame.image.load(sprite).convert_alpha() for sprite in SPRITE_FRUITS ]
-        self.sprite_bomb = pygame.image.load(SPRITE_BOMB).convert_alpha()
-        self.sprite_fire = pygame.image.load(SPRITE_FIRE).convert_alpha()
-        sprite_dk = [ pygame.image.load(sprite).convert_alpha() for sprite in SPRITE_DK ]
-        sprite_link = [ pygame.image.load(sprite).convert_alpha() for sprite in SPRITE_LINK ]
-        sprite_batman = [ pygame.image.load(sprite).convert_alpha() for sprite in SPRITE_BATMAN ]
+        # load sprites (from the atlas)
+        atlas = load_atlas()
+        self.sprite_walls = [ atlas.get(sprite, False) for sprite in SPRITE_WALLS ]
+        self.sprite_backgrounds = [ atlas.get(sprite, False) for sprite in SPRITE_BACKGROUNDS ]
+        self.sprite_blank = atlas.get(SPRITE_BLANK, False)
+        self.sprite_heart = atlas.get(SPRITE_HEART)
+        self.sprite_fruits = [ atlas.get(sprite) for sprite in SPRITE_FRUITS ]
+        self.sprite_bomb = atlas.get(SPRITE_BOMB)
+        self.sprite_fire = atlas.get(SPRITE_FIRE)
+        sprite_dk = [ atlas.get(sprite) for sprite in SPRITE_DK ]
+        sprite_link = [ atlas.get(sprite) for sprite in SPRITE_LINK ]
+        sprite_batman = [ atlas.get(sprite) for sprite in SPRITE_BATMAN ]
         self.sprite_characters = [sprite_dk, sprite_link, sprite_batman]
+        # sprite of each tile byte, blank if missing
+        self.sprite_tiles = { ord('w'): self.sprite_walls[0], ord('x'): self.sprite_walls[1], ord('z'): self.sprite_walls[2],
+                              ord('0'): self.sprite_backgrounds[0], ord('1'): self.sprite_backgrounds[1],
+                              ord('2'): self.sprite_backgrounds[2], ord('3'): self.sprite_backgrounds[3] }
         # init view
         pygame.font.init()
         pygame.display.set_icon(self.sprite_bomb)
@@ -60,96 +144,185 @@ class GraphicView:
         if playername: title = WIN_TITLE + " (" + playername + ")"
         pygame.display.set_caption(title)
         self.font = pygame.font.SysFont('Consolas', 20)
+        # rendered texts, by (text, color, antialias), least recently used first
+        self.glyphs = {}
+        self.glyph_hits = 0
+        self.glyph_misses = 0
+        # the bomb countdowns are rendered beforehand
+        for countdown in range(COUNTDOWN + 1): self.render_text(str(countdown), True, YELLOW)
+        # visible part of the map rendered once (see render_map), top left
+        # tile of this part (see camera), and drawing of each tile at the last
+        # frame (see layout)
+        self.background = None
+        self.map = None
+        self.version = None
+        self.origin = None
+        self.scene = {}
 
-    # render map view
-    def render_map(self, m):
-        # win.blit(self.background, (0, 0))
-        for y in range(0, m.height):
-            for x in range(0, m.width):
-                square = m.array[y][x]
-                x0 = x*SPRITE_SIZE
-                y0 = y*SPRITE_SIZE
-                # walls
-                if square == 'w':
-                    self.win.blit(self.sprite_walls[0], (x0, y0))
-                elif square == 'x':
-                    self.win.blit(self.sprite_walls[1], (x0, y0))
-                elif square == 'z':
-                    self.win.blit(self.sprite_walls[2], (x0, y0))
-                # backgrounds
-                elif square == '0':
-                    self.win.blit(self.sprite_backgrounds[0], (x0, y0))
-                elif square == '1':
-                    self.win.blit(self.sprite_backgrounds[1], (x0, y0))
-                elif square == '2':
-                    self.win.blit(self.sprite_backgrounds[2], (x0, y0))
-                elif square == '3':
-                    self.win.blit(self.sprite_backgrounds[3], (x0, y0))
-                else:
-                    self.win.blit(self.sprite_blank, (x0, y0)) # blank
+    # size of the window for a map (in pixels)
+    def size(self, m):
+        return (min(m.width, VIEW_WIDTH)*SPRITE_SIZE, min(m.height, VIEW_HEIGHT)*SPRITE_SIZE)
+
+    # top left tile of the visible part of the map, centered on the player
+    # when the map is larger than the window
+    def camera(self, m):
+        player = self.model.player
+        if not player: return (0, 0)
+        columns = self.width // SPRITE_SIZE
+        rows = self.height // SPRITE_SIZE
+        x = min(max(0, player.pos[X] - columns // 2), m.width - columns)
+        y = min(max(0, player.pos[Y] - rows // 2), m.height - rows)
+        return (x, y)
+
+    # position of a tile in the window (in pixels)
+    def screen(self, pos):
+        return ((pos[X] - self.origin[X])*SPRITE_SIZE, (pos[Y] - self.origin[Y])*SPRITE_SIZE)
+
+    # render the visible part of the map once into the background, and the
+    # whole window from it
+    def render_map(self, m, origin):
+        self.background = pygame.Surface((self.width, self.height)).convert()
+        (x0, y0) = origin
+        m.page_in(x0, y0, x0 + self.width // SPRITE_SIZE, y0 + self.height // SPRITE_SIZE)
+        for y in range(0, self.height // SPRITE_SIZE):
+            i = (y0 + y)*m.width + x0
+            for x in range(0, self.width // SPRITE_SIZE):
+                sprite = self.sprite_tiles.get(m.tiles[i], self.sprite_blank)
+                self.background.blit(sprite, (x*SPRITE_SIZE, y*SPRITE_SIZE))
+                i += 1
+        self.map = m
+        self.version = m.version
+        self.origin = origin
+        self.win.blit(self.background, (0, 0))
+
+    # surface of a text, rendered once and kept in a bounded cache
+    def render_text(self, text, antialias, color):
+        key = (text, color, antialias)
+        surface = self.glyphs.pop(key, None)
+        if surface is None:
+            self.glyph_misses += 1
+            surface = self.font.render(text, antialias, color)
+            if len(self.glyphs) >= GLYPH_CACHE: del self.glyphs[next(iter(self.glyphs))]
+        else:
+            self.glyph_hits += 1
+        self.glyphs[key] = surface
+        return surface
 
     # render fruit view
-    def render_fruit(self, fruit):
-        x = fruit.pos[X] * SPRITE_SIZE
-        y = fruit.pos[Y] * SPRITE_SIZE
-        self.win.blit(self.sprite_fruits[fruit.kind], (x, y))
-
-    def render_bomb_explosion(self, bomb):
-        x0 = bomb.pos[X]
-        y0 = bomb.pos[Y]
-        for x in range(bomb.range[DIRECTION_LEFT], bomb.range[DIRECTION_RIGHT]+1):
-            self.win.blit(self.sprite_fire, (x*SPRITE_SIZE, y0*SPRITE_SIZE))
-        for y in range(bomb.range[DIRECTION_UP], bomb.range[DIRECTION_DOWN]+1):
-            self.win.blit(self.sprite_fire, (x0*SPRITE_SIZE, y*SPRITE_SIZE))
-
-    def render_bomb_drop(self, bomb):
-        x = bomb.pos[X] * SPRITE_SIZE
-        y = bomb.pos[Y] * SPRITE_SIZE
+    def render_fruit(self, pos, kind):
+        self.win.blit(self.sprite_fruits[kind], self.screen(pos))
+
+    def render_fire(self, pos):
+        self.win.blit(self.sprite_fire, self.screen(pos))
+
+    def render_bomb(self, pos, countdown):
+        (x, y) = self.screen(pos)
         self.win.blit(self.sprite_bomb, (x, y))
         x0 = x + SPRITE_SIZE/2
         y0 = y + SPRITE_SIZE/2
-        text = self.font.render(str(bomb.countdown), True, YELLOW)
+        text = self.render_text(str(countdown), True, YELLOW)
         rect = text.get_rect(center=(x0-5,y0+5))
         self.win.blit(text, rect)
 
-    def render_bomb(self, bomb):
-        if(bomb.countdown == 0):
-            self.render_bomb_explosion(bomb)
-        elif(bomb.countdown > 0):
-            self.render_bomb_drop(bomb)
-
-    def render_character(self, character):
-        x = character.pos[X] * SPRITE_SIZE
-        y = character.pos[Y] * SPRITE_SIZE
-        sprite = self.sprite_characters[character.kind][character.direction]
-        self.win.blit(sprite, (x, y))
-
-    def render_player(self, player):
-        if not player: return
-        x = player.pos[X] * SPRITE_SIZE
-        y = player.pos[Y] * SPRITE_SIZE
+    def render_character(self, pos, kind, direction):
+        sprite = self.sprite_characters[kind][direction]
+        self.win.blit(sprite, self.screen(pos))
+
+    def render_player(self, pos):
+        (x, y) = self.screen(pos)
         pygame.draw.rect(self.win, RED, (x, y, SPRITE_SIZE, SPRITE_SIZE), 1)
 
-    def render_life(self, player):
+    def render_life(self, pos, health):
         x = 3
         y = 3
-        health_text = self.font.render(str(player.health), False, (0, 0, 0))
+        health_text = self.render_text(str(health), False, BLACK)
         self.win.blit(self.sprite_heart, (x, y))
         self.win.blit(health_text, (x+35, y+5))
 
-    # render PyGame graphic view at each clock tick
+    # objects of an occupancy index between tiles (x0,y0) and (x1,y1) excluded;
+    # the objects sharing a tile come in the order they arrived on it
+    def lookup(self, occupancy, x0, y0, x1, y1):
+        found = []
+        tiles = occupancy.tiles
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                objs = tiles.get((x, y))
+                if objs: found += objs
+        return found
+
+    # what is drawn on each visible tile, in drawing order: (x,y) -> [ (render
+    # method, args...) ]; objects are looked up in the occupancy indexes of
+    # the map, tile by tile, so that the cost does not depend on the size of
+    # the map nor on the number of objects out of sight
+    def layout(self):
+        m = self.model.map
+        (x0, y0) = self.origin
+        x1 = x0 + self.width // SPRITE_SIZE
+        y1 = y0 + self.height // SPRITE_SIZE
+        scene = {}
+        def add(pos, item):
+            if x0 <= pos[X] < x1 and y0 <= pos[Y] < y1: scene.setdefault(pos, []).append(item)
+        # bombs, including the ones out of sight whose blast reaches the
+        # visible tiles, the fire being drawn under the bombs still counting
+        bombs = self.lookup(m.bombs_at, max(0, x0 - MAX_RANGE), max(0, y0 - MAX_RANGE),
+                            min(m.width, x1 + MAX_RANGE), min(m.height, y1 + MAX_RANGE))
+        for bomb in bombs:
+            if(bomb.countdown == 0):
+                for x in range(bomb.range[DIRECTION_LEFT], bomb.range[DIRECTION_RIGHT]+1):
+                    add((x, bomb.pos[Y]), (self.render_fire,))
+                for y in range(bomb.range[DIRECTION_UP], bomb.range[DIRECTION_DOWN]+1):
+                    add((bomb.pos[X], y), (self.render_fire,))
+        for bomb in bombs:
+            if(bomb.countdown > 0):
+                add(bomb.pos, (self.render_bomb, bomb.countdown))
+        for fruit in self.lookup(m.fruits_at, x0, y0, x1, y1):
+            add(fruit.pos, (self.render_fruit, fruit.kind))
+        for character in self.lookup(m.characters_at, x0, y0, x1, y1):
+            add(character.pos, (self.render_character, character.kind, character.direction))
+        player = self.model.player
+        if player:
+            add(player.pos, (self.render_player,))
+            # the life is drawn over the tiles in the top left corner of the window
+            (width, height) = self.font.size(str(player.health))
+            right = max(3 + self.sprite_heart.get_width(), 3 + 35 + width)
+            bottom = max(3 + self.sprite_heart.get_height(), 3 + 5 + height)
+            for x in range(x0, min(x1, x0 + (right - 1)//SPRITE_SIZE + 1)):
+                for y in range(y0, min(y1, y0 + (bottom - 1)//SPRITE_SIZE + 1)):
+                    add((x, y), (self.render_life, player.health))
+        return scene
+
+    # redraw a tile from the background, return its rectangle
+    def render_tile(self, pos, items):
+        rect = pygame.Rect(self.screen(pos), (SPRITE_SIZE, SPRITE_SIZE))
+        self.win.set_clip(rect)
+        self.win.blit(self.background, rect, rect)
+        for item in items:
+            item[0](pos, *item[1:])
+        self.win.set_clip(None)
+        return rect
+
+    # render PyGame graphic view at each clock tick: only the tiles whose
+    # drawing has changed since the last frame are redrawn and updated,
+    # unless the camera has moved
     def tick(self, dt):
-        self.render_map(self.model.map)
-        for bomb in self.model.bombs:
-            self.render_bomb(bomb)
-        for fruit in self.model.fruits:
-            self.render_fruit(fruit)
-        for character in self.model.characters:
-            self.render_character(character)
-        if(self.width != self.model.map.width*SPRITE_SIZE or self.height != self.model.map.height*SPRITE_SIZE):
-            self.width = self.model.map.width*SPRITE_SIZE
-            self.height = self.model.map.height*SPRITE_SIZE
+        m = self.model.map
+        if (self.width, self.height) != self.size(m):
+            (self.width, self.height) = self.size(m)
             self.win = pygame.display.set_mode((self.width, self.height))
-        self.render_player(self.model.player)
-        self.render_life(self.model.player)
-        pygame.display.flip()
+            self.background = None
+        origin = self.camera(m)
+        if self.background is None or m is not self.map or m.version != self.version or origin != self.origin:
+            self.render_map(m, origin)
+            scene = self.layout()
+            for (pos, items) in scene.items():
+                self.render_tile(pos, items)
+            pygame.display.flip()
+        else:
+            scene = self.layout()
+            rects = []
+            for pos in self.scene.keys() | scene.keys():
+                items = scene.get(pos, [])
+                if items != self.scene.get(pos, []):
+                    rects.append(self.render_tile(pos, items))
+            if rects: pygame.display.update(rects)
+        self.scene = scene